@@ -4,6 +4,7 @@ from dotenv import load_dotenv
 from functools import lru_cache
 from typing import Optional
 
+import httpx
 from langchain_openai import ChatOpenAI
 
 load_dotenv()
@@ -22,10 +23,103 @@ class Settings:
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
     DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"
+    # Для async-движка; если пусто — выводится из DATABASE_URL (sqlite -> aiosqlite)
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+
+    # Redis (или совместимый сервер) для общих кешей; нужен только при *_BACKEND=redis
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+    # Кеш истории диалогов: memory | redis | none
+    HISTORY_CACHE_BACKEND: str = os.getenv("HISTORY_CACHE_BACKEND", "memory")
+    HISTORY_CACHE_MAX_DIALOGS: int = int(os.getenv("HISTORY_CACHE_MAX_DIALOGS", "1000"))
+    HISTORY_CACHE_MAX_MESSAGES: int = int(os.getenv("HISTORY_CACHE_MAX_MESSAGES", "200"))
+    HISTORY_CACHE_TTL: int = int(os.getenv("HISTORY_CACHE_TTL", "3600"))
+
+    # Конфигурация текстового поиска Postgres (simple — без стемминга, годится для смеси языков)
+    SEARCH_TS_CONFIG: str = os.getenv("SEARCH_TS_CONFIG", "simple")
+
+    # Сколько секунд кешировать статистику админки
+    STATS_TTL_SECONDS: int = int(os.getenv("STATS_TTL_SECONDS", "30"))
+
+    # Кеш принципала (id/is_admin/is_active/is_blocked) для проверки токена: memory | redis | none
+    PRINCIPAL_CACHE_BACKEND: str = os.getenv("PRINCIPAL_CACHE_BACKEND", "memory")
+    PRINCIPAL_CACHE_TTL: int = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+    PRINCIPAL_CACHE_MAX: int = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+
+    # Кеш системных промптов персонажей для чата: memory | redis | none
+    PROMPT_CACHE_BACKEND: str = os.getenv("PROMPT_CACHE_BACKEND", "memory")
+    PROMPT_CACHE_TTL: int = int(os.getenv("PROMPT_CACHE_TTL", "300"))
+    PROMPT_CACHE_MAX: int = int(os.getenv("PROMPT_CACHE_MAX", "5000"))
+
+    # Загрузка фото: каталог и его URL, каталог для недокачанных файлов (вне /static,
+    # лучше на той же ФС, что UPLOAD_DIR), лимит размера, размер куска при копировании,
+    # стороны уменьшенных копий (через запятую) и какая из них идёт в карточки
+    UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "static/uploads")
+    UPLOAD_URL: str = os.getenv("UPLOAD_URL", "/static/uploads").rstrip("/")
+    UPLOAD_TMP_DIR: str = os.getenv("UPLOAD_TMP_DIR", "uploads-tmp")
+    UPLOAD_MAX_BYTES: int = int(os.getenv("UPLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+    UPLOAD_CHUNK_BYTES: int = int(os.getenv("UPLOAD_CHUNK_BYTES", str(64 * 1024)))
+    UPLOAD_THUMB_SIZES = [int(x) for x in os.getenv("UPLOAD_THUMB_SIZES", "96,320").split(",") if x]
+    UPLOAD_CARD_THUMB_SIZE: int = int(os.getenv("UPLOAD_CARD_THUMB_SIZE", "320"))
+    UPLOAD_THUMB_WORKERS: int = int(os.getenv("UPLOAD_THUMB_WORKERS", "2"))
+
+    # Раздача /static: max-age для файлов с именем по хешу (immutable) и для остальных;
+    # MEDIA_ACCEL_REDIRECT — internal-локация nginx для X-Accel-Redirect (пусто — отдаёт бэкенд)
+    MEDIA_MAX_AGE: int = int(os.getenv("MEDIA_MAX_AGE", str(365 * 24 * 3600)))
+    MEDIA_MUTABLE_MAX_AGE: int = int(os.getenv("MEDIA_MUTABLE_MAX_AGE", "300"))
+    MEDIA_ACCEL_REDIRECT: str = os.getenv("MEDIA_ACCEL_REDIRECT", "")
+
+    # Условные GET персонажей: сколько секунд держать готовый публичный список
+    # для анонимов (он же max-age в Cache-Control)
+    HTTP_PUBLIC_LIST_TTL: int = int(os.getenv("HTTP_PUBLIC_LIST_TTL", "5"))
+
+    # Выгрузка/загрузка диалогов (utils/dialog_transfer.py): строк на выборку серверного курсора
+    # и строк на пачку вставки
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    IMPORT_BATCH_SIZE: int = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+
+    # Голоса: write-behind копит дельты счётчиков и сбрасывает их раз в VOTE_FLUSH_INTERVAL сек;
+    # VOTE_RECONCILE_INTERVAL > 0 — периодическая сверка счётчиков с CharacterVote (сек)
+    VOTE_WRITE_BEHIND: bool = os.getenv("VOTE_WRITE_BEHIND", "false").lower() == "true"
+    VOTE_FLUSH_INTERVAL: float = float(os.getenv("VOTE_FLUSH_INTERVAL", "2"))
+    VOTE_RECONCILE_INTERVAL: int = int(os.getenv("VOTE_RECONCILE_INTERVAL", "0"))
+
+    # Почта: console — печать в консоль, smtp — отправка через SMTP_HOST:SMTP_PORT
+    EMAIL_BACKEND: str = os.getenv("EMAIL_BACKEND", "console")
+    EMAIL_FROM: str = os.getenv("EMAIL_FROM", "no-reply@example.com")
+    SMTP_HOST: str = os.getenv("SMTP_HOST", "localhost")
+    SMTP_PORT: int = int(os.getenv("SMTP_PORT", "1025"))
+    SMTP_USERNAME: str = os.getenv("SMTP_USERNAME", "")
+    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
+    SMTP_TLS: bool = os.getenv("SMTP_TLS", "false").lower() == "true"
+    SMTP_TIMEOUT: float = float(os.getenv("SMTP_TIMEOUT", "10"))
+    # Соединение закрывается после стольких секунд простоя
+    SMTP_IDLE_TIMEOUT: float = float(os.getenv("SMTP_IDLE_TIMEOUT", "60"))
+    # Очередь отправки: воркеры (по соединению на каждый), размер пачки, повторы
+    EMAIL_WORKERS: int = int(os.getenv("EMAIL_WORKERS", "2"))
+    EMAIL_QUEUE_SIZE: int = int(os.getenv("EMAIL_QUEUE_SIZE", "10000"))
+    EMAIL_BATCH_SIZE: int = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+    EMAIL_MAX_RETRIES: int = int(os.getenv("EMAIL_MAX_RETRIES", "5"))
+    EMAIL_RETRY_BASE: float = float(os.getenv("EMAIL_RETRY_BASE", "2"))
+
+    # Пароли: схема хеша (pbkdf2_sha256 | scrypt) и её стоимость. При смене
+    # параметров старые хеши пересчитываются при следующем входе пользователя
+    PASSWORD_SCHEME: str = os.getenv("PASSWORD_SCHEME", "pbkdf2_sha256")
+    PASSWORD_PBKDF2_ITERATIONS: int = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "100000"))
+    PASSWORD_SCRYPT_N: int = int(os.getenv("PASSWORD_SCRYPT_N", "16384"))
+    PASSWORD_SCRYPT_R: int = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+    PASSWORD_SCRYPT_P: int = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+    # Пул процессов для хеширования (0 — в потоке, без отдельных процессов),
+    # максимум одновременных задач (0 — по числу процессов) и таймаут ожидания в очереди
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_CONCURRENCY: int = int(os.getenv("PASSWORD_HASH_CONCURRENCY", "0"))
+    PASSWORD_HASH_QUEUE_TIMEOUT: float = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "10"))
 
     # JWT
     JWT_SECRET: str = os.getenv("JWT_SECRET", "change-me")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+    # Сколько уже проверенных токенов держать в памяти (0 — не кешировать)
+    TOKEN_CACHE_MAX: int = int(os.getenv("TOKEN_CACHE_MAX", "10000"))
 
     # Маппинг имён моделей
     MODEL_NAMES = {
@@ -34,6 +128,73 @@ class Settings:
         'pro_32k': 'yandexgpt-32k',
     }
 
+    # Размер контекстного окна моделей (в токенах), ключи как в MODEL_NAMES
+    MODEL_CONTEXT_TOKENS = {
+        'lite': int(os.getenv("CONTEXT_TOKENS_LITE", "8000")),
+        'pro': int(os.getenv("CONTEXT_TOKENS_PRO", "8000")),
+        'pro_32k': int(os.getenv("CONTEXT_TOKENS_PRO_32K", "32000")),
+    }
+    # Сколько токенов оставляем под ответ модели
+    RESPONSE_RESERVE_TOKENS: int = int(os.getenv("RESPONSE_RESERVE_TOKENS", "1500"))
+    # Грубая оценка: символов на токен (для русского текста у YandexGPT ~3)
+    CHARS_PER_TOKEN: float = float(os.getenv("CHARS_PER_TOKEN", "3"))
+
+    # Шлюз к LLM: максимум одновременных запросов на модель (ключи как в MODEL_NAMES),
+    # длина очереди ожидания (дальше — сразу 503) и сколько секунд ждать слота
+    LLM_MAX_IN_FLIGHT = {
+        'lite': int(os.getenv("LLM_MAX_IN_FLIGHT_LITE", "16")),
+        'pro': int(os.getenv("LLM_MAX_IN_FLIGHT_PRO", "8")),
+        'pro_32k': int(os.getenv("LLM_MAX_IN_FLIGHT_PRO_32K", "4")),
+    }
+    LLM_MAX_QUEUE: int = int(os.getenv("LLM_MAX_QUEUE", "100"))
+    LLM_QUEUE_TIMEOUT: float = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+    # Общий пул HTTP-соединений к API для всех моделей
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "64"))
+    LLM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "32"))
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+    # Устойчивость вызовов LLM: дедлайн попытки и всего вызова (сек), пауза между
+    # кусками стрима, число повторов и база экспоненциальной задержки
+    LLM_ATTEMPT_TIMEOUT: float = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "30"))
+    LLM_TOTAL_TIMEOUT: float = float(os.getenv("LLM_TOTAL_TIMEOUT", "90"))
+    LLM_STREAM_IDLE_TIMEOUT: float = float(os.getenv("LLM_STREAM_IDLE_TIMEOUT", "30"))
+    LLM_RETRIES: int = int(os.getenv("LLM_RETRIES", "2"))
+    LLM_RETRY_BACKOFF: float = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+    LLM_RETRY_BACKOFF_MAX: float = float(os.getenv("LLM_RETRY_BACKOFF_MAX", "5"))
+    # Автомат отключения модели: ошибок подряд и сколько секунд модель не вызывается
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_RESET: float = float(os.getenv("LLM_BREAKER_RESET", "30"))
+    # Запасные модели (через запятую, по порядку) для каждой модели из MODEL_NAMES
+    LLM_FALLBACKS = {
+        'pro_32k': [m for m in os.getenv("LLM_FALLBACK_PRO_32K", "pro,lite").split(",") if m],
+        'pro': [m for m in os.getenv("LLM_FALLBACK_PRO", "lite").split(",") if m],
+        'lite': [m for m in os.getenv("LLM_FALLBACK_LITE", "").split(",") if m],
+    }
+
+    # Кеш ответов LLM: none | sqlite | redis. Действует для температур не выше
+    # COMPLETION_CACHE_MAX_TEMPERATURE и персонажей из списка id через запятую (пусто — для всех)
+    COMPLETION_CACHE_BACKEND: str = os.getenv("COMPLETION_CACHE_BACKEND", "none")
+    COMPLETION_CACHE_PATH: str = os.getenv("COMPLETION_CACHE_PATH", "./completion_cache.db")
+    COMPLETION_CACHE_TTL: int = int(os.getenv("COMPLETION_CACHE_TTL", "86400"))
+    COMPLETION_CACHE_MAX_ENTRIES: int = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "10000"))
+    COMPLETION_CACHE_MAX_TEMPERATURE: float = float(os.getenv("COMPLETION_CACHE_MAX_TEMPERATURE", "0.3"))
+    COMPLETION_CACHE_CHARACTERS: str = os.getenv("COMPLETION_CACHE_CHARACTERS", "")
+
+    # Сводки длинных диалогов: сворачиваем старые реплики, когда несвёрнутых
+    # набирается SUMMARY_TRIGGER_MESSAGES; последние SUMMARY_KEEP_RECENT не трогаем
+    SUMMARY_ENABLED: bool = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+    SUMMARY_TRIGGER_MESSAGES: int = int(os.getenv("SUMMARY_TRIGGER_MESSAGES", "40"))
+    SUMMARY_KEEP_RECENT: int = int(os.getenv("SUMMARY_KEEP_RECENT", "20"))
+    SUMMARY_MODEL_ID: str = os.getenv("SUMMARY_MODEL_ID", "lite")
+    # Через сколько секунд захват прохода (упавшего воркера) считается брошенным
+    SUMMARY_CLAIM_TTL: int = int(os.getenv("SUMMARY_CLAIM_TTL", "300"))
+
+    def context_budget(self, model_id: str) -> int:
+        """
+        Бюджет токенов на промпт: окно модели минус резерв под ответ.
+        """
+        return max(self.MODEL_CONTEXT_TOKENS[model_id] - self.RESPONSE_RESERVE_TOKENS, 0)
+
     def model_name(self, model_id: str) -> str:
         """
         gpt://<folder>/<model>/latest — формат для Yandex Cloud
@@ -41,9 +202,16 @@ class Settings:
         return f"gpt://{self.FOLDER_ID}/{self.MODEL_NAMES[model_id]}/latest"
 
     @lru_cache()
-    def create_yandex_model(self, model_id: str = "lite", temperature: Optional[float] = None) -> ChatOpenAI:
+    def create_yandex_model(
+        self,
+        model_id: str = "lite",
+        temperature: Optional[float] = None,
+        http_client: Optional[httpx.Client] = None,
+        http_async_client: Optional[httpx.AsyncClient] = None,
+    ) -> ChatOpenAI:
         """
-        Создаёт (и кеширует) клиент YandexGPT через langchain_openai
+        Создаёт (и кеширует) клиент YandexGPT через langchain_openai.
+        http_client/http_async_client — общие пулы соединений (utils/llm_gateway.py)
         """
         if temperature is None:
             temperature = self.TEMPERATURE
@@ -53,6 +221,10 @@ class Settings:
             base_url=self.BASE_URL,
             model=self.model_name(model_id),
             temperature=temperature,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            # Повторы и таймауты попыток — в utils/llm_resilience.py
+            max_retries=0,
         )
         return llm
 
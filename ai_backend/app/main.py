@@ -1,10 +1,18 @@
 # app/main.py
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
-from utils.db import create_db_and_tables
+from utils.db import create_db_and_tables, async_engine
+from utils.cache import close_redis
+from utils.search import setup_search_index
+from utils.votes import run_vote_jobs, vote_buffer
+from utils.email import outbox
+from utils.security import shutdown_password_pool
+from utils.llm_gateway import close_http_clients
+from utils.uploads import shutdown_thumbnail_pool
+from utils.media import MediaFiles
 from routers import auth, characters, dialogs, admin
 
 from prometheus_fastapi_instrumentator import Instrumentator
@@ -12,7 +20,18 @@ from prometheus_fastapi_instrumentator import Instrumentator
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+    setup_search_index()
+    outbox.start()
+    vote_jobs = asyncio.create_task(run_vote_jobs())
     yield
+    vote_jobs.cancel()
+    await vote_buffer.flush()
+    await asyncio.to_thread(outbox.stop)
+    shutdown_password_pool()
+    await close_http_clients()
+    await asyncio.to_thread(shutdown_thumbnail_pool)
+    await async_engine.dispose()
+    await close_redis()
 
 app = FastAPI(title="LLM Chat Backend", lifespan=lifespan)
 
@@ -26,10 +45,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Фронтенд листает историю по X-Has-More
+    expose_headers=["X-Has-More"],
 )
 
-# Статика (для картинок персонажей, если захотите)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Статика (картинки персонажей) с Cache-Control/ETag, см. utils/media.py
+app.mount("/static", MediaFiles(directory="static"), name="static")
 
 # Роутеры
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
@@ -3,7 +3,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional, List
 
-from sqlalchemy import Column, JSON
+from sqlalchemy import Column, Index, JSON
 from sqlmodel import SQLModel, Field
 
 class Character(SQLModel, table=True):
@@ -31,6 +31,21 @@ class Character(SQLModel, table=True):
     is_blocked: bool = False
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Счётчик изменений строки (профиль, блокировка, счётчики голосов) — версия
+    # закешированного промпта (utils/character_prompts.py) и ETag (utils/http_cache.py)
+    version: int = Field(default=0)
+
+
+# Индексы каталога: по одному на каждый порядок сортировки (см. utils/characters.py)
+Index("ix_character_catalog_created", Character.is_public, Character.is_blocked, Character.created_at, Character.id)
+Index("ix_character_catalog_likes", Character.is_public, Character.is_blocked, Character.likes_count, Character.id)
+Index(
+    "ix_character_catalog_rating",
+    Character.is_public,
+    Character.is_blocked,
+    Character.likes_count - Character.dislikes_count,
+    Character.id,
+)
 
 
 # class Character(SQLModel, table=True):
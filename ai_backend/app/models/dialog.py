@@ -3,6 +3,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 class Dialog(SQLModel, table=True):
@@ -10,4 +11,9 @@ class Dialog(SQLModel, table=True):
     user_id: int = Field(index=True, foreign_key="user.id")
     character_id: int = Field(index=True, foreign_key="character.id")
     started_at: datetime = Field(default_factory=datetime.utcnow)
-    closed_at: Optional[datetime] = None
\ No newline at end of file
+    closed_at: Optional[datetime] = None
+
+    __table_args__ = (
+        # Списки диалогов пользователя (свои и в админке), новые сверху
+        Index("ix_dialog_user_started", "user_id", "started_at", "id"),
+    )
\ No newline at end of file
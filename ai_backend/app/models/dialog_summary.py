@@ -0,0 +1,18 @@
+# app/models/dialog_summary.py
+from __future__ import annotations
+from datetime import datetime
+from typing import Optional
+
+from sqlmodel import SQLModel, Field
+
+class DialogSummary(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    dialog_id: int = Field(index=True, unique=True, foreign_key="dialog.id")
+    content: str
+    # Последнее сообщение, вошедшее в сводку; всё после него идёт в промпт как есть
+    last_message_id: int
+    summarized_count: int = 0
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Воркер, который сейчас сворачивает диалог, держит здесь отметку захвата
+    # (NULL — свободно); last_message_id = 0 — заготовка до первой сводки
+    claimed_at: Optional[datetime] = None
@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import Optional, Literal
 from enum import Enum
 
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 # RoleType = Literal["system", "user", "assistant"]
@@ -18,4 +19,11 @@ class Message(SQLModel, table=True):
     dialog_id: int = Field(index=True, foreign_key="dialog.id")
     role: RoleEnum = Field(index=True)
     content: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    __table_args__ = (
+        # Keyset-пагинация и выборка «последних N» по диалогу
+        Index("ix_message_dialog_created_id", "dialog_id", "created_at", "id"),
+        # Суточная статистика в админке
+        Index("ix_message_created_at", "created_at"),
+    )
\ No newline at end of file
@@ -21,5 +21,7 @@ class User(SQLModel, table=True):
 
     verification_token: Optional[str] = Field(default=None, index=True)
 
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Растёт при каждом голосе пользователя — часть ETag списков персонажей (utils/http_cache.py)
+    votes_version: int = Field(default=0)
\ No newline at end of file
@@ -1,71 +1,168 @@
 # app/routers/admin.py
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Optional
+
+import anyio
+from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
 
-from utils.db import get_session
+from utils.db import engine, get_session
 from utils.dependencies import require_admin
+from utils.principal import Principal, invalidate_principal
+from utils.chat import fetch_messages_page, MESSAGES_PAGE_LIMIT, MESSAGE_OUT_COLUMNS
+from utils.fast_json import FastJSONResponse, rows_to_json
+from utils.stats import get_counts, get_series
+from utils.admin import fetch_user_characters, fetch_user_dialogs
+from utils.votes import reconcile_vote_counters, vote_buffer
+from utils.dialog_transfer import gzip_chunks, import_dialogs, iter_export_lines
+from utils.history_cache import history_cache
 from models.user import User
-from models.character import Character
-from models.dialog import Dialog
-from models.message import Message
-from schemas.admin import Stats
-from schemas.user import UserPublic, UserAdminDetail, ShortDialog
+from schemas.admin import Stats, StatsSeries
+from schemas.user import UserPublic, UserAdminDetail
 from schemas.dialog import MessageOut
 
 router = APIRouter()
 
+MESSAGE_OUT_KEYS = [c.key for c in MESSAGE_OUT_COLUMNS]
+# Колонки UserPublic — список пользователей собирается из кортежей
+USER_PUBLIC_COLUMNS = (
+    User.id, User.email, User.username, User.display_name, User.created_at, User.is_admin, User.is_blocked,
+)
+USER_PUBLIC_KEYS = [c.key for c in USER_PUBLIC_COLUMNS]
+
 @router.get("/stats", response_model=Stats)
-def stats(_: User = Depends(require_admin), session: Session = Depends(get_session)):
-    users = session.exec(select(User)).all()
-    characters = session.exec(select(Character)).all()
-    dialogs = session.exec(select(Dialog)).all()
-    messages = session.exec(select(Message)).all()
-    return Stats(
-        users=len(users),
-        characters=len(characters),
-        dialogs=len(dialogs),
-        messages=len(messages),
-    )
+def stats(_: Principal = Depends(require_admin), session: Session = Depends(get_session)):
+    return get_counts(session)
+
+@router.get("/stats/series", response_model=StatsSeries)
+def stats_series(
+    days: int = Query(30, ge=1, le=365),
+    _: Principal = Depends(require_admin),
+    session: Session = Depends(get_session),
+):
+    return get_series(session, days)
 
 @router.get("/users", response_model=List[UserPublic])
-def list_users(_: User = Depends(require_admin), session: Session = Depends(get_session)):
-    q = select(User).order_by(User.created_at.desc())
-    return session.exec(q).all()
+def list_users(_: Principal = Depends(require_admin), session: Session = Depends(get_session)):
+    rows = session.exec(select(*USER_PUBLIC_COLUMNS).order_by(User.created_at.desc())).all()
+    return FastJSONResponse(rows_to_json(UserPublic, USER_PUBLIC_KEYS, rows))
 
 @router.get("/users/{user_id}", response_model=UserAdminDetail)
-def user_detail(user_id: int, _: User = Depends(require_admin), session: Session = Depends(get_session)):
+def user_detail(
+    user_id: int,
+    dialogs_limit: int = Query(100, ge=1, le=500),
+    dialogs_offset: int = Query(0, ge=0),
+    _: Principal = Depends(require_admin),
+    session: Session = Depends(get_session),
+):
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Not found")
 
-    chars = session.exec(select(Character).where(Character.owner_id == user.id)).all()
-    dialogs = session.exec(select(Dialog).where(Dialog.user_id == user.id).order_by(Dialog.started_at.desc())).all()
-
-    short_dialogs: List[ShortDialog] = []
-    for d in dialogs:
-        ch = session.get(Character, d.character_id)
-        short_dialogs.append(ShortDialog(id=d.id, started_at=d.started_at, character_name=ch.name if ch else "Unknown"))
+    short_dialogs, total = fetch_user_dialogs(session, user.id, dialogs_limit, dialogs_offset)
 
     return UserAdminDetail(
         id=user.id,
         email=user.email,
         created_at=user.created_at,
-        characters=[{'id': c.id, 'name': c.name} for c in chars],
+        characters=fetch_user_characters(session, user.id),
         short_dialogs=short_dialogs,
+        dialogs_total=total,
     )
 
 @router.get("/dialogs/{dialog_id}", response_model=List[MessageOut])
-def admin_dialog_detail(dialog_id: int, _: User = Depends(require_admin), session: Session = Depends(get_session)):
-    q = select(Message).where(Message.dialog_id == dialog_id).order_by(Message.created_at.asc())
-    return session.exec(q).all()
+def admin_dialog_detail(
+    dialog_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(MESSAGES_PAGE_LIMIT, ge=1, le=500),
+    _: Principal = Depends(require_admin),
+    session: Session = Depends(get_session),
+):
+    rows, has_more = fetch_messages_page(
+        session, dialog_id, before_id, after_id, limit, columns=MESSAGE_OUT_COLUMNS
+    )
+    return FastJSONResponse(
+        rows_to_json(MessageOut, MESSAGE_OUT_KEYS, rows),
+        headers={"X-Has-More": "true" if has_more else "false"},
+    )
 
 @router.post("/users/{user_id}/block")
-def toggle_user_block(user_id: int, admin: User = Depends(require_admin), session: Session = Depends(get_session)):
+def toggle_user_block(user_id: int, admin: Principal = Depends(require_admin), session: Session = Depends(get_session)):
     user = session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Not found")
     user.is_blocked = not user.is_blocked
     session.add(user)
     session.commit()
-    return {"detail": "toggled", "is_blocked": user.is_blocked}
\ No newline at end of file
+    # Блокировка должна действовать сразу, а не по истечении TTL кеша
+    anyio.from_thread.run(invalidate_principal, user.id)
+    return {"detail": "toggled", "is_blocked": user.is_blocked}
+
+@router.post("/characters/reconcile-votes")
+def reconcile_votes(
+    character_id: Optional[int] = None,
+    _: Principal = Depends(require_admin),
+    session: Session = Depends(get_session),
+):
+    """
+    Пересчитывает счётчики лайков/дизлайков из таблицы голосов
+    (для одного персонажа или для всех).
+    """
+    # Сначала отдаём в БД накопленные write-behind дельты
+    anyio.from_thread.run(vote_buffer.flush)
+    updated = reconcile_vote_counters(session, character_id)
+    return {"detail": "reconciled", "updated": updated}
+
+
+@router.get("/export/dialogs")
+def export_dialogs(
+    user_id: Optional[int] = None,
+    character_id: Optional[int] = None,
+    _: Principal = Depends(require_admin),
+):
+    """
+    Диалоги с сообщениями в gzip JSONL: пользователя, персонажа или вся БД.
+    Отдаётся потоком, память не зависит от объёма.
+    """
+    def body():
+        # Своя сессия: зависимость get_session закрывается до отправки тела
+        with Session(engine) as session:
+            yield from gzip_chunks(iter_export_lines(session, user_id, character_id))
+
+    scope = f"user-{user_id}" if user_id else f"character-{character_id}" if character_id else "all"
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip",
+        headers={"Content-Disposition": f'attachment; filename="dialogs-{scope}.jsonl.gz"'},
+    )
+
+@router.post("/import/dialogs")
+def import_dialogs_upload(
+    file: UploadFile = File(...),
+    user_id: Optional[int] = None,
+    character_id: Optional[int] = None,
+    _: Principal = Depends(require_admin),
+    session: Session = Depends(get_session),
+):
+    """
+    Загрузка выгрузки /admin/export/dialogs. user_id/character_id — переназначить
+    диалоги; диалоги без пользователя/персонажа в этой БД пропускаются.
+    Повторная загрузка того же файла не создаёт дублей.
+    """
+    def invalidate(dialog_ids: List[int]) -> None:
+        # id могли достаться от удалённых диалогов, а в уже загруженные дописаны
+        # сообщения — не отдаём их старую историю из кеша
+        for dialog_id in dialog_ids:
+            anyio.from_thread.run(history_cache.invalidate, dialog_id)
+
+    try:
+        stats = import_dialogs(session, file.file, user_id, character_id, on_commit=invalidate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "dialogs": stats.dialogs,
+        "messages": stats.messages,
+        "skipped_dialogs": stats.skipped_dialogs,
+        "existing_dialogs": stats.existing_dialogs,
+    }
@@ -2,16 +2,19 @@
 import os
 
 import secrets
+import anyio
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from schemas.auth import RequestSignup, CompleteSignup, LoginRequest, TokenResponse
 from schemas.user import UserPublic
 from models.user import User
-from utils.db import get_session
-from utils.security import hash_password, verify_password, create_access_token
+from utils.db import get_session, get_async_session
+from utils.security import hash_password_async, verify_password_async, password_needs_rehash, create_access_token
 from utils.dependencies import get_current_user
 from utils.email import send_signup_link
+from utils.principal import invalidate_principal
 
 from sqlalchemy import func
 
@@ -34,8 +37,10 @@ def request_signup(data: RequestSignup, request: Request, session: Session = Dep
     user.verification_token = token
     session.add(user)
     session.commit()
+    # Любая запись в User сбрасывает кеш принципала — флаги доступа берутся из БД
+    anyio.from_thread.run(invalidate_principal, user.id)
 
-    # В консоль — ссылку (в реальности отправляйте письмо)
+    # Письмо уходит в фоновую очередь — ответ не ждёт SMTP
     base = str(request.base_url).rstrip("/")
     # base = 'http://localhost:3000'
     frontend_base = os.getenv("FRONTEND_BASE_URL", str(request.base_url)).rstrip("/")
@@ -45,18 +50,18 @@ def request_signup(data: RequestSignup, request: Request, session: Session = Dep
     return {"detail": "If email exists, a link has been sent."}
 
 @router.post("/complete-signup")
-def complete_signup(data: CompleteSignup, session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.verification_token == data.token)).first()
+async def complete_signup(data: CompleteSignup, session: AsyncSession = Depends(get_async_session)):
+    user = (await session.exec(select(User).where(User.verification_token == data.token))).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid token")
 
     if data.username:
         # Проверим уникальность username по-простому
-        exists = session.exec(select(User).where(User.username == data.username)).first()
+        exists = (await session.exec(select(User).where(User.username == data.username))).first()
         if exists and exists.id != user.id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username already taken")
 
-    user.hashed_password = hash_password(data.password)
+    user.hashed_password = await hash_password_async(data.password)
     user.email_verified = True
     user.verification_token = None
     user.username = data.username or user.username
@@ -64,24 +69,31 @@ def complete_signup(data: CompleteSignup, session: Session = Depends(get_session
         user.display_name = data.display_name
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await invalidate_principal(user.id)
     return {"detail": "Signup completed"}
 
 @router.post("/login", response_model=TokenResponse)
-def login(data: LoginRequest, session: Session = Depends(get_session)):
+async def login(data: LoginRequest, session: AsyncSession = Depends(get_async_session)):
     # логин может быть email или username
     # q = select(User).where((User.email == data.login) | (User.username == data.login))
     q = select(User).where(
         (func.lower(User.email) == func.lower(data.login)) |
         (func.lower(User.username) == func.lower(data.login))
     )
-    user = session.exec(q).first()
-    if not user or not user.hashed_password or not verify_password(data.password, user.hashed_password):
+    user = (await session.exec(q)).first()
+    if not user or not user.hashed_password or not await verify_password_async(data.password, user.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     if not user.is_active or user.is_blocked:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User inactive or blocked")
 
+    # Хеш старого формата или с устаревшими параметрами — пересчитываем, пока знаем пароль
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await hash_password_async(data.password)
+        session.add(user)
+        await session.commit()
+        await invalidate_principal(user.id)
+
     token = create_access_token(subject=str(user.id))
     return TokenResponse(access_token=token)
 
@@ -1,65 +1,142 @@
 # app/routers/characters.py
-import os
-from typing import List, Optional
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request, Response
 from sqlmodel import Session, select
 
 from utils.db import get_session
-from utils.dependencies import get_current_user, require_admin
-from utils.characters import build_character_out
-from models.user import User
+from utils.dependencies import get_current_principal, get_current_principal_optional, require_admin
+from utils.principal import Principal
+from utils.characters import build_character_out, character_list_json, fetch_catalog_page
+from utils.fast_json import FastJSONResponse
+from utils.search import index_character, search_characters
+from utils.votes import VoteConflict, record_vote, commit_vote, pending_counters
+from utils.character_prompts import bump_character_version, refresh_character_prompt
+from utils.uploads import save_upload, schedule_thumbnails, thumbnail_url, upload_url
+from utils.http_cache import (
+    is_not_modified, list_version, make_validators, not_modified, public_lists, user_votes_version,
+)
+from config import settings
 from models.character import Character
-from schemas.character import CharacterCreate, CharacterUpdate, CharacterOut, VoteIn
+from schemas.character import CharacterCreate, CharacterUpdate, CharacterOut, CharacterCard, CharacterPage, VoteIn
 from models.character_vote import CharacterVote
 
 router = APIRouter()
 
 @router.get("", response_model=List[CharacterOut])
 def list_characters(
+    request: Request,
     session: Session = Depends(get_session),
     mine: bool = False,
     owner_id: Optional[int] = None,
-    current_user: Optional[User] = Depends(get_current_user),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional),
 ):
-    q = select(Character).where(Character.is_blocked == False)
+    where = [Character.is_blocked == False]
     if mine and current_user:
-        q = q.where(Character.owner_id == current_user.id)
+        where.append(Character.owner_id == current_user.id)
     elif owner_id:
-        q = q.where(Character.owner_id == owner_id)
+        where.append(Character.owner_id == owner_id)
+        # Чужие приватные персонажи видны только владельцу и админу
+        if not current_user or (current_user.id != owner_id and not current_user.is_admin):
+            where.append(Character.is_public == True)
     else:
-        q = q.where(Character.is_public == True)
-
-    items = session.exec(q.order_by(Character.created_at.desc())).all()
-    if not items:
-        return []
-
-    # Собираем голоса текущего пользователя одним запросом
-    vmap = {}
-    if current_user:
-        ids = [c.id for c in items]
-        votes = session.exec(
-            select(CharacterVote).where(
-                CharacterVote.user_id == current_user.id,
-                CharacterVote.character_id.in_(ids),
-            )
-        ).all()
-        vmap = {v.character_id: v.value for v in votes}
-
-    # Преобразуем Character -> CharacterOut и проставим my_vote из карты
-    out: List[CharacterOut] = [
-        CharacterOut.model_validate(ch, from_attributes=True).model_copy(
-            update={"my_vote": vmap.get(ch.id)}
-        )
-        for ch in items
-    ]
-    return out
+        where.append(Character.is_public == True)
+
+    # Аноним и общий список: готовый ответ из общего короткого кеша, без запросов к БД.
+    # Списки по владельцу туда не попадают и не помечаются public
+    shared_key = "list" if not current_user and not owner_id else None
+    if shared_key:
+        cached = public_lists.get(shared_key)
+        if cached:
+            validators, body = cached
+            return _public_response(request, validators, body)
+
+    # Версия ответа — дёшевым агрегатом; совпала с If-None-Match — 304 без выборки
+    user_id = current_user.id if current_user else None
+    validators = make_validators(
+        "list", mine, owner_id, user_id,
+        list_version(session, *where), user_votes_version(session, user_id),
+    )
+    if not shared_key and is_not_modified(request, validators):
+        return not_modified(validators)
+
+    body = character_list_json(session, where, user_id)
+    if shared_key:
+        public_lists.set(shared_key, (validators, body))
+        return _public_response(request, validators, body)
+    return FastJSONResponse(body, headers=validators.headers())
+
+
+def _public_response(request: Request, validators, body: bytes) -> Response:
+    ttl = settings.HTTP_PUBLIC_LIST_TTL
+    if is_not_modified(request, validators):
+        return not_modified(validators, public=True, max_age=ttl)
+    return FastJSONResponse(body, headers=validators.headers(public=True, max_age=ttl))
+
+@router.get("/catalog", response_model=CharacterPage)
+def catalog(
+    sort: Literal["new", "likes", "rating"] = "new",
+    cursor: Optional[str] = None,
+    limit: int = Query(24, ge=1, le=100),
+    gender: Optional[str] = None,
+    interests: Optional[List[str]] = Query(None),
+    owner_id: Optional[int] = None,
+    mine: bool = False,
+    session: Session = Depends(get_session),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional),
+):
+    """
+    Каталог карточек (без context) с курсорной пагинацией.
+    sort: new — по дате, likes — по лайкам, rating — лайки минус дизлайки.
+    interests можно передать несколько раз — нужны все теги.
+    Следующая страница — тот же запрос с cursor=next_cursor.
+    """
+    include_private = False
+    if mine:
+        if not current_user:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        owner_id = current_user.id
+        include_private = True
+    return fetch_catalog_page(
+        session,
+        sort=sort,
+        limit=limit,
+        cursor=cursor,
+        gender=gender,
+        interests=interests,
+        owner_id=owner_id,
+        include_private=include_private,
+        user_id=current_user.id if current_user else None,
+    )
+
+@router.get("/search", response_model=List[CharacterCard])
+def search(
+    q: str = "",
+    interests: Optional[List[str]] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    session: Session = Depends(get_session),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional),
+):
+    """
+    Полнотекстовый поиск по имени и bio (слова по префиксу) + точное совпадение
+    тегов interests. Результаты отсортированы по релевантности.
+    """
+    return search_characters(
+        session,
+        query=q,
+        interests=interests,
+        limit=limit,
+        offset=offset,
+        user_id=current_user.id if current_user else None,
+    )
 
 @router.post("", response_model=CharacterOut)
 def create_character(
     data: CharacterCreate,
     session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     ch = Character(
         owner_id=current_user.id,
@@ -72,37 +149,46 @@ def create_character(
         is_public=data.is_public,
     )
     session.add(ch)
+    session.flush()
+    index_character(session, ch)
     session.commit()
     session.refresh(ch)
     return ch
 
 @router.get("/{character_id}", response_model=CharacterOut)
-def get_character(character_id: int, 
-                  session: Session = Depends(get_session), 
-                  current_user: Optional[User] = Depends(get_current_user)):
-    ch = session.get(Character, character_id)
-    if not ch or ch.is_blocked:
+def get_character(character_id: int,
+                  request: Request,
+                  response: Response,
+                  session: Session = Depends(get_session),
+                  current_user: Optional[Principal] = Depends(get_current_principal_optional)):
+    # Сначала лёгкий запрос: доступ и версия, без context и прочих полей
+    head = session.exec(
+        select(Character.version, Character.owner_id, Character.is_public, Character.is_blocked)
+        .where(Character.id == character_id)
+    ).first()
+    if not head or head.is_blocked:
         raise HTTPException(status_code=404, detail="Character not found")
-    if not ch.is_public:
-        if not current_user or (current_user.id != ch.owner_id and not current_user.is_admin):
+    if not head.is_public:
+        if not current_user or (current_user.id != head.owner_id and not current_user.is_admin):
             raise HTTPException(status_code=403, detail="Private character")
-    # return ch
-    if current_user:
-        v = session.exec(
-            select(CharacterVote).where(
-                CharacterVote.user_id == current_user.id,
-                CharacterVote.character_id == character_id,
-            )
-        ).first()
-        # setattr(ch, "my_vote", v.value if v else None)
-    return build_character_out(session, ch, current_user.id)
+
+    user_id = current_user.id if current_user else None
+    validators = make_validators(
+        "character", character_id, head.version, user_id, user_votes_version(session, user_id)
+    )
+    if is_not_modified(request, validators):
+        return not_modified(validators)
+
+    ch = session.get(Character, character_id)
+    response.headers.update(validators.headers())
+    return build_character_out(session, ch, user_id)
 
 @router.patch("/{character_id}", response_model=CharacterOut)
 def update_character(
     character_id: int,
     data: CharacterUpdate,
     session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     ch = session.get(Character, character_id)
     if not ch:
@@ -112,78 +198,61 @@ def update_character(
 
     for field, value in data.model_dump(exclude_unset=True).items():
         setattr(ch, field, value)
+    bump_character_version(ch)
     session.add(ch)
+    index_character(session, ch)
     session.commit()
     session.refresh(ch)
+    anyio.from_thread.run(refresh_character_prompt, ch)
     return build_character_out(session, ch, current_user.id)
 
 @router.post("/{character_id}/block")
-def block_character(character_id: int, session: Session = Depends(get_session), admin: User = Depends(require_admin)):
+def block_character(character_id: int, session: Session = Depends(get_session), admin: Principal = Depends(require_admin)):
     ch = session.get(Character, character_id)
     if not ch:
         raise HTTPException(status_code=404, detail="Not found")
     ch.is_blocked = not ch.is_blocked
+    bump_character_version(ch)
     session.add(ch)
     session.commit()
+    session.refresh(ch)
+    anyio.from_thread.run(refresh_character_prompt, ch)
     return {"detail": "toggled", "is_blocked": ch.is_blocked}
 
-# Простой локальный аплоад картинки (опционально)
+# Локальный аплоад картинки: потоково на диск, имя по sha256 содержимого
 @router.post("/upload/photo")
-def upload_photo(file: UploadFile = File(...)):
-    os.makedirs("static/uploads", exist_ok=True)
-    path = os.path.join("static", "uploads", file.filename)
-    with open(path, "wb") as f:
-        f.write(file.file.read())
-    return {"photo_url": f"/{path}"}
+def upload_photo(file: UploadFile = File(...), _: Principal = Depends(get_current_principal)):
+    digest, name, _created = save_upload(file.file)
+    # Уменьшенные копии — в фоне; повторная загрузка досоздаст недостающие
+    schedule_thumbnails(digest, name)
+    return {"photo_url": upload_url(name)}
+
 
 @router.post("/{character_id}/vote", response_model=CharacterOut)
 def vote_character(
     character_id: int,
     data: VoteIn,
     session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
 ):
     ch = session.get(Character, character_id)
     if not ch:
         raise HTTPException(status_code=404, detail="Not found")
 
-    vote = session.exec(
-        select(CharacterVote).where(
-            CharacterVote.character_id == character_id,
-            CharacterVote.user_id == current_user.id,
-        )
-    ).one_or_none()
-
-    new_value = data.value  # -1, 0, 1
-    old_value = vote.value if vote else 0
-
-    # Обновляем лайки/дизлайки
-    def dec(v):
-        if v == 1: ch.likes_count -= 1
-        elif v == -1: ch.dislikes_count -= 1
-    def inc(v):
-        if v == 1: ch.likes_count += 1
-        elif v == -1: ch.dislikes_count += 1
-
-    if new_value == 0:
-        # Сброс голоса
-        if vote:
-            dec(vote.value)
-            session.delete(vote)
-    else:
-        if not vote:
-            vote = CharacterVote(character_id=character_id, user_id=current_user.id, value=new_value)
-            inc(new_value)
-            session.add(vote)
-        else:
-            if vote.value != new_value:
-                dec(vote.value)
-                vote.value = new_value
-                inc(new_value)
-            # Если vote.value == new_value, ничего не меняем (клиент мог нажать тот же)
-
-    session.add(ch)
-    session.commit()
+    # Голос и счётчики пишутся атомарно на стороне БД (-1, 0 — сброс, 1)
+    try:
+        record_vote(session, character_id, current_user.id, data.value)
+    except VoteConflict:
+        session.rollback()
+        raise HTTPException(status_code=409, detail="Vote is being changed concurrently, try again")
+    commit_vote(session)
     session.refresh(ch)
 
-    return build_character_out(session, ch, current_user.id)
\ No newline at end of file
+    out = build_character_out(session, ch, current_user.id)
+    likes, dislikes = pending_counters(character_id)
+    if likes or dislikes:
+        out = out.model_copy(update={
+            "likes_count": out.likes_count + likes,
+            "dislikes_count": out.dislikes_count + dislikes,
+        })
+    return out
@@ -1,79 +1,201 @@
 # app/routers/dialogs.py
 # app/routers/dialogs.py
+from contextlib import aclosing
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from config import settings
-from utils.db import get_session
-from utils.dependencies import get_current_user
-from models.user import User
+from utils.db import get_session, get_async_session, async_session_maker
+from utils.dependencies import get_current_principal
+from utils.principal import Principal
 from models.character import Character
 from models.dialog import Dialog
 from models.message import Message
 from schemas.dialog import DialogOut, MessageOut, StartOrContinueChat, ChatResponse
 
-from utils.chat import (
+from utils.chat import get_llm, format_sse, fetch_messages_page, MESSAGES_PAGE_LIMIT, MESSAGE_OUT_COLUMNS
+from utils.fast_json import FastJSONResponse, rows_to_json
+from utils.chat_async import (
     ensure_character_access,
     fetch_dialog_if_valid,
-    create_dialog_with_context,
+    begin_turn,
+    abort_turn,
     add_message,
-    fetch_history_messages,
-    to_langchain_messages,
-    get_llm,
+    assemble_context,
     generate_ai_response,
+    stream_ai_response,
 )
+from utils.summary import maybe_summarize_dialog
 
 router = APIRouter()
 
+MESSAGE_OUT_KEYS = [c.key for c in MESSAGE_OUT_COLUMNS]
+
 @router.get("", response_model=List[DialogOut])
-def my_dialogs(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+def my_dialogs(session: Session = Depends(get_session), current_user: Principal = Depends(get_current_principal)):
     q = select(Dialog).where(Dialog.user_id == current_user.id).order_by(Dialog.started_at.desc())
     return session.exec(q).all()
 
 @router.get("/{dialog_id}/messages", response_model=List[MessageOut])
-def get_messages(dialog_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+def get_messages(
+    dialog_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(MESSAGES_PAGE_LIMIT, ge=1, le=500),
+    session: Session = Depends(get_session),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """
+    История диалога страницами: без курсоров — последние limit (по умолчанию 100),
+    before_id — страница перед сообщением, after_id — только новые после него.
+    Заголовок X-Has-More: true — за пределами страницы есть ещё сообщения.
+    """
     dialog = session.get(Dialog, dialog_id)
     if not dialog or dialog.user_id != current_user.id:
         raise HTTPException(status_code=404, detail="Dialog not found")
-    q = select(Message).where(Message.dialog_id == dialog_id).order_by(Message.created_at.asc())
-    return session.exec(q).all()
+    rows, has_more = fetch_messages_page(
+        session, dialog_id, before_id, after_id, limit, columns=MESSAGE_OUT_COLUMNS
+    )
+    return FastJSONResponse(
+        rows_to_json(MessageOut, MESSAGE_OUT_KEYS, rows),
+        headers={"X-Has-More": "true" if has_more else "false"},
+    )
 
 @router.post("/{character_id}/messages", response_model=ChatResponse)
-def send_message(
+async def send_message(
     character_id: int,
     data: StartOrContinueChat,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+    background_tasks: BackgroundTasks,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
 ):
     # 1) Доступ к персонажу
-    character = ensure_character_access(session, character_id, current_user)
+    character = await ensure_character_access(session, character_id, current_user)
+
+    # 2) Получаем диалог (если передан)
+    dialog = await fetch_dialog_if_valid(session, data.dialog_id, current_user.id, character.id)
 
-    # 2) Получаем/создаём диалог
-    dialog = fetch_dialog_if_valid(session, data.dialog_id, current_user.id, character.id)
-    if dialog is None:
-        dialog = create_dialog_with_context(
-            session,
-            user_id=current_user.id,
-            character_id=character.id,
-            system_content=character.context,
-        )
+    # 3) Очередь к модели переполнена — 503 до записи сообщения пользователя
+    model_id = "lite"
+    llm = get_llm(model_id=model_id)
+    llm.admit()
 
-    # 3) Сообщение пользователя
-    add_message(session, dialog.id, "user", data.message)
+    # 4) Новый диалог (если нужен) + сообщение пользователя — одна транзакция
+    is_new = dialog is None
+    dialog, user_msg = await begin_turn(session, dialog, current_user.id, character, data.message)
 
-    # 4) История -> LangChain
-    history = fetch_history_messages(session, dialog.id)
-    lc_messages = to_langchain_messages(history)
+    try:
+        # 5) История -> LangChain (в пределах бюджета токенов модели)
+        context = await assemble_context(session, dialog.id, character, model_id)
 
-    # 5) Вызов LLM
-    llm = get_llm(model_id="lite")
-    text = generate_ai_response(llm, character, lc_messages)
+        # 6) Вызов LLM
+        text = await generate_ai_response(llm, character, context.messages)
+    except BaseException:
+        # Модель не ответила — ход откатывается целиком
+        with anyio.CancelScope(shield=True):
+            await abort_turn(session, dialog.id, user_msg.id, is_new)
+        raise
 
-    # 6) Ответ ассистента
-    assistant = add_message(session, dialog.id, "assistant", text)
+    # 7) Ответ ассистента — финальный commit хода
+    assistant = await add_message(session, dialog.id, "assistant", text)
+
+    # 8) В фоне сворачиваем старые реплики в сводку, если диалог разросся
+    background_tasks.add_task(maybe_summarize_dialog, dialog.id)
 
     return ChatResponse(
         dialog_id=dialog.id,
-        assistant_message=assistant
-    )
\ No newline at end of file
+        assistant_message=assistant,
+        context_tokens=context.tokens_used,
+    )
+
+
+@router.post("/{character_id}/messages/stream")
+async def send_message_stream(
+    character_id: int,
+    data: StartOrContinueChat,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """
+    Потоковый вариант send_message (Server-Sent Events).
+
+    События: `dialog` (id диалога), `token` (очередной кусок текста),
+    `done` (сохранённый ответ ассистента, как в ChatResponse), `error`.
+    Сообщение пользователя сохраняется сразу, ответ ассистента — один раз
+    в конце генерации или при отключении клиента (то, что успели получить).
+    Если модель не выдала ни куска, ход откатывается (abort_turn).
+    """
+    character = await ensure_character_access(session, character_id, current_user)
+
+    dialog = await fetch_dialog_if_valid(session, data.dialog_id, current_user.id, character.id)
+
+    # Очередь к модели переполнена — 503 сразу, пока ответ ещё не начат
+    model_id = "lite"
+    llm = get_llm(model_id=model_id)
+    llm.admit()
+
+    is_new = dialog is None
+    dialog, user_msg = await begin_turn(session, dialog, current_user.id, character, data.message)
+    dialog_id, user_msg_id = dialog.id, user_msg.id
+
+    try:
+        context = await assemble_context(session, dialog_id, character, model_id)
+    except BaseException:
+        with anyio.CancelScope(shield=True):
+            await abort_turn(session, dialog_id, user_msg_id, is_new)
+        raise
+    tokens = stream_ai_response(llm, character, context.messages)
+
+    async def save_assistant(text: str) -> Message:
+        # Сессия запроса к этому моменту уже закрыта — пишем через свою
+        async with async_session_maker() as s:
+            return await add_message(s, dialog_id, "assistant", text)
+
+    async def abort() -> None:
+        async with async_session_maker() as s:
+            await abort_turn(s, dialog_id, user_msg_id, is_new)
+
+    async def event_stream():
+        parts: List[str] = []
+        saved = False
+        try:
+            yield format_sse("dialog", {"dialog_id": dialog_id, "context_tokens": context.tokens_used})
+            # Закрываем поток модели сразу (и при отключении клиента) — он держит слот модели
+            async with aclosing(tokens):
+                async for token in tokens:
+                    parts.append(token)
+                    yield format_sse("token", {"content": token})
+            assistant = await save_assistant("".join(parts))
+            saved = True
+            yield format_sse("done", ChatResponse(
+                dialog_id=dialog_id,
+                assistant_message=MessageOut.model_validate(assistant),
+                context_tokens=context.tokens_used,
+            ).model_dump(mode="json"))
+        except HTTPException as e:
+            # Например, так и не дождались слота модели
+            yield format_sse("error", {"detail": e.detail})
+        except Exception:
+            yield format_sse("error", {"detail": "LLM error"})
+        finally:
+            # Клиент отключился или LLM упала посреди ответа — сохраняем частичный текст,
+            # а если ответа нет совсем — откатываем ход.
+            # При отключении генератор отменяется, поэтому запись экранируем от отмены.
+            if not saved:
+                with anyio.CancelScope(shield=True):
+                    if parts:
+                        await save_assistant("".join(parts))
+                    else:
+                        await abort()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(maybe_summarize_dialog, dialog_id),
+    )
@@ -1,8 +1,20 @@
 # app/schemas/admin.py
+from datetime import date
+from typing import List
+
 from pydantic import BaseModel
 
 class Stats(BaseModel):
     users: int
     characters: int
     dialogs: int
-    messages: int
\ No newline at end of file
+    messages: int
+
+class DailyPoint(BaseModel):
+    day: date
+    value: int
+
+class StatsSeries(BaseModel):
+    messages_per_day: List[DailyPoint]
+    active_dialogs_per_day: List[DailyPoint]
+    new_users_per_day: List[DailyPoint]
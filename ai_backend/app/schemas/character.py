@@ -1,5 +1,6 @@
 # app/schemas/character.py
 from pydantic import BaseModel, field_validator, ConfigDict
+from datetime import datetime
 from typing import List, Optional
 
 class CharacterCreate(BaseModel):
@@ -52,11 +53,36 @@ class CharacterOut(BaseModel):
     likes_count: int
     dislikes_count: int
     my_vote: Optional[int] = None  # -1, 0/None, 1
+    thumb_url: Optional[str] = None  # уменьшенная копия photo_url для карточек
 
     model_config = ConfigDict(from_attributes=True)
     # class Config:
     #     from_attributes = True
 
+class CharacterCard(BaseModel):
+    """
+    Облегчённая карточка для каталога — без context (системного промпта).
+    """
+    id: int
+    owner_id: int
+    name: str
+    gender: Optional[str] = None
+    photo_url: Optional[str] = None
+    bio: Optional[str] = None
+    interests: List[str]
+    is_public: bool
+    likes_count: int
+    dislikes_count: int
+    created_at: datetime
+    my_vote: Optional[int] = None
+    thumb_url: Optional[str] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class CharacterPage(BaseModel):
+    items: List[CharacterCard]
+    next_cursor: Optional[str] = None  # None — дальше страниц нет
+
 class VoteIn(BaseModel):
     value: int  # -1, 0, 1
 
@@ -27,4 +27,5 @@ class DialogOut(BaseModel):
 
 class ChatResponse(BaseModel):
     dialog_id: int
-    assistant_message: MessageOut
\ No newline at end of file
+    assistant_message: MessageOut
+    context_tokens: Optional[int] = None  # сколько токенов ушло на промпт
\ No newline at end of file
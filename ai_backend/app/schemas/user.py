@@ -19,6 +19,9 @@ class ShortDialog(BaseModel):
     id: int
     started_at: datetime
     character_name: str
+    character_id: Optional[int] = None
+    message_count: int = 0
+    last_activity_at: Optional[datetime] = None
 
 class UserAdminDetail(BaseModel):
     id: int
@@ -26,6 +29,7 @@ class UserAdminDetail(BaseModel):
     created_at: datetime
     characters: List[dict]
     short_dialogs: List[ShortDialog]
+    dialogs_total: int = 0  # всего диалогов; short_dialogs — текущая страница
 
     class Config:
         from_attributes = True
\ No newline at end of file
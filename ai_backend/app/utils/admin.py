@@ -0,0 +1,64 @@
+# utils/admin.py
+"""
+Выборки для админки фиксированным числом запросов (без N+1).
+"""
+from typing import List, Tuple
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from models.character import Character
+from models.dialog import Dialog
+from models.message import Message
+from schemas.user import ShortDialog
+
+
+def fetch_user_characters(session: Session, user_id: int) -> List[dict]:
+    """
+    Персонажи пользователя — только id и имя.
+    """
+    rows = session.exec(
+        select(Character.id, Character.name).where(Character.owner_id == user_id).order_by(Character.id)
+    ).all()
+    return [{"id": cid, "name": name} for cid, name in rows]
+
+
+def fetch_user_dialogs(session: Session, user_id: int, limit: int, offset: int = 0) -> Tuple[List[ShortDialog], int]:
+    """
+    Страница диалогов пользователя с именем персонажа, числом сообщений
+    и временем последней активности. Три запроса независимо от числа диалогов:
+    общее количество, страница диалогов с JOIN на персонажа, агрегаты по сообщениям.
+    """
+    total = session.exec(select(func.count()).select_from(Dialog).where(Dialog.user_id == user_id)).one()
+
+    rows = session.exec(
+        select(Dialog.id, Dialog.started_at, Dialog.character_id, Character.name)
+        .join(Character, Character.id == Dialog.character_id, isouter=True)
+        .where(Dialog.user_id == user_id)
+        .order_by(Dialog.started_at.desc(), Dialog.id.desc())
+        .offset(offset)
+        .limit(limit)
+    ).all()
+    if not rows:
+        return [], total
+
+    ids = [r[0] for r in rows]
+    agg = session.exec(
+        select(Message.dialog_id, func.count(Message.id), func.max(Message.created_at))
+        .where(Message.dialog_id.in_(ids))
+        .group_by(Message.dialog_id)
+    ).all()
+    amap = {dialog_id: (count, last) for dialog_id, count, last in agg}
+
+    dialogs = []
+    for dialog_id, started_at, character_id, character_name in rows:
+        count, last = amap.get(dialog_id, (0, None))
+        dialogs.append(ShortDialog(
+            id=dialog_id,
+            started_at=started_at,
+            character_id=character_id,
+            character_name=character_name or "Unknown",
+            message_count=count,
+            last_activity_at=last,
+        ))
+    return dialogs, total
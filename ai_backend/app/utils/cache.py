@@ -0,0 +1,84 @@
+# utils/cache.py
+"""
+Общие кирпичики для кешей: потокобезопасный LRU с TTL в памяти процесса
+и ленивый клиент Redis (или совместимого сервера — KeyDB, Valkey, Dragonfly).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from config import settings
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру словарь с вытеснением давно неиспользуемых ключей.
+    ttl (секунды) — необязательный срок жизни записи.
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_redis = None
+
+
+def get_redis():
+    """
+    Возвращает общий async-клиент Redis по settings.REDIS_URL.
+    Пакет redis нужен только если какой-то кеш настроен на бэкенд redis.
+    """
+    global _redis
+    if _redis is None:
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("Для Redis-бэкенда кешей установите пакет redis") from e
+        _redis = aioredis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,131 @@
+# utils/character_prompts.py
+"""
+Кеш «скомпилированных» персонажей для чата: готовый системный промпт,
+его размер в токенах и поля для проверки доступа и старта диалога.
+На горячем ходе чата таблица character не читается.
+
+Запись помечена Character.version (счётчик изменений). update_character
+и блокировка увеличивают версию и сразу кладут свежую запись в кеш;
+загрузка при промахе пишет только если записи ещё нет — так прочитанная
+до изменения старая версия не затрёт новую.
+Бэкенд PROMPT_CACHE_BACKEND: memory | redis | none; PROMPT_CACHE_TTL —
+верхняя граница устаревания в памяти других воркеров.
+"""
+import json
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from langchain_core.messages import SystemMessage
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from config import settings
+from models.character import Character
+from utils.cache import LRUCache, get_redis
+from utils.chat import estimate_tokens
+from utils.for_ai import build_character_system_prompt
+
+
+@dataclass
+class CharacterPrompt:
+    id: int
+    version: int
+    owner_id: int
+    is_public: bool
+    is_blocked: bool
+    context: str  # первое системное сообщение нового диалога
+    system_prompt: str
+    system_tokens: int
+    system_message: Optional[SystemMessage] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.system_message is None:
+            self.system_message = SystemMessage(content=self.system_prompt)
+
+    @classmethod
+    def from_character(cls, ch: Character) -> "CharacterPrompt":
+        system_prompt = build_character_system_prompt(ch)
+        return cls(
+            id=ch.id,
+            version=ch.version or 0,
+            owner_id=ch.owner_id,
+            is_public=ch.is_public,
+            is_blocked=ch.is_blocked,
+            context=ch.context,
+            system_prompt=system_prompt,
+            system_tokens=estimate_tokens(system_prompt),
+        )
+
+    def to_json(self) -> str:
+        d = asdict(self)
+        d.pop("system_message")
+        return json.dumps(d, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CharacterPrompt":
+        return cls(**json.loads(raw))
+
+
+_memory = LRUCache(maxsize=settings.PROMPT_CACHE_MAX, ttl=settings.PROMPT_CACHE_TTL)
+_memory_lock = threading.Lock()
+
+
+def _backend() -> str:
+    return settings.PROMPT_CACHE_BACKEND.lower()
+
+
+def _key(character_id: int) -> str:
+    return f"charprompt:{character_id}"
+
+
+async def _cache_get(character_id: int) -> Optional[CharacterPrompt]:
+    backend = _backend()
+    if backend == "memory":
+        return _memory.get(character_id)
+    if backend == "redis":
+        raw = await get_redis().get(_key(character_id))
+        return CharacterPrompt.from_json(raw) if raw else None
+    return None
+
+
+async def _cache_put(prompt: CharacterPrompt, only_if_absent: bool) -> None:
+    backend = _backend()
+    if backend == "memory":
+        with _memory_lock:
+            current = _memory.get(prompt.id)
+            if current is not None and (only_if_absent or current.version > prompt.version):
+                return
+            _memory.set(prompt.id, prompt)
+    elif backend == "redis":
+        await get_redis().set(
+            _key(prompt.id), prompt.to_json(), ex=settings.PROMPT_CACHE_TTL, nx=only_if_absent
+        )
+
+
+async def get_character_prompt(session: AsyncSession, character_id: int) -> Optional[CharacterPrompt]:
+    """
+    Персонаж для чата из кеша; при промахе — из БД с записью в кеш.
+    """
+    prompt = await _cache_get(character_id)
+    if prompt is not None:
+        return prompt
+    ch = await session.get(Character, character_id)
+    if ch is None:
+        return None
+    prompt = CharacterPrompt.from_character(ch)
+    await _cache_put(prompt, only_if_absent=True)
+    return prompt
+
+
+def bump_character_version(ch: Character) -> None:
+    """
+    Отмечает изменение персонажа (до commit).
+    """
+    ch.version = (ch.version or 0) + 1
+
+
+async def refresh_character_prompt(ch: Character) -> None:
+    """
+    Кладёт в кеш актуальную версию персонажа (после commit).
+    """
+    await _cache_put(CharacterPrompt.from_character(ch), only_if_absent=False)
@@ -1,10 +1,76 @@
 # utils/characters.py
 
-from typing import Optional
+import base64
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, cast, exists, func, literal, or_
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlmodel import Session, select
 from models.character import Character
 from models.character_vote import CharacterVote
-from schemas.character import CharacterOut
+from schemas.character import CharacterOut, CharacterCard, CharacterPage
+from utils.db import engine
+from utils.fast_json import rows_to_json
+from utils.uploads import thumbnail_url
+
+# Ключ сортировки каталога -> выражение (под каждое есть индекс в models/character.py)
+CATALOG_SORTS = {
+    "new": Character.created_at,
+    "likes": Character.likes_count,
+    "rating": Character.likes_count - Character.dislikes_count,
+}
+
+# Колонки карточки: всё, кроме тяжёлого context
+CARD_COLUMNS = (
+    Character.id,
+    Character.owner_id,
+    Character.name,
+    Character.gender,
+    Character.photo_url,
+    Character.bio,
+    Character.interests,
+    Character.is_public,
+    Character.likes_count,
+    Character.dislikes_count,
+    Character.created_at,
+)
+
+# Колонки CharacterOut (my_vote и thumb_url вычисляются отдельно)
+OUT_COLUMNS = (
+    Character.id,
+    Character.owner_id,
+    Character.name,
+    Character.gender,
+    Character.photo_url,
+    Character.bio,
+    Character.context,
+    Character.interests,
+    Character.is_public,
+    Character.is_blocked,
+    Character.likes_count,
+    Character.dislikes_count,
+)
+
+def character_list_json(session: Session, where, user_id: Optional[int] = None) -> bytes:
+    """
+    Список CharacterOut сразу в JSON-байтах: кортежи колонок без ORM-объектов,
+    голос пользователя — тем же запросом (LEFT JOIN), проверка — одним TypeAdapter.
+    """
+    keys = [c.key for c in OUT_COLUMNS]
+    q = select(*OUT_COLUMNS)
+    if user_id:
+        keys.append("my_vote")
+        q = select(*OUT_COLUMNS, CharacterVote.value).outerjoin(
+            CharacterVote,
+            and_(CharacterVote.character_id == Character.id, CharacterVote.user_id == user_id),
+        )
+    keys.append("thumb_url")
+    rows = session.exec(q.where(*where).order_by(Character.created_at.desc())).all()
+    return rows_to_json(CharacterOut, keys, ((*row, thumbnail_url(row.photo_url)) for row in rows))
+
 
 def build_character_out(
     session: Session,
@@ -23,6 +89,104 @@ def build_character_out(
 
     out = CharacterOut.model_validate(ch, from_attributes=True)
     # В pydantic v2 можно так:
-    out = out.model_copy(update={"my_vote": my_vote})
+    out = out.model_copy(update={"my_vote": my_vote, "thumb_url": thumbnail_url(ch.photo_url)})
     # или просто: out.my_vote = my_vote
-    return out
\ No newline at end of file
+    return out
+
+
+def fetch_my_votes(session: Session, user_id: Optional[int], ids: List[int]) -> Dict[int, int]:
+    """
+    Голоса пользователя по списку персонажей одним запросом.
+    """
+    if not user_id or not ids:
+        return {}
+    rows = session.exec(
+        select(CharacterVote.character_id, CharacterVote.value).where(
+            CharacterVote.user_id == user_id,
+            CharacterVote.character_id.in_(ids),
+        )
+    ).all()
+    return {character_id: value for character_id, value in rows}
+
+
+def card_from_row(row, my_vote: Optional[int] = None) -> CharacterCard:
+    """
+    Карточка из строки select(*CARD_COLUMNS, ...).
+    """
+    return CharacterCard(
+        **{c.key: row._mapping[c.key] for c in CARD_COLUMNS},
+        my_vote=my_vote,
+        thumb_url=thumbnail_url(row.photo_url),
+    )
+
+
+def interest_filter(tag: str):
+    """
+    Условие «в interests есть тег» для JSON-колонки: jsonb @> в Postgres,
+    json_each в SQLite.
+    """
+    if engine.dialect.name == "postgresql":
+        return cast(Character.interests, JSONB).contains([tag])
+    je = func.json_each(Character.interests).table_valued("value")
+    return exists(select(literal(1)).select_from(je).where(je.c.value == tag))
+
+
+def encode_cursor(sort: str, value, last_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, last_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[object, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cur_sort, value, last_id = json.loads(raw)
+        if cur_sort != sort:
+            raise ValueError("sort mismatch")
+        if sort == "new":
+            value = datetime.fromisoformat(value)
+        return value, int(last_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def fetch_catalog_page(
+    session: Session,
+    sort: str = "new",
+    limit: int = 24,
+    cursor: Optional[str] = None,
+    gender: Optional[str] = None,
+    interests: Optional[List[str]] = None,
+    owner_id: Optional[int] = None,
+    include_private: bool = False,
+    user_id: Optional[int] = None,
+) -> CharacterPage:
+    """
+    Страница каталога карточек с keyset-пагинацией по (ключ сортировки, id).
+    Читаются только колонки карточки, без ORM-объектов.
+    """
+    key = CATALOG_SORTS[sort]
+    q = select(*CARD_COLUMNS).where(Character.is_blocked == False)
+    if not include_private:
+        q = q.where(Character.is_public == True)
+    if owner_id is not None:
+        q = q.where(Character.owner_id == owner_id)
+    if gender:
+        q = q.where(Character.gender == gender)
+    for tag in interests or []:
+        q = q.where(interest_filter(tag))
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort)
+        q = q.where(or_(key < value, and_(key == value, Character.id < last_id)))
+
+    q = q.add_columns(key.label("sort_key")).order_by(key.desc(), Character.id.desc()).limit(limit + 1)
+    rows = session.exec(q).all()
+
+    page = rows[:limit]
+    vmap = fetch_my_votes(session, user_id, [r.id for r in page])
+    items = [card_from_row(r, vmap.get(r.id)) for r in page]
+    next_cursor = None
+    if len(rows) > limit and page:
+        next_cursor = encode_cursor(sort, page[-1].sort_key, page[-1].id)
+    return CharacterPage(items=items, next_cursor=next_cursor)
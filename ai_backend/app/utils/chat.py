@@ -1,6 +1,10 @@
 # utils/chat.py
-from typing import List, Optional
+import json
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import HTTPException
+from sqlalchemy import and_, or_
 from sqlmodel import Session, select
 
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
@@ -12,6 +16,7 @@ from models.character import Character
 from models.dialog import Dialog
 from models.message import Message
 from utils.for_ai import build_character_system_prompt
+from utils.llm_resilience import ResilientLLM
 
 
 def ensure_character_access(session: Session, character_id: int, current_user: User) -> Character:
@@ -45,44 +50,57 @@ def fetch_dialog_if_valid(
     return dialog
 
 
-def create_dialog_with_context(
-    session: Session,
-    user_id: int,
-    character_id: int,
-    system_content: str,
-) -> Dialog:
-    """
-    Создаёт диалог и первое системное сообщение (контекст персонажа).
-    """
-    dialog = Dialog(user_id=user_id, character_id=character_id)
-    session.add(dialog)
-    session.commit()
-    session.refresh(dialog)
-
-    sys_msg = Message(dialog_id=dialog.id, role="system", content=system_content)
-    session.add(sys_msg)
-    session.commit()
+# Колонки MessageOut — для выборки кортежами без ORM-объектов (utils/fast_json.py)
+MESSAGE_OUT_COLUMNS = (Message.id, Message.role, Message.content, Message.created_at)
 
-    return dialog
 
+# Размер страницы истории по умолчанию: длинный диалог целиком не отдаём
+MESSAGES_PAGE_LIMIT = 100
 
-def add_message(session: Session, dialog_id: int, role: str, content: str) -> Message:
-    """
-    Создаёт и сохраняет сообщение.
-    """
-    msg = Message(dialog_id=dialog_id, role=role, content=content)
-    session.add(msg)
-    session.commit()
-    session.refresh(msg)
-    return msg
 
+def fetch_messages_page(
+    session: Session,
+    dialog_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = MESSAGES_PAGE_LIMIT,
+    columns: Optional[Tuple] = None,
+) -> Tuple[List[Message], bool]:
+    """
+    Keyset-пагинация истории по (created_at, id), всегда по возрастанию времени.
+
+    after_id — только сообщения после указанного (инкрементальная догрузка),
+    before_id — страница перед указанным (прокрутка вверх), без курсоров —
+    последние limit сообщений.
+    Вторым значением — есть ли ещё сообщения за пределами страницы.
+    columns — вернуть кортежи этих колонок вместо объектов Message.
+    """
+    q = select(*columns) if columns else select(Message)
+    q = q.where(Message.dialog_id == dialog_id)
+    for pivot_id, newer in ((after_id, True), (before_id, False)):
+        if pivot_id is None:
+            continue
+        pivot = session.get(Message, pivot_id)
+        if not pivot or pivot.dialog_id != dialog_id:
+            raise HTTPException(status_code=404, detail="Message not found")
+        if newer:
+            q = q.where(or_(
+                Message.created_at > pivot.created_at,
+                and_(Message.created_at == pivot.created_at, Message.id > pivot.id),
+            ))
+        else:
+            q = q.where(or_(
+                Message.created_at < pivot.created_at,
+                and_(Message.created_at == pivot.created_at, Message.id < pivot.id),
+            ))
 
-def fetch_history_messages(session: Session, dialog_id: int) -> List[Message]:
-    """
-    Возвращает всю историю сообщений в диалоге по возрастанию времени.
-    """
-    q = select(Message).where(Message.dialog_id == dialog_id).order_by(Message.created_at.asc())
-    return session.exec(q).all()
+    # after_id — идём вперёд от курсора; иначе берём самые новые и разворачиваем
+    if after_id is not None and before_id is None:
+        rows = session.exec(q.order_by(Message.created_at.asc(), Message.id.asc()).limit(limit + 1)).all()
+        return rows[:limit], len(rows) > limit
+    rows = session.exec(q.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
 
 
 def to_langchain_messages(history: List[Message]) -> List[BaseMessage]:
@@ -102,23 +120,51 @@ def to_langchain_messages(history: List[Message]) -> List[BaseMessage]:
     return lc_messages
 
 
-def get_llm(model_id: str = "lite", temperature: Optional[float] = None) -> BaseLanguageModel:
+# Служебные токены на одно сообщение (роль, разделители)
+MESSAGE_TOKEN_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Приблизительно оценивает число токенов в тексте сообщения.
     """
-    Возвращает LLM из settings с дефолтным model_id и температурой из настроек.
+    return math.ceil(len(text or "") / settings.CHARS_PER_TOKEN) + MESSAGE_TOKEN_OVERHEAD
+
+
+@dataclass
+class ContextWindow:
+    """
+    Результат сборки контекста: сообщения для LLM (без системного промпта
+    персонажа — его добавляет build_prompt_messages) и расход бюджета.
+    """
+    messages: List[BaseMessage]
+    tokens_used: int
+    budget: int
+    truncated: bool = False
+
+
+def get_llm(model_id: str = "lite", temperature: Optional[float] = None) -> ResilientLLM:
+    """
+    Возвращает LLM через шлюз (общие пулы соединений, лимит запросов на модель)
+    с повторами, дедлайнами и запасными моделями; дефолтные model_id и температура из настроек.
     """
     temp = settings.TEMPERATURE if temperature is None else temperature
-    return settings.create_yandex_model(model_id=model_id, temperature=temp)
+    return ResilientLLM(model_id, temp)
+
+
+def build_prompt_messages(character: Character, lc_messages: List[BaseMessage]) -> list:
+    """
+    Собирает итоговый промпт: системный промпт персонажа + история + маркер ответа.
+    character — модель Character или CharacterPrompt с уже готовым системным сообщением.
+    """
+    char_sys = getattr(character, "system_message", None) or SystemMessage(
+        content=build_character_system_prompt(character)
+    )
+    return [char_sys] + lc_messages + ['Ассистент: [SEP]']
 
 
-def generate_ai_response(
-    llm: BaseLanguageModel,
-    character: Character,
-    lc_messages: List[BaseMessage],
-) -> str:
+def format_sse(event: str, data: Dict[str, Any]) -> str:
     """
-    Добавляет системный промпт персонажа и вызывает LLM.
-    Возвращает чистый текст ответа.
+    Форматирует одно событие Server-Sent Events.
     """
-    char_sys = SystemMessage(content=build_character_system_prompt(character))
-    ai_msg = llm.invoke([char_sys] + lc_messages + ['Ассистент: [SEP]'])
-    return ai_msg.content if hasattr(ai_msg, "content") else str(ai_msg)
\ No newline at end of file
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
@@ -0,0 +1,294 @@
+# utils/chat_async.py
+"""
+Асинхронные версии хелперов из utils/chat: AsyncSession + ainvoke/astream.
+Ожидание LLM не держит поток из пула Starlette — только корутину.
+"""
+from contextlib import aclosing
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import and_, delete, or_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from langchain_core.messages import BaseMessage
+
+from config import settings
+from models.dialog import Dialog
+from models.message import Message
+from utils.chat import ContextWindow, build_prompt_messages, estimate_tokens
+from utils.character_prompts import CharacterPrompt, get_character_prompt
+from utils.llm_resilience import ResilientLLM
+from utils.completion_cache import completion_cache, completion_key
+from utils.principal import Principal
+from utils.history_cache import HistoryEntry, HistoryItem, history_cache
+from utils.summary import get_summary, summary_system_message
+
+
+async def ensure_character_access(session: AsyncSession, character_id: int, current_user: Principal) -> CharacterPrompt:
+    """
+    Проверяет существование персонажа и права доступа.
+    Бросает HTTPException если доступ запрещён.
+    Персонаж берётся из кеша промптов — на горячем ходе без SELECT.
+    """
+    ch = await get_character_prompt(session, character_id)
+    if not ch or ch.is_blocked:
+        raise HTTPException(status_code=404, detail="Character not found")
+    if not ch.is_public and ch.owner_id != current_user.id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Private character")
+    return ch
+
+
+async def fetch_dialog_if_valid(
+    session: AsyncSession,
+    dialog_id: Optional[int],
+    user_id: int,
+    character_id: int,
+) -> Optional[Dialog]:
+    """
+    Возвращает диалог, если dialog_id задан и пользователь/персонаж совпадают,
+    иначе кидает 404. Если dialog_id не передан — возвращает None.
+    """
+    if not dialog_id:
+        return None
+    dialog = await session.get(Dialog, dialog_id)
+    if not dialog or dialog.user_id != user_id or dialog.character_id != character_id:
+        raise HTTPException(status_code=404, detail="Dialog not found")
+    return dialog
+
+
+async def begin_turn(
+    session: AsyncSession,
+    dialog: Optional[Dialog],
+    user_id: int,
+    character: CharacterPrompt,
+    content: str,
+) -> Tuple[Dialog, Message]:
+    """
+    Начало хода одной транзакцией: при необходимости новый диалог с системным
+    сообщением (контекст персонажа) и сообщение пользователя.
+    id выдаёт flush, поэтому отдельные commit/refresh не нужны; при ошибке
+    не остаётся диалога без системного сообщения или «висячих» строк.
+    Если затем не ответит модель, ход откатывает abort_turn.
+    """
+    is_new = dialog is None
+    try:
+        if is_new:
+            dialog = Dialog(user_id=user_id, character_id=character.id)
+            session.add(dialog)
+            await session.flush()
+            session.add(Message(dialog_id=dialog.id, role="system", content=character.context))
+        user_msg = Message(dialog_id=dialog.id, role="user", content=content)
+        session.add(user_msg)
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+
+    if not is_new:
+        await history_cache.append(dialog.id, HistoryItem.from_message(user_msg))
+    return dialog, user_msg
+
+
+async def abort_turn(session: AsyncSession, dialog_id: int, user_msg_id: int, is_new: bool) -> None:
+    """
+    Откат хода, если модель так и не ответила: одной транзакцией удаляет
+    сообщение пользователя, а для нового диалога — диалог целиком
+    (с системным сообщением). Транзакция не держится открытой на время
+    вызова LLM — вместо неё компенсирующее удаление.
+    """
+    try:
+        if is_new:
+            await session.exec(delete(Message).where(Message.dialog_id == dialog_id))
+            await session.exec(delete(Dialog).where(Dialog.id == dialog_id))
+        else:
+            await session.exec(delete(Message).where(Message.id == user_msg_id))
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    await history_cache.invalidate(dialog_id)
+
+
+async def add_message(session: AsyncSession, dialog_id: int, role: str, content: str) -> Message:
+    """
+    Создаёт и сохраняет сообщение одним commit (сессия с expire_on_commit=False,
+    поэтому id и created_at доступны без повторного SELECT).
+    """
+    msg = Message(dialog_id=dialog_id, role=role, content=content)
+    session.add(msg)
+    try:
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    if role == "system":
+        await history_cache.invalidate(dialog_id)
+    else:
+        await history_cache.append(dialog_id, HistoryItem.from_message(msg))
+    return msg
+
+
+async def load_history_head(session: AsyncSession, dialog_id: int) -> HistoryEntry:
+    """
+    Пустая запись кеша истории: системные сообщения и сводка, без реплик.
+    """
+    pinned_q = (
+        select(Message)
+        .where(Message.dialog_id == dialog_id, Message.role == "system")
+        .order_by(Message.created_at.asc(), Message.id.asc())
+    )
+    pinned = (await session.exec(pinned_q)).all()
+    summary = await get_summary(session, dialog_id)
+    return HistoryEntry(
+        pinned=[HistoryItem.from_message(m) for m in pinned],
+        summary=summary.content if summary else None,
+        floor_id=summary.last_message_id if summary else 0,
+        items=[],
+        complete=False,
+    )
+
+
+async def assemble_context(
+    session: AsyncSession,
+    dialog_id: int,
+    character: CharacterPrompt,
+    model_id: str = "lite",
+    batch_size: int = 50,
+) -> ContextWindow:
+    """
+    Собирает историю диалога под бюджет токенов модели.
+
+    Системный промпт персонажа, системные сообщения диалога и сводка старых
+    реплик (если есть) попадают всегда, затем несвёрнутые реплики берутся
+    от новых к старым, пока хватает бюджета. Реплики берутся из кеша истории,
+    а из БД дочитываются только недостающие старые — пачками по batch_size.
+    """
+    budget = settings.context_budget(model_id)
+    used = character.system_tokens
+
+    entry = await history_cache.get(dialog_id)
+    if entry is None:
+        # Поколение — до чтения из БД: если сводка обновится во время сборки,
+        # set ниже не запишет устаревшую запись
+        generation = await history_cache.generation(dialog_id)
+        entry = await load_history_head(session, dialog_id)
+        entry.generation = generation
+    else:
+        # Закешированную запись читают и другие ходы — дописываем в копию
+        entry = entry.copy()
+
+    pinned_lc = [x.lc for x in entry.pinned]
+    used += sum(x.tokens for x in entry.pinned)
+    if entry.summary is not None:
+        summary_msg = summary_system_message(entry.summary)
+        pinned_lc.append(summary_msg)
+        used += estimate_tokens(summary_msg.content)
+
+    # idx — сколько реплик в начале entry.items ещё не взято в контекст
+    idx = len(entry.items)
+    truncated = False
+    while True:
+        while idx > 0:
+            item = entry.items[idx - 1]
+            # Последнюю реплику берём всегда, даже если она одна не влезает
+            if idx < len(entry.items) and used + item.tokens > budget:
+                truncated = True
+                break
+            used += item.tokens
+            idx -= 1
+        if truncated or entry.complete:
+            break
+
+        q = select(Message).where(
+            Message.dialog_id == dialog_id,
+            Message.role != "system",
+            Message.id > entry.floor_id,
+        )
+        if entry.items:
+            oldest = entry.items[0]
+            q = q.where(or_(
+                Message.created_at < oldest.created_at,
+                and_(Message.created_at == oldest.created_at, Message.id < oldest.id),
+            ))
+        q = q.order_by(Message.created_at.desc(), Message.id.desc()).limit(batch_size)
+        rows = (await session.exec(q)).all()
+        older = [HistoryItem.from_message(m) for m in reversed(rows)]
+        entry.items[:0] = older
+        idx = len(older)
+        if len(rows) < batch_size:
+            entry.complete = True
+
+    recent = [x.lc for x in entry.items[idx:]]
+    await history_cache.set(dialog_id, entry)
+    return ContextWindow(
+        messages=pinned_lc + recent,
+        tokens_used=used,
+        budget=budget,
+        truncated=truncated,
+    )
+
+
+async def generate_ai_response(
+    llm: ResilientLLM,
+    character: CharacterPrompt,
+    lc_messages: List[BaseMessage],
+) -> str:
+    """
+    Добавляет системный промпт персонажа и вызывает LLM (ainvoke).
+    Возвращает чистый текст ответа. Одинаковые детерминированные запросы
+    берутся из кеша ответов, если он включён для персонажа и температуры.
+    """
+    prompt = build_prompt_messages(character, lc_messages)
+    key = _completion_key(llm, character, prompt)
+    if key:
+        cached = await completion_cache.get(key)
+        if cached is not None:
+            return cached
+
+    ai_msg = await llm.ainvoke(prompt)
+    text = ai_msg.content if hasattr(ai_msg, "content") else str(ai_msg)
+    # Ответ запасной модели не кешируем под ключом основной
+    if key and text and llm.served_by == llm.model_id:
+        await completion_cache.set(key, text)
+    return text
+
+
+def stream_ai_response(
+    llm: ResilientLLM,
+    character: CharacterPrompt,
+    lc_messages: List[BaseMessage],
+) -> AsyncIterator[str]:
+    """
+    То же, что generate_ai_response, но отдаёт текст кусками (astream).
+    Промпт собирается сразу, чтобы итератор не трогал ORM-объекты после закрытия сессии.
+    Ответ из кеша отдаётся одним куском; в кеш попадает только полный ответ.
+    Итератор нужно закрывать (contextlib.aclosing) — до этого занят слот модели.
+    """
+    prompt = build_prompt_messages(character, lc_messages)
+    key = _completion_key(llm, character, prompt)
+
+    async def chunks() -> AsyncIterator[str]:
+        if key:
+            cached = await completion_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        parts: List[str] = []
+        # aclosing: при остановке потребителя поток модели закрывается сразу и
+        # освобождает слот модели, а не когда его доберёт сборщик мусора
+        async with aclosing(llm.astream(prompt)) as stream:
+            async for chunk in stream:
+                text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+        if key and parts and llm.served_by == llm.model_id:
+            await completion_cache.set(key, "".join(parts))
+
+    return chunks()
+
+
+def _completion_key(llm: ResilientLLM, character: CharacterPrompt, prompt: list) -> Optional[str]:
+    if not completion_cache.enabled_for(character.id, llm.temperature):
+        return None
+    return completion_key(llm.model_id, llm.temperature, prompt)
@@ -0,0 +1,178 @@
+# utils/completion_cache.py
+"""
+Кеш готовых ответов LLM для детерминированных (низкая температура) запросов.
+
+Ключ — sha256 от (модель, температура, собранный промпт), поэтому совпадают
+только полностью одинаковые запросы: типично — первый ход нового диалога
+с персонажем. Кеш включается COMPLETION_CACHE_BACKEND (none | sqlite | redis)
+и действует только для температур не выше COMPLETION_CACHE_MAX_TEMPERATURE
+и персонажей из COMPLETION_CACHE_CHARACTERS (пусто — для всех).
+
+sqlite — локальный файл COMPLETION_CACHE_PATH с TTL и вытеснением давно
+не читавшихся записей сверх COMPLETION_CACHE_MAX_ENTRIES; redis — общий для
+воркеров, размер ограничивает политика maxmemory сервера (allkeys-lru).
+Доля попаданий: completion_cache_requests_total{result="hit"} / все запросы.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+
+from prometheus_client import Counter
+
+from config import settings
+from utils.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_CACHE_REQUESTS = Counter(
+    "completion_cache_requests_total", "Обращения к кешу ответов LLM", ["result"]
+)
+
+
+def completion_key(model_id: str, temperature: float, prompt: List[Any]) -> str:
+    parts = [
+        [type(m).__name__, m] if isinstance(m, str) else [m.type, m.content]
+        for m in prompt
+    ]
+    raw = json.dumps([model_id, temperature, parts], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _allowed_characters() -> Optional[set]:
+    ids = [x.strip() for x in settings.COMPLETION_CACHE_CHARACTERS.split(",") if x.strip()]
+    return {int(x) for x in ids} if ids else None
+
+
+class SQLiteCompletionCache:
+    """
+    Кеш в локальном файле SQLite; запросы выполняются в потоке.
+    """
+
+    PURGE_EVERY = 100  # проверять размер раз в столько записей
+
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completion ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_completion_accessed ON completion (accessed_at)")
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM completion WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM completion WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE completion SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def _set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completion (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM completion WHERE expires_at <= ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM completion WHERE key IN ("
+                    "SELECT key FROM completion ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> None:
+        await asyncio.to_thread(self._set, key, value)
+
+
+class RedisCompletionCache:
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[str]:
+        return await get_redis().get(f"completion:{key}")
+
+    async def set(self, key: str, value: str) -> None:
+        await get_redis().set(f"completion:{key}", value, ex=self.ttl)
+
+
+class CompletionCache:
+    """
+    Обёртка над бэкендом: проверка, включён ли кеш для запроса, и метрики.
+    Ошибки бэкенда не мешают ответу — считаем их промахом.
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._backend_lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._backend_lock:
+                if self._backend is None:
+                    self._backend = self._create_backend()
+        return self._backend
+
+    @staticmethod
+    def _create_backend():
+        kind = settings.COMPLETION_CACHE_BACKEND.lower()
+        if kind == "sqlite":
+            return SQLiteCompletionCache(
+                settings.COMPLETION_CACHE_PATH,
+                settings.COMPLETION_CACHE_TTL,
+                settings.COMPLETION_CACHE_MAX_ENTRIES,
+            )
+        if kind == "redis":
+            return RedisCompletionCache(settings.COMPLETION_CACHE_TTL)
+        return None
+
+    def enabled_for(self, character_id: int, temperature: float) -> bool:
+        if settings.COMPLETION_CACHE_BACKEND.lower() not in ("sqlite", "redis"):
+            return False
+        if temperature > settings.COMPLETION_CACHE_MAX_TEMPERATURE:
+            return False
+        allowed = _allowed_characters()
+        return allowed is None or character_id in allowed
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.backend.get(key)
+        except Exception:
+            logger.exception("completion cache get failed")
+            value = None
+        COMPLETION_CACHE_REQUESTS.labels("hit" if value is not None else "miss").inc()
+        return value
+
+    async def set(self, key: str, value: str) -> None:
+        try:
+            await self.backend.set(key, value)
+        except Exception:
+            logger.exception("completion cache set failed")
+
+
+completion_cache = CompletionCache()
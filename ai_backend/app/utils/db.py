@@ -1,13 +1,81 @@
 # app/utils/db.py
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.schema import CreateIndex
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from config import settings
 
 # engine = create_engine(settings.DATABASE_URL, echo=settings.DB_ECHO, connect_args={"check_same_thread": False})
 engine = create_engine(settings.DATABASE_URL, echo=settings.DB_ECHO)
 
+
+def async_database_url(url: str) -> str:
+    """
+    Подбирает async-драйвер для синхронного DATABASE_URL.
+    psycopg3 умеет работать асинхронно под тем же именем диалекта.
+    """
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:") or url.startswith("postgresql+psycopg2:"):
+        return "postgresql+psycopg:" + url.split(":", 1)[1]
+    return url
+
+
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL),
+    echo=settings.DB_ECHO,
+)
+# expire_on_commit=False — после commit объекты остаются читаемыми без ленивых SELECT
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def dialect_insert(model):
+    """
+    INSERT с поддержкой ON CONFLICT для диалекта БД (Postgres или SQLite).
+    """
+    return pg_insert(model) if engine.dialect.name == "postgresql" else sqlite_insert(model)
+
+
+def _add_missing_columns(conn) -> None:
+    """
+    Добавляет в существующие таблицы новые колонки моделей (ALTER TABLE ... ADD COLUMN).
+    Поддерживаются колонки со скалярным default или nullable.
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = (
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(conn.dialect)}"
+            )
+            default = column.default.arg if column.default is not None and column.default.is_scalar else None
+            if default is not None:
+                ddl += f" DEFAULT {literal(default).compile(conn, compile_kwargs={'literal_binds': True})}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+            conn.execute(text(ddl))
+
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all не трогает уже существующие таблицы — досоздаём новые колонки и индексы
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
 
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
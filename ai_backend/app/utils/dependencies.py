@@ -1,13 +1,17 @@
 # app/utils/dependencies.py
+from typing import Optional
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlmodel import Session, select
 
 from utils.db import get_session
 from utils.security import decode_token
+from utils.principal import Principal, load_principal
 from models.user import User
 
 security = HTTPBearer(auto_error=True)
+optional_security = HTTPBearer(auto_error=False)
 
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
@@ -23,7 +27,32 @@ def get_current_user(
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive or blocked")
     return user
 
-def require_admin(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> Principal:
+    """
+    Лёгкая альтернатива get_current_user: только id и флаги доступа,
+    из кеша (без сессии БД на попадании). Полный User — через get_current_user.
+    """
+    payload = decode_token(credentials.credentials)
+    principal = await load_principal(int(payload.get("sub", 0)))
+    if principal is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+    if not principal.is_active or principal.is_blocked:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is inactive or blocked")
+    return principal
+
+async def get_current_principal_optional(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+) -> Optional[Principal]:
+    """
+    Как get_current_principal, но без токена возвращает None (для публичных эндпоинтов).
+    """
+    if credentials is None:
+        return None
+    return await get_current_principal(credentials)
+
+def require_admin(current_user: Principal = Depends(get_current_principal)) -> Principal:
     if not current_user.is_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
-    return current_user
\ No newline at end of file
+    return current_user
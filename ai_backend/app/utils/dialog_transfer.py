@@ -0,0 +1,301 @@
+# utils/dialog_transfer.py
+"""
+Выгрузка и загрузка диалогов в gzip JSONL — для бэкапов и переноса между БД
+(например, SQLite разработки -> Postgres).
+
+Формат: по строке на запись, сначала диалог, за ним его сообщения:
+    {"type": "dialog", "id": 7, "user_id": 1, "character_id": 3, "started_at": ..., "closed_at": null}
+    {"type": "message", "dialog_id": 7, "role": "user", "content": "...", "created_at": ...}
+
+Выгрузка — один запрос Dialog LEFT JOIN Message с серверным курсором
+(yield_per), gzip сжимается потоково: память не зависит от объёма.
+Загрузка читает поток построчно и вставляет пачками по IMPORT_BATCH_SIZE;
+id диалогов и сообщений выдаёт целевая БД (старые id диалогов
+сопоставляются с новыми), повторная загрузка не создаёт дублей.
+Ошибки формата файла — ValueError (HTTP-слой отвечает на них 400).
+Пользователи и персонажи не переносятся — в целевой БД они должны быть
+заранее, с теми же id (или диалоги переназначаются через user_id/character_id).
+Сводки (DialogSummary) не переносятся — они пересоздаются при следующих
+ходах диалога.
+"""
+import gzip
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import IO, Callable, Dict, Iterator, List, Optional, Set
+
+import orjson
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from config import settings
+from models.character import Character
+from models.dialog import Dialog
+from models.message import Message
+from models.user import User
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+_FLUSH_BYTES = 64 * 1024
+
+
+def _dialog_filter(user_id: Optional[int], character_id: Optional[int]) -> list:
+    where = []
+    if user_id is not None:
+        where.append(Dialog.user_id == user_id)
+    if character_id is not None:
+        where.append(Dialog.character_id == character_id)
+    return where
+
+
+def iter_export_lines(
+    session: Session, user_id: Optional[int] = None, character_id: Optional[int] = None
+) -> Iterator[bytes]:
+    """
+    Строки JSONL (без сжатия) диалогов пользователя, персонажа или всей БД.
+    """
+    q = (
+        select(
+            Dialog.id, Dialog.user_id, Dialog.character_id, Dialog.started_at, Dialog.closed_at,
+            Message.id, Message.role, Message.content, Message.created_at,
+        )
+        .select_from(Dialog)
+        .outerjoin(Message, Message.dialog_id == Dialog.id)
+        .where(*_dialog_filter(user_id, character_id))
+        .order_by(Dialog.id, Message.created_at, Message.id)
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    current = None
+    for d_id, d_user, d_character, started_at, closed_at, m_id, role, content, created_at in session.execute(q):
+        if d_id != current:
+            current = d_id
+            yield orjson.dumps({
+                "type": "dialog", "id": d_id, "user_id": d_user, "character_id": d_character,
+                "started_at": started_at, "closed_at": closed_at,
+            }) + b"\n"
+        if m_id is not None:
+            yield orjson.dumps({
+                "type": "message", "dialog_id": d_id,
+                "role": role.value if hasattr(role, "value") else role,
+                "content": content, "created_at": created_at,
+            }) + b"\n"
+
+
+def gzip_chunks(lines: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Потоковое gzip-сжатие: куски примерно по 64 КБ.
+    """
+    compressor = zlib.compressobj(wbits=_GZIP_WBITS)
+    buf = []
+    size = 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            out = compressor.compress(b"".join(buf))
+            buf, size = [], 0
+            if out:
+                yield out
+    yield compressor.compress(b"".join(buf)) + compressor.flush()
+
+
+@dataclass
+class ImportStats:
+    dialogs: int = 0
+    messages: int = 0
+    skipped_dialogs: int = 0
+    # Уже загруженные ранее (повторный импорт того же файла)
+    existing_dialogs: int = 0
+
+
+class _Importer:
+    """
+    Всё состояние — в пределах одной пачки: ссылки на пользователей
+    и персонажей и уже загруженные строки проверяются запросом на пачку,
+    сопоставление старых id диалогов с новыми держится только для пачки
+    (сообщения в файле идут сразу за своим диалогом).
+
+    Повторная загрузка не дублирует данные: диалог считается уже загруженным,
+    если в БД есть диалог того же пользователя и персонажа с тем же started_at,
+    а его сообщение — если есть сообщение с той же ролью, created_at и текстом
+    (с учётом числа совпадений: одинаковые сообщения в файле не схлопываются).
+    Так прерванный импорт можно просто запустить заново.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        user_id: Optional[int],
+        character_id: Optional[int],
+        batch_size: int,
+        on_commit: Optional[Callable[[List[int]], None]],
+    ):
+        self.session = session
+        self.user_id = user_id
+        self.character_id = character_id
+        self.batch_size = batch_size
+        self.on_commit = on_commit
+        self.stats = ImportStats()
+        self.dialog_map: Dict[int, Optional[int]] = {}  # старый id -> новый (None — пропущен)
+        self.resumed: Set[int] = set()  # новые id диалогов, которые уже были в БД
+        self.last_dialog: Optional[int] = None
+        self.pending_dialogs: List[dict] = []
+        self.pending_messages: List[dict] = []
+
+    def add(self, record: dict) -> None:
+        kind = record.get("type")
+        if kind == "dialog":
+            self.pending_dialogs.append(record)
+            self.last_dialog = record["id"]
+            if len(self.pending_dialogs) >= self.batch_size:
+                self.flush()
+        elif kind == "message":
+            if record["dialog_id"] != self.last_dialog:
+                raise ValueError(f"Message outside its dialog {record['dialog_id']}")
+            self.pending_messages.append(record)
+            if len(self.pending_messages) >= self.batch_size:
+                self.flush()
+        else:
+            raise ValueError(f"Unknown record type: {kind!r}")
+
+    def _existing_ids(self, column, ids: Set[int]) -> Set[int]:
+        if not ids:
+            return set()
+        return set(self.session.exec(select(column).where(column.in_(ids))).all())
+
+    def flush_dialogs(self) -> None:
+        records = []
+        for rec in self.pending_dialogs:
+            user_id = self.user_id if self.user_id is not None else rec["user_id"]
+            character_id = self.character_id if self.character_id is not None else rec["character_id"]
+            records.append((rec, user_id, character_id, datetime.fromisoformat(rec["started_at"])))
+        self.pending_dialogs = []
+        if not records:
+            return
+
+        users = self._existing_ids(User.id, {r[1] for r in records})
+        characters = self._existing_ids(Character.id, {r[2] for r in records})
+        existing = {
+            (u, c, started_at): d_id
+            for d_id, u, c, started_at in self.session.exec(
+                select(Dialog.id, Dialog.user_id, Dialog.character_id, Dialog.started_at).where(
+                    Dialog.user_id.in_(users), Dialog.started_at.in_({r[3] for r in records})
+                )
+            )
+        }
+
+        rows, old_ids = [], []
+        for rec, user_id, character_id, started_at in records:
+            if user_id not in users or character_id not in characters:
+                self.dialog_map[rec["id"]] = None
+                self.stats.skipped_dialogs += 1
+                continue
+            found = existing.get((user_id, character_id, started_at))
+            if found is not None:
+                self.dialog_map[rec["id"]] = found
+                self.resumed.add(found)
+                self.stats.existing_dialogs += 1
+                continue
+            old_ids.append(rec["id"])
+            rows.append({
+                "user_id": user_id,
+                "character_id": character_id,
+                "started_at": started_at,
+                "closed_at": datetime.fromisoformat(rec["closed_at"]) if rec.get("closed_at") else None,
+            })
+        if not rows:
+            return
+        new_ids = self.session.execute(
+            insert(Dialog).returning(Dialog.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        self.dialog_map.update(zip(old_ids, new_ids))
+        self.stats.dialogs += len(new_ids)
+
+    @staticmethod
+    def _message_key(row: dict) -> tuple:
+        return row["dialog_id"], row["role"], row["created_at"], row["content"]
+
+    def _existing_messages(self, rows: List[dict]) -> Counter:
+        # Дубли возможны только в диалогах, которые уже были в БД
+        resumed = [r for r in rows if r["dialog_id"] in self.resumed]
+        if not resumed:
+            return Counter()
+        q = select(Message.dialog_id, Message.role, Message.created_at, Message.content).where(
+            Message.dialog_id.in_({r["dialog_id"] for r in resumed}),
+            Message.created_at.in_({r["created_at"] for r in resumed}),
+        )
+        return Counter(
+            (d_id, role.value if hasattr(role, "value") else role, created_at, content)
+            for d_id, role, created_at, content in self.session.exec(q)
+        )
+
+    def flush(self) -> None:
+        self.flush_dialogs()
+        rows = []
+        for rec in self.pending_messages:
+            dialog_id = self.dialog_map[rec["dialog_id"]]
+            if dialog_id is None:
+                continue
+            rows.append({
+                "dialog_id": dialog_id,
+                "role": rec["role"],
+                "content": rec["content"],
+                "created_at": datetime.fromisoformat(rec["created_at"]),
+            })
+        self.pending_messages = []
+        existing = self._existing_messages(rows)
+        if existing:
+            fresh = []
+            for r in rows:
+                key = self._message_key(r)
+                if existing[key]:
+                    existing[key] -= 1
+                else:
+                    fresh.append(r)
+            rows = fresh
+        if rows:
+            self.session.execute(insert(Message), rows)
+            self.stats.messages += len(rows)
+        self.session.commit()
+
+        touched = [d_id for d_id in self.dialog_map.values() if d_id is not None]
+        # Сообщения следующей пачки могут относиться только к последнему диалогу
+        last = self.dialog_map.get(self.last_dialog, None)
+        self.dialog_map = {self.last_dialog: last} if self.last_dialog in self.dialog_map else {}
+        self.resumed = {last} if last in self.resumed else set()
+        if touched and self.on_commit:
+            self.on_commit(touched)
+
+
+def import_dialogs(
+    session: Session,
+    stream: IO[bytes],
+    user_id: Optional[int] = None,
+    character_id: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    on_commit: Optional[Callable[[List[int]], None]] = None,
+) -> ImportStats:
+    """
+    Загружает gzip JSONL из двоичного потока. user_id/character_id — переназначить все
+    диалоги на этого пользователя/персонажа; иначе берутся из файла, а диалоги
+    с отсутствующими в БД пользователем или персонажем пропускаются (пользователи
+    и персонажи не переносятся — в целевой БД они должны быть с теми же id).
+    Уже загруженные диалоги и сообщения не дублируются.
+    Коммит — после каждой пачки; on_commit получает id затронутых ею диалогов.
+    Битый файл — ValueError (уже закоммиченные пачки остаются).
+    """
+    importer = _Importer(session, user_id, character_id, batch_size or settings.IMPORT_BATCH_SIZE, on_commit)
+    try:
+        with gzip.GzipFile(fileobj=stream, mode="rb") as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    raise ValueError("Invalid JSONL line")
+                importer.add(record)
+    except (gzip.BadGzipFile, EOFError):
+        raise ValueError("Not a gzip file or truncated")
+    importer.flush()
+    return importer.stats
@@ -1,25 +1,261 @@
 # app/utils/email.py
-import os
+"""
+Отправка писем в фоне.
+
+send_signup_link только кладёт письмо в очередь и сразу возвращает управление.
+Несколько фоновых потоков (EMAIL_WORKERS) держат каждый своё постоянное
+SMTP-соединение и отправляют письма пачками по EMAIL_BATCH_SIZE без
+переподключения. Временные ошибки (4xx, обрыв связи) повторяются с
+экспоненциальной задержкой, постоянные (5xx) — отбрасываются с записью в лог.
+EMAIL_BACKEND=console печатает письма в консоль (как раньше), smtp — шлёт
+через SMTP_HOST:SMTP_PORT (локально — Mailpit из docker-compose).
+"""
+import heapq
+import itertools
+import logging
+import queue
+import random
 import smtplib
-from email.mime.text import MIMEText
+import threading
+import time
+from dataclasses import dataclass
+from email.message import EmailMessage
+from typing import List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SUBJECT_SIGNUP = "Подтверждение регистрации"
+
+
+@dataclass
+class OutgoingEmail:
+    to: str
+    subject: str
+    body: str
+    attempts: int = 0
+
+    def to_message(self) -> EmailMessage:
+        msg = EmailMessage()
+        msg["Subject"] = self.subject
+        msg["From"] = settings.EMAIL_FROM
+        msg["To"] = self.to
+        msg.set_content(self.body)
+        return msg
+
+
+class _Transient(Exception):
+    """Ошибку стоит повторить позже."""
+
+
+class SMTPConnection:
+    """
+    Постоянное SMTP-соединение одного воркера: открывается лениво,
+    закрывается после SMTP_IDLE_TIMEOUT секунд простоя.
+    """
+
+    def __init__(self):
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT)
+        if settings.SMTP_TLS:
+            smtp.starttls()
+        if settings.SMTP_USERNAME:
+            smtp.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+        return smtp
+
+    def send(self, email: OutgoingEmail) -> None:
+        msg = email.to_message()
+        # Один повтор сразу: сервер мог закрыть простаивавшее соединение
+        for reconnect in (False, True):
+            try:
+                if self._smtp is None or reconnect:
+                    self.close()
+                    self._smtp = self._connect()
+                self._smtp.send_message(msg)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.close()
+                if reconnect:
+                    raise _Transient("server disconnected")
+            except smtplib.SMTPRecipientsRefused:
+                raise
+            except smtplib.SMTPResponseException as e:
+                if 400 <= e.smtp_code < 500:
+                    raise _Transient(f"{e.smtp_code} {e.smtp_error!r}")
+                raise
+            except OSError as e:
+                self.close()
+                raise _Transient(repr(e))
+
+    def close_if_idle(self) -> None:
+        if self._smtp is not None and time.monotonic() - self._last_used > settings.SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
+
+
+class ConsoleConnection:
+    """
+    Бэкенд для разработки: письмо печатается в консоль.
+    """
+
+    def send(self, email: OutgoingEmail) -> None:
+        print(f"[EMAIL] To {email.to}: {email.subject}\n{email.body}")
+
+    def close_if_idle(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class EmailOutbox:
+    """
+    Очередь исходящих писем и пул воркеров с постоянными соединениями.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[OutgoingEmail]]" = queue.Queue(maxsize=settings.EMAIL_QUEUE_SIZE)
+        self._retry: List[tuple] = []  # (когда, порядковый номер, письмо)
+        self._retry_lock = threading.Lock()
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(settings.EMAIL_WORKERS):
+                t = threading.Thread(target=self._worker, name=f"email-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Дожидается отправки уже поставленных писем (не дольше timeout).
+        """
+        with self._start_lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        self._stopping.set()
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for t in threads:
+            t.join(max(deadline - time.monotonic(), 0))
+        with self._retry_lock:
+            if self._retry:
+                logger.error(
+                    "%d letters left unsent on shutdown: %s",
+                    len(self._retry), ", ".join(email.to for _, _, email in self._retry),
+                )
+                self._retry.clear()
+
+    def enqueue(self, email: OutgoingEmail) -> bool:
+        """
+        Ставит письмо в очередь. False — очередь переполнена, письмо не принято.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait(email)
+            return True
+        except queue.Full:
+            logger.warning("email queue full, dropped letter to %s", email.to)
+            return False
+
+    def _schedule_retry(self, email: OutgoingEmail, reason: str) -> None:
+        email.attempts += 1
+        if email.attempts > settings.EMAIL_MAX_RETRIES:
+            logger.error("giving up on %s after %d attempts: %s", email.to, email.attempts, reason)
+            return
+        delay = settings.EMAIL_RETRY_BASE * 2 ** (email.attempts - 1)
+        delay = min(delay, 300) * random.uniform(0.5, 1.5)
+        with self._retry_lock:
+            heapq.heappush(self._retry, (time.monotonic() + delay, next(self._seq), email))
+
+    def _due_retries(self, limit: int) -> List[OutgoingEmail]:
+        now = time.monotonic()
+        due = []
+        with self._retry_lock:
+            while self._retry and self._retry[0][0] <= now and len(due) < limit:
+                due.append(heapq.heappop(self._retry)[2])
+        return due
 
-SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
-SMTP_PORT = int(os.getenv("SMTP_PORT", 1025))
+    def _next_batch(self) -> Optional[List[OutgoingEmail]]:
+        """
+        Пачка писем для одного прохода; None — пора завершаться.
+        """
+        size = settings.EMAIL_BATCH_SIZE
+        batch = self._due_retries(size)
+        stop = False
+        if not batch:
+            try:
+                first = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                return batch
+            if first is None:
+                return None
+            batch.append(first)
+        while len(batch) < size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        if stop:
+            # Сигнал остановки вернём в очередь, чтобы сперва отправить пачку
+            self._queue.put(None)
+        return batch
 
-def send_signup_link(email: str, link: str):
-    # subject = "Подтверждение регистрации"
-    # body = f"Перейдите по ссылке для завершения регистрации: {link}"
+    def _worker(self) -> None:
+        conn = SMTPConnection() if settings.EMAIL_BACKEND.lower() == "smtp" else ConsoleConnection()
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                if not batch:
+                    conn.close_if_idle()
+                    continue
+                for email in batch:
+                    try:
+                        conn.send(email)
+                    except _Transient as e:
+                        if self._stopping.is_set():
+                            logger.warning("email to %s not sent on shutdown: %s", email.to, e)
+                        else:
+                            self._schedule_retry(email, str(e))
+                    except Exception:
+                        logger.exception("failed to send email to %s", email.to)
+        finally:
+            conn.close()
 
-    # msg = MIMEText(body, "plain", "utf-8")
-    # msg["Subject"] = subject
-    # msg["From"] = "no-reply@example.com"
-    # msg["To"] = email
 
-    # with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-    #     server.sendmail(msg["From"], [msg["To"]], msg.as_string())
+outbox = EmailOutbox()
 
-    print(f"[SIGNUP LINK] Sent to {email}: {link}")
 
-# def send_signup_link(email: str, link: str):
-#     # В реальном проекте отправляйте письмо через SMTP / сервисы
-#     print(f"[SIGNUP LINK] Send to {email}: {link}")
\ No newline at end of file
+def send_signup_link(email: str, link: str) -> bool:
+    """
+    Ставит письмо со ссылкой регистрации в очередь и сразу возвращается.
+    """
+    body = f"Перейдите по ссылке для завершения регистрации: {link}"
+    return outbox.enqueue(OutgoingEmail(to=email, subject=SUBJECT_SIGNUP, body=body))
@@ -0,0 +1,44 @@
+# utils/fast_json.py
+"""
+Быстрая сериализация больших списков.
+
+Вместо ORM-объектов и model_validate/model_copy на каждую строку: выбираем
+из БД только нужные колонки (кортежи), проверяем весь список одним вызовом
+TypeAdapter.validate_python и сразу получаем JSON-байты через dump_json
+(pydantic-core). Хендлер возвращает FastJSONResponse с готовыми байтами —
+FastAPI не прогоняет их повторно через response_model и jsonable_encoder.
+Замер до/после: bench/bench_serialization.py.
+"""
+from functools import lru_cache
+from typing import Any, Iterable, List, Sequence, Type
+
+import orjson
+from fastapi.responses import Response
+from pydantic import BaseModel, TypeAdapter
+
+
+class FastJSONResponse(Response):
+    """
+    JSON-ответ: готовые байты отдаются как есть, остальное — через orjson.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+
+def rows_to_json(model: Type[BaseModel], keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> bytes:
+    """
+    Строки-кортежи (порядок полей — keys) -> проверенный список model -> JSON-байты.
+    """
+    adapter = list_adapter(model)
+    items = adapter.validate_python([dict(zip(keys, row)) for row in rows])
+    return adapter.dump_json(items)
@@ -0,0 +1,272 @@
+# utils/history_cache.py
+"""
+Кеш хвоста истории диалогов в уже сконвертированном (LangChain) виде.
+
+Запись на диалог хранит системные сообщения, текст сводки, границу сводки
+(floor_id) и последние реплики после неё. add_message дописывает реплики
+в хвост, поэтому для «горячего» диалога сборка контекста не читает историю
+из БД вовсе. Бэкенд выбирается HISTORY_CACHE_BACKEND: memory | redis | none.
+
+У каждого диалога есть поколение (generation): invalidate и append его меняют,
+а set пишет запись, только если поколение не изменилось с момента get/generation.
+Так ход, начавший собирать контекст до новой сводки или новой реплики, не вернёт
+в кеш устаревшие floor_id и summary и не затрёт дописанный append хвост.
+"""
+import itertools
+import json
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage
+
+from config import settings
+from models.message import Message
+from utils.cache import LRUCache, get_redis
+from utils.chat import estimate_tokens, to_langchain_messages
+
+
+@dataclass
+class HistoryItem:
+    id: int
+    role: str
+    content: str
+    created_at: datetime
+    tokens: int = 0
+    lc: Optional[BaseMessage] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.tokens:
+            self.tokens = estimate_tokens(self.content)
+        if self.lc is None:
+            self.lc = to_langchain_messages([self])[0]
+
+    @classmethod
+    def from_message(cls, m: Message) -> "HistoryItem":
+        role = m.role.value if hasattr(m.role, "value") else m.role
+        return cls(id=m.id, role=role, content=m.content, created_at=m.created_at)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "id": self.id,
+            "role": self.role,
+            "content": self.content,
+            "created_at": self.created_at.isoformat(),
+            "tokens": self.tokens,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "HistoryItem":
+        d = json.loads(raw)
+        d["created_at"] = datetime.fromisoformat(d["created_at"])
+        return cls(**d)
+
+
+@dataclass
+class HistoryEntry:
+    pinned: List[HistoryItem]
+    summary: Optional[str]
+    floor_id: int  # в items только сообщения с id > floor_id
+    items: List[HistoryItem]  # по возрастанию времени
+    complete: bool  # items покрывают всё после floor_id, в БД старше ничего нет
+    generation: int = 0  # поколение кеша, из которого прочитана запись
+
+    def copy(self) -> "HistoryEntry":
+        """
+        Копия со своим списком items — закешированную запись не меняем на месте.
+        """
+        return replace(self, items=list(self.items))
+
+
+# Поколения memory-бэкенда: монотонные, уникальные в процессе
+_generations = itertools.count(1)
+
+
+class MemoryHistoryCache:
+    """
+    Кеш в памяти процесса: LRU по диалогам, хвост ограничен max_messages.
+    Значение — (поколение, запись); после invalidate запись None, а поколение новое.
+    """
+
+    def __init__(self, max_dialogs: int, max_messages: int):
+        self.max_messages = max_messages
+        self._lru = LRUCache(max_dialogs)
+
+    async def get(self, dialog_id: int) -> Optional[HistoryEntry]:
+        value = self._lru.get(dialog_id)
+        return value[1] if value else None
+
+    async def generation(self, dialog_id: int) -> int:
+        value = self._lru.get(dialog_id)
+        return value[0] if value else 0
+
+    async def set(self, dialog_id: int, entry: HistoryEntry) -> None:
+        if await self.generation(dialog_id) != entry.generation:
+            return
+        _trim(entry, self.max_messages)
+        self._lru.set(dialog_id, (entry.generation, entry))
+
+    async def append(self, dialog_id: int, item: HistoryItem) -> None:
+        # Новое поколение даже без записи: сборка по БД могла не увидеть реплику
+        generation = next(_generations)
+        entry = await self.get(dialog_id)
+        if entry is not None:
+            if entry.items and entry.items[-1].id >= item.id:
+                generation = entry.generation
+            else:
+                entry = replace(entry, items=entry.items + [item], generation=generation)
+                _trim(entry, self.max_messages)
+        self._lru.set(dialog_id, (generation, entry))
+
+    async def invalidate(self, dialog_id: int) -> None:
+        self._lru.set(dialog_id, (next(_generations), None))
+
+
+# KEYS: meta, items, gen; ARGV: реплика (JSON), её id, max_messages, ttl.
+# Хвост обрезан — старшие реплики придётся дочитать из БД (complete = false);
+# meta правится заменой строки: cjson превратил бы пустой pinned в {}
+_APPEND_LUA = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+local meta = redis.call('GET', KEYS[1])
+if not meta then
+    return 0
+end
+local last = redis.call('LINDEX', KEYS[2], -1)
+if last and cjson.decode(last)['id'] >= tonumber(ARGV[2]) then
+    return 0
+end
+local length = redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+if length > tonumber(ARGV[3]) then
+    redis.call('LTRIM', KEYS[2], -tonumber(ARGV[3]), -1)
+    meta = string.gsub(meta, '"complete": true', '"complete": false')
+end
+redis.call('SET', KEYS[1], meta, 'EX', ARGV[4])
+return 1
+"""
+
+
+class RedisHistoryCache:
+    """
+    Кеш в Redis: общий для всех воркеров. meta — JSON с pinned/summary/floor,
+    items — список реплик (RPUSH/LTRIM). Вытеснение — TTL и политика maxmemory сервера.
+    """
+
+    def __init__(self, max_messages: int, ttl: int):
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(dialog_id: int):
+        return f"history:{dialog_id}:meta", f"history:{dialog_id}:items"
+
+    @staticmethod
+    def _gen_key(dialog_id: int) -> str:
+        return f"history:{dialog_id}:gen"
+
+    async def generation(self, dialog_id: int) -> int:
+        return int(await get_redis().get(self._gen_key(dialog_id)) or 0)
+
+    async def get(self, dialog_id: int) -> Optional[HistoryEntry]:
+        r = get_redis()
+        meta_key, items_key = self._keys(dialog_id)
+        async with r.pipeline(transaction=True) as pipe:
+            meta_raw, items_raw, gen = await (
+                pipe.get(meta_key).lrange(items_key, 0, -1).get(self._gen_key(dialog_id)).execute()
+            )
+        if not meta_raw:
+            return None
+        meta = json.loads(meta_raw)
+        return HistoryEntry(
+            pinned=[HistoryItem.from_json(x) for x in meta["pinned"]],
+            summary=meta["summary"],
+            floor_id=meta["floor_id"],
+            items=[HistoryItem.from_json(x) for x in items_raw],
+            complete=meta["complete"],
+            generation=int(gen or 0),
+        )
+
+    async def set(self, dialog_id: int, entry: HistoryEntry) -> None:
+        _trim(entry, self.max_messages)
+        r = get_redis()
+        meta_key, items_key = self._keys(dialog_id)
+        meta = json.dumps({
+            "pinned": [x.to_json() for x in entry.pinned],
+            "summary": entry.summary,
+            "floor_id": entry.floor_id,
+            "complete": entry.complete,
+        }, ensure_ascii=False)
+        from redis.exceptions import WatchError  # пакет redis нужен только этому бэкенду
+
+        gen_key = self._gen_key(dialog_id)
+        async with r.pipeline(transaction=True) as pipe:
+            try:
+                # Запись — только если за это время не было invalidate
+                await pipe.watch(gen_key)
+                if int(await pipe.get(gen_key) or 0) != entry.generation:
+                    return
+                pipe.multi()
+                pipe.delete(items_key)
+                if entry.items:
+                    pipe.rpush(items_key, *[x.to_json() for x in entry.items])
+                    pipe.expire(items_key, self.ttl)
+                pipe.set(meta_key, meta, ex=self.ttl)
+                await pipe.execute()
+            except WatchError:
+                return
+
+    async def append(self, dialog_id: int, item: HistoryItem) -> None:
+        # Один скрипт — один round trip, и между RPUSH, LTRIM и правкой meta
+        # не вклинится ни set, ни invalidate
+        await get_redis().eval(
+            _APPEND_LUA, 3, *self._keys(dialog_id), self._gen_key(dialog_id),
+            item.to_json(), item.id, self.max_messages, self.ttl,
+        )
+
+    async def invalidate(self, dialog_id: int) -> None:
+        gen_key = self._gen_key(dialog_id)
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.delete(*self._keys(dialog_id))
+            pipe.incr(gen_key)
+            pipe.expire(gen_key, self.ttl)
+            await pipe.execute()
+
+
+class NullHistoryCache:
+    """
+    Кеш выключен: всегда промах.
+    """
+
+    async def get(self, dialog_id: int) -> Optional[HistoryEntry]:
+        return None
+
+    async def generation(self, dialog_id: int) -> int:
+        return 0
+
+    async def set(self, dialog_id: int, entry: HistoryEntry) -> None:
+        pass
+
+    async def append(self, dialog_id: int, item: HistoryItem) -> None:
+        pass
+
+    async def invalidate(self, dialog_id: int) -> None:
+        pass
+
+
+def _trim(entry: HistoryEntry, max_messages: int) -> None:
+    if len(entry.items) > max_messages:
+        del entry.items[:-max_messages]
+        entry.complete = False
+
+
+def _create_history_cache():
+    backend = settings.HISTORY_CACHE_BACKEND.lower()
+    if backend == "redis":
+        return RedisHistoryCache(settings.HISTORY_CACHE_MAX_MESSAGES, settings.HISTORY_CACHE_TTL)
+    if backend == "memory":
+        return MemoryHistoryCache(settings.HISTORY_CACHE_MAX_DIALOGS, settings.HISTORY_CACHE_MAX_MESSAGES)
+    return NullHistoryCache()
+
+
+history_cache = _create_history_cache()
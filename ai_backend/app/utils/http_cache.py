@@ -0,0 +1,84 @@
+# utils/http_cache.py
+"""
+Условные GET для персонажей: ETag и 304 без сборки ответа.
+
+Версия ответа считается дёшево, без чтения и сериализации строк:
+- список — агрегат по тем же условиям, что и выборка: число строк, max(id),
+  max(created_at) и сумма Character.version (версия растёт при любом
+  изменении строки: профиль, блокировка, счётчики голосов);
+- персонаж — его version;
+- плюс User.votes_version текущего пользователя (меняется при каждом его
+  голосе — от этого зависит my_vote).
+Last-Modified не отдаём: времени изменения счётчиков и голосов в данных нет,
+а время «когда воркер увидел версию» у воркеров разное и сбрасывается
+при рестарте. Клиенты проверяют свежесть по ETag (If-None-Match).
+
+Публичный список для анонимов дополнительно держится готовыми байтами
+HTTP_PUBLIC_LIST_TTL секунд — повторные запросы в это окно не трогают БД.
+"""
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from config import settings
+from models.character import Character
+from models.user import User
+from utils.cache import LRUCache
+
+# Готовые ответы публичного списка для анонимов: ключ -> (Validators, bytes)
+public_lists = LRUCache(maxsize=64, ttl=settings.HTTP_PUBLIC_LIST_TTL)
+
+
+@dataclass
+class Validators:
+    etag: str
+
+    def headers(self, public: bool = False, max_age: int = 0) -> dict:
+        cache_control = f"public, max-age={max_age}" if public else "private, no-cache"
+        return {
+            "ETag": self.etag,
+            "Cache-Control": cache_control,
+            "Vary": "Authorization",
+        }
+
+
+def make_validators(*parts: Any) -> Validators:
+    return Validators('"' + hashlib.sha1(repr(parts).encode()).hexdigest() + '"')
+
+
+def list_version(session: Session, *where) -> tuple:
+    return tuple(
+        session.exec(
+            select(
+                func.count(Character.id),
+                func.max(Character.id),
+                func.max(Character.created_at),
+                func.coalesce(func.sum(Character.version), 0),
+            ).where(*where)
+        ).one()
+    )
+
+
+def user_votes_version(session: Session, user_id: Optional[int]) -> Optional[int]:
+    if not user_id:
+        return None
+    return session.exec(select(User.votes_version).where(User.id == user_id)).first()
+
+
+def is_not_modified(request: Request, validators: Validators) -> bool:
+    """
+    If-None-Match совпадает с текущей версией.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or validators.etag in tags
+
+
+def not_modified(validators: Validators, public: bool = False, max_age: int = 0) -> Response:
+    return Response(status_code=304, headers=validators.headers(public, max_age))
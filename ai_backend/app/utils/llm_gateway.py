@@ -0,0 +1,178 @@
+# utils/llm_gateway.py
+"""
+Шлюз к LLM: общие пулы HTTP-соединений и ограничение параллельных вызовов.
+
+Все клиенты ChatOpenAI работают через один httpx.AsyncClient/httpx.Client
+(keep-alive к API Yandex переиспользуется между моделями и температурами).
+Для каждой модели из MODEL_NAMES действует лимит одновременных запросов
+(LLM_MAX_IN_FLIGHT); остальные ждут в очереди не дольше LLM_QUEUE_TIMEOUT,
+а если очередь длиннее LLM_MAX_QUEUE — сразу получают 503, а не копятся
+и не вызывают шквал 429 от Yandex. Ограничиваются асинхронные вызовы
+(ainvoke/astream) — ими пользуются все эндпоинты.
+"""
+import asyncio
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge, Histogram
+
+from config import settings
+
+LLM_IN_FLIGHT = Gauge("llm_in_flight", "Выполняющиеся запросы к LLM", ["model"])
+LLM_QUEUED = Gauge("llm_queued", "Запросы к LLM, ждущие свободного слота", ["model"])
+LLM_QUEUE_SECONDS = Histogram("llm_queue_seconds", "Ожидание слота для запроса к LLM", ["model"])
+LLM_REJECTED = Counter("llm_rejected_total", "Запросы к LLM, отклонённые с 503", ["model", "reason"])
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+    )
+
+
+def get_http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """
+    Общие HTTP-клиенты (пулы соединений) для всех моделей.
+    """
+    global _http_client, _http_async_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=_limits(), timeout=settings.LLM_HTTP_TIMEOUT)
+    if _http_async_client is None:
+        _http_async_client = httpx.AsyncClient(limits=_limits(), timeout=settings.LLM_HTTP_TIMEOUT)
+    return _http_client, _http_async_client
+
+
+async def close_http_clients() -> None:
+    global _http_client, _http_async_client
+    # Клиенты моделей держат ссылки на закрываемые пулы
+    _models.clear()
+    if _http_async_client is not None:
+        await _http_async_client.aclose()
+        _http_async_client = None
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+
+
+def _overloaded(model_id: str, reason: str) -> HTTPException:
+    LLM_REJECTED.labels(model_id, reason).inc()
+    return HTTPException(
+        status_code=503,
+        detail="LLM is overloaded, try again later",
+        headers={"Retry-After": str(max(int(settings.LLM_QUEUE_TIMEOUT), 1))},
+    )
+
+
+class ModelGate:
+    """
+    Ограничитель одновременных запросов к одной модели с очередью ожидания.
+    """
+
+    def __init__(self, model_id: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.model_id = model_id
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._sem = asyncio.Semaphore(max_in_flight)
+        self._waiting = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self._sem.locked() and self._waiting >= self.max_queue
+
+    def admit(self) -> None:
+        """
+        Быстрая проверка перед началом работы: очередь переполнена — 503.
+        """
+        if self.saturated:
+            raise _overloaded(self.model_id, "queue_full")
+
+    @asynccontextmanager
+    async def slot(self):
+        self.admit()
+        started = time.perf_counter()
+        self._waiting += 1
+        LLM_QUEUED.labels(self.model_id).inc()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise _overloaded(self.model_id, "timeout")
+        finally:
+            self._waiting -= 1
+            LLM_QUEUED.labels(self.model_id).dec()
+        LLM_QUEUE_SECONDS.labels(self.model_id).observe(time.perf_counter() - started)
+        LLM_IN_FLIGHT.labels(self.model_id).inc()
+        try:
+            yield
+        finally:
+            self._sem.release()
+            LLM_IN_FLIGHT.labels(self.model_id).dec()
+
+
+class GatedLLM:
+    """
+    Обёртка над LangChain-моделью: ainvoke/astream занимают слот модели.
+    Остальные атрибуты проксируются к исходной модели.
+    """
+
+    def __init__(self, llm, gate: ModelGate):
+        self.llm = llm
+        self.gate = gate
+
+    def admit(self) -> None:
+        self.gate.admit()
+
+    async def ainvoke(self, input: Any, *args, **kwargs):
+        async with self.gate.slot():
+            return await self.llm.ainvoke(input, *args, **kwargs)
+
+    async def astream(self, input: Any, *args, **kwargs) -> AsyncIterator:
+        # Слот держится всё время генерации ответа
+        async with self.gate.slot():
+            async with aclosing(self.llm.astream(input, *args, **kwargs)) as stream:
+                async for chunk in stream:
+                    yield chunk
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+
+_gates: Dict[str, ModelGate] = {}
+_models: Dict[Tuple[str, float], GatedLLM] = {}
+
+
+def get_gate(model_id: str) -> ModelGate:
+    gate = _gates.get(model_id)
+    if gate is None:
+        gate = _gates[model_id] = ModelGate(
+            model_id,
+            max_in_flight=settings.LLM_MAX_IN_FLIGHT[model_id],
+            max_queue=settings.LLM_MAX_QUEUE,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+        )
+    return gate
+
+
+def get_gated_llm(model_id: str, temperature: float) -> GatedLLM:
+    """
+    Клиент модели на общих пулах соединений, с лимитом параллельных вызовов.
+    Лимит общий для всех температур одной модели.
+    """
+    key = (model_id, temperature)
+    llm = _models.get(key)
+    if llm is None:
+        http_client, http_async_client = get_http_clients()
+        base = settings.create_yandex_model(
+            model_id=model_id,
+            temperature=temperature,
+            http_client=http_client,
+            http_async_client=http_async_client,
+        )
+        llm = _models[key] = GatedLLM(base, get_gate(model_id))
+    return llm
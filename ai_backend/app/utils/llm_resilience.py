@@ -0,0 +1,282 @@
+# utils/llm_resilience.py
+"""
+Устойчивые вызовы LLM поверх шлюза (utils/llm_gateway.py).
+
+- у каждой попытки свой дедлайн (LLM_ATTEMPT_TIMEOUT), у всего вызова —
+  общий (LLM_TOTAL_TIMEOUT), так что хвост задержек ограничен;
+- временные ошибки (таймауты, обрывы, 429, 5xx) повторяются LLM_RETRIES раз
+  с экспоненциальной задержкой и полным джиттером;
+- на каждую модель — автомат отключения (circuit breaker): после
+  LLM_BREAKER_FAILURES ошибок подряд модель LLM_BREAKER_RESET секунд не
+  вызывается, затем пропускается один пробный запрос;
+- если модель недоступна или перегружена — переходим на следующую из
+  LLM_FALLBACKS (pro_32k -> pro -> lite), если промпт в неё помещается.
+Стрим повторяется и переключается только до первого куска ответа.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from config import settings
+from utils.llm_gateway import get_gate, get_gated_llm
+
+LLM_ATTEMPTS = Counter("llm_attempts_total", "Попытки вызова LLM", ["model", "outcome"])
+LLM_FALLBACKS = Counter("llm_fallbacks_total", "Переключения на запасную модель", ["model"])
+LLM_BREAKER_OPEN = Gauge("llm_breaker_open", "Автомат модели разомкнут (1) или нет (0)", ["model"])
+
+TRANSIENT_STATUS = {408, 409, 425, 429}
+
+
+def is_transient(exc: BaseException) -> bool:
+    """
+    Ошибка, которую имеет смысл повторить (в том числе на другой модели).
+    """
+    if isinstance(exc, (asyncio.TimeoutError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in TRANSIENT_STATUS or exc.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    closed -> (N ошибок подряд) -> open -> (reset_after сек) -> half-open:
+    один пробный вызов; успех замыкает автомат, ошибка снова размыкает.
+    """
+
+    def __init__(self, model_id: str, failures: int, reset_after: float):
+        self.model_id = model_id
+        self.failures = failures
+        self.reset_after = reset_after
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allows(self) -> bool:
+        """
+        Можно ли сейчас звать модель (без захвата пробного вызова).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            return not self._probing and time.monotonic() - self._opened_at >= self.reset_after
+
+    def before_call(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            self._probing = True
+            return True
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probing = False
+        LLM_BREAKER_OPEN.labels(self.model_id).set(0)
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._errors += 1
+            if self._probing or self._errors >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+            opened = self._opened_at is not None
+        LLM_BREAKER_OPEN.labels(self.model_id).set(int(opened))
+
+    def on_skip(self) -> None:
+        """
+        Вызов не состоялся (например, очередь модели переполнена).
+        """
+        with self._lock:
+            self._probing = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model_id: str) -> CircuitBreaker:
+    breaker = _breakers.get(model_id)
+    if breaker is None:
+        breaker = _breakers[model_id] = CircuitBreaker(
+            model_id, settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET
+        )
+    return breaker
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="LLM is temporarily unavailable, try again later",
+        headers={"Retry-After": str(max(int(settings.LLM_BREAKER_RESET), 1))},
+    )
+
+
+def _backoff(attempt: int, remaining: float) -> float:
+    delay = min(settings.LLM_RETRY_BACKOFF * 2 ** attempt, settings.LLM_RETRY_BACKOFF_MAX)
+    return min(random.uniform(0, delay), max(remaining, 0))
+
+
+def _prompt_tokens(prompt: Any) -> int:
+    # utils.chat сам импортирует этот модуль (get_llm)
+    from utils.chat import estimate_tokens
+
+    if isinstance(prompt, str):
+        return estimate_tokens(prompt)
+    total = 0
+    for m in prompt:
+        total += estimate_tokens(m if isinstance(m, str) else str(getattr(m, "content", "")))
+    return total
+
+
+class ResilientLLM:
+    """
+    LLM с повторами, дедлайнами, автоматами и запасными моделями.
+    Интерфейс как у GatedLLM: admit / ainvoke / astream.
+    """
+
+    def __init__(self, model_id: str, temperature: float):
+        self.model_id = model_id
+        self.temperature = temperature
+        # Какая модель ответила на последний вызов (могла быть запасная)
+        self.served_by: Optional[str] = None
+
+    def chain(self, prompt: Any = None) -> List[str]:
+        """
+        Основная модель и запасные, в окно которых помещается промпт.
+        """
+        fallbacks = settings.LLM_FALLBACKS.get(self.model_id, [])
+        if fallbacks and prompt is not None:
+            tokens = _prompt_tokens(prompt)
+            fallbacks = [m for m in fallbacks if settings.context_budget(m) >= tokens]
+        return [self.model_id] + [m for m in fallbacks if m != self.model_id]
+
+    def admit(self) -> None:
+        """
+        Быстрая проверка до начала работы: нет ни одной модели, готовой
+        принять запрос (автомат разомкнут или очередь полна) — 503.
+        """
+        for model_id in self.chain():
+            if get_breaker(model_id).allows() and not get_gate(model_id).saturated:
+                return
+        raise _unavailable()
+
+    async def ainvoke(self, input: Any, *args, **kwargs):
+        deadline = time.monotonic() + settings.LLM_TOTAL_TIMEOUT
+        for i, model_id in enumerate(self.chain(input)):
+            if i:
+                LLM_FALLBACKS.labels(model_id).inc()
+            breaker = get_breaker(model_id)
+            gated = get_gated_llm(model_id, self.temperature)
+            for attempt in range(settings.LLM_RETRIES + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _unavailable()
+                if not breaker.before_call():
+                    break
+                try:
+                    async with gated.gate.slot():
+                        timeout = min(settings.LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+                        result = await asyncio.wait_for(gated.llm.ainvoke(input, *args, **kwargs), timeout)
+                except HTTPException:
+                    # Очередь модели переполнена — сразу к запасной
+                    breaker.on_skip()
+                    LLM_ATTEMPTS.labels(model_id, "rejected").inc()
+                    break
+                except Exception as e:
+                    if not is_transient(e):
+                        breaker.on_skip()
+                        LLM_ATTEMPTS.labels(model_id, "error").inc()
+                        raise
+                    breaker.on_failure()
+                    LLM_ATTEMPTS.labels(model_id, "transient").inc()
+                    if attempt < settings.LLM_RETRIES:
+                        await asyncio.sleep(_backoff(attempt, deadline - time.monotonic()))
+                    continue
+                breaker.on_success()
+                LLM_ATTEMPTS.labels(model_id, "ok").inc()
+                self.served_by = model_id
+                return result
+        raise _unavailable()
+
+    async def astream(self, input: Any, *args, **kwargs) -> AsyncIterator:
+        """
+        Слот модели занят, пока идёт генерация: вызывающий закрывает итератор
+        (contextlib.aclosing), в том числе если перестал читать на середине.
+        """
+        deadline = time.monotonic() + settings.LLM_TOTAL_TIMEOUT
+        for i, model_id in enumerate(self.chain(input)):
+            if i:
+                LLM_FALLBACKS.labels(model_id).inc()
+            breaker = get_breaker(model_id)
+            gated = get_gated_llm(model_id, self.temperature)
+            for attempt in range(settings.LLM_RETRIES + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise _unavailable()
+                if not breaker.before_call():
+                    break
+                started = False
+                try:
+                    async with gated.gate.slot():
+                        stream = gated.llm.astream(input, *args, **kwargs)
+                        try:
+                            timeout = min(settings.LLM_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+                            try:
+                                first = await asyncio.wait_for(stream.__anext__(), timeout)
+                            except StopAsyncIteration:
+                                breaker.on_success()
+                                LLM_ATTEMPTS.labels(model_id, "ok").inc()
+                                self.served_by = model_id
+                                return
+                            breaker.on_success()
+                            LLM_ATTEMPTS.labels(model_id, "ok").inc()
+                            self.served_by = model_id
+                            started = True
+                            yield first
+                            # Дальше повторять нельзя — клиент уже получает текст;
+                            # ограничиваем только паузы между кусками
+                            while True:
+                                try:
+                                    chunk = await asyncio.wait_for(
+                                        stream.__anext__(), settings.LLM_STREAM_IDLE_TIMEOUT
+                                    )
+                                except StopAsyncIteration:
+                                    return
+                                yield chunk
+                        finally:
+                            await stream.aclose()
+                except HTTPException:
+                    if started:
+                        raise
+                    breaker.on_skip()
+                    LLM_ATTEMPTS.labels(model_id, "rejected").inc()
+                    break
+                except Exception as e:
+                    if started:
+                        if is_transient(e):
+                            breaker.on_failure()
+                        raise
+                    if not is_transient(e):
+                        breaker.on_skip()
+                        LLM_ATTEMPTS.labels(model_id, "error").inc()
+                        raise
+                    breaker.on_failure()
+                    LLM_ATTEMPTS.labels(model_id, "transient").inc()
+                    if attempt < settings.LLM_RETRIES:
+                        await asyncio.sleep(_backoff(attempt, deadline - time.monotonic()))
+                    continue
+        raise _unavailable()
+
+    def __getattr__(self, name: str):
+        return getattr(get_gated_llm(self.model_id, self.temperature), name)
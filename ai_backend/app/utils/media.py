@@ -0,0 +1,72 @@
+# utils/media.py
+"""
+Раздача /static (фото персонажей и их уменьшенные копии) с заголовками кеширования.
+
+Загрузки называются по sha256 содержимого (utils/uploads.py), поэтому файл
+под таким URL никогда не меняется: отдаём его с Cache-Control immutable на
+MEDIA_MAX_AGE и ETag = хеш из имени — браузер и прокси больше не спрашивают
+бэкенд при повторных показах каталога. Прочие файлы (старые загрузки
+с именами клиента) кешируются на MEDIA_MUTABLE_MAX_AGE с перепроверкой по ETag.
+If-None-Match -> 304 и Range поддерживает FileResponse из Starlette.
+
+MEDIA_ACCEL_REDIRECT — префикс internal-локации nginx: бэкенд только
+проверяет путь и ставит заголовки, а файл (с Range и 304) отдаёт nginx.
+"""
+import os
+import re
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from config import settings
+
+# <sha256>.<ext> и <sha256>_<size>.webp
+_CONTENT_ADDRESSED_RE = re.compile(r"^([0-9a-f]{64})(?:_\d+)?\.\w+$")
+
+
+def cache_headers(filename: str) -> dict:
+    m = _CONTENT_ADDRESSED_RE.match(filename)
+    if m:
+        return {
+            "cache-control": f"public, max-age={settings.MEDIA_MAX_AGE}, immutable",
+            # Одинаковый на всех воркерах и после переразвёртывания (не зависит от mtime)
+            "etag": f'"{filename}"',
+        }
+    return {"cache-control": f"public, max-age={settings.MEDIA_MUTABLE_MAX_AGE}, must-revalidate"}
+
+
+class MediaFiles(StaticFiles):
+    """
+    StaticFiles с Cache-Control/ETag для контентно-адресуемых файлов
+    и необязательной передачей отдачи nginx через X-Accel-Redirect.
+    Скрытые файлы (недописанные загрузки и уменьшенные копии) не отдаются.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if any(part.startswith(".") for part in path.split(os.sep)):
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = cache_headers(os.path.basename(full_path))
+
+        if settings.MEDIA_ACCEL_REDIRECT and status_code == 200:
+            # ETag, 304 и Range в этом случае — на стороне nginx
+            headers.pop("etag", None)
+            rel = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+            headers["x-accel-redirect"] = settings.MEDIA_ACCEL_REDIRECT.rstrip("/") + "/" + rel
+            return Response(headers=headers)
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,75 @@
+# utils/passwords.py
+"""
+Алгоритмы хеширования паролей. Модуль без зависимостей от приложения —
+его функции выполняются в дочерних процессах пула (utils/security.py).
+
+Форматы хранимой строки (параметры стоимости хранятся в самом хеше,
+поэтому их можно менять без миграции — старые хеши пересчитаются при входе):
+    pbkdf2_sha256$<iterations>$<salt_b64>$<hash_b64>
+    scrypt$<n>$<r>$<p>$<salt_b64>$<hash_b64>
+    <salt_hex>$<hash_hex>  — исходный формат (PBKDF2-SHA256, 100 000 итераций)
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+from typing import Any, Dict
+
+LEGACY_ITERATIONS = 100_000
+SCHEMES = ("pbkdf2_sha256", "scrypt")
+
+
+def _b64(b: bytes) -> str:
+    return base64.b64encode(b).decode().rstrip("=")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.b64decode(s + "=" * (-len(s) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem с запасом: scrypt требует ~128 * n * r байт
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+
+def hash_password(password: str, scheme: str, params: Dict[str, Any]) -> str:
+    salt = secrets.token_bytes(16)
+    if scheme == "pbkdf2_sha256":
+        iterations = params["iterations"]
+        dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(dk)}"
+    if scheme == "scrypt":
+        n, r, p = params["n"], params["r"], params["p"]
+        dk = _scrypt(password, salt, n, r, p)
+        return f"scrypt${n}${r}${p}${_b64(salt)}${_b64(dk)}"
+    raise ValueError(f"Unknown password scheme: {scheme}")
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    try:
+        parts = hashed.split("$")
+        if parts[0] == "pbkdf2_sha256":
+            _, iterations, salt, expected = parts
+            dk = hashlib.pbkdf2_hmac("sha256", password.encode(), _unb64(salt), int(iterations))
+            return hmac.compare_digest(dk, _unb64(expected))
+        if parts[0] == "scrypt":
+            _, n, r, p, salt, expected = parts
+            dk = _scrypt(password, _unb64(salt), int(n), int(r), int(p))
+            return hmac.compare_digest(dk, _unb64(expected))
+        salt, hex_hash = parts
+        dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), LEGACY_ITERATIONS)
+        return hmac.compare_digest(dk.hex(), hex_hash)
+    except Exception:
+        return False
+
+
+def needs_rehash(hashed: str, scheme: str, params: Dict[str, Any]) -> bool:
+    """
+    True, если хеш сделан другой схемой или с другими параметрами стоимости.
+    """
+    parts = hashed.split("$")
+    if parts[0] != scheme:
+        return True
+    if scheme == "pbkdf2_sha256":
+        return int(parts[1]) != params["iterations"]
+    return [int(x) for x in parts[1:4]] != [params["n"], params["r"], params["p"]]
@@ -0,0 +1,81 @@
+# utils/principal.py
+"""
+Кеш «принципала» — минимума данных о пользователе, нужного для проверки
+доступа (id, is_admin, is_active, is_blocked). Горячие эндпоинты берут его
+вместо полного SELECT User на каждый запрос.
+Бэкенд PRINCIPAL_CACHE_BACKEND: memory | redis | none; срок жизни
+PRINCIPAL_CACHE_TTL — верхняя граница задержки блокировки на других воркерах,
+в текущем процессе/Redis блокировка сбрасывает запись сразу.
+"""
+import json
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from sqlmodel import select
+
+from config import settings
+from models.user import User
+from utils.cache import LRUCache, get_redis
+from utils.db import async_session_maker
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    is_admin: bool
+    is_active: bool
+    is_blocked: bool
+
+
+_memory = LRUCache(maxsize=settings.PRINCIPAL_CACHE_MAX, ttl=settings.PRINCIPAL_CACHE_TTL)
+
+
+def _backend() -> str:
+    return settings.PRINCIPAL_CACHE_BACKEND.lower()
+
+
+async def _cache_get(user_id: int) -> Optional[Principal]:
+    backend = _backend()
+    if backend == "memory":
+        return _memory.get(user_id)
+    if backend == "redis":
+        raw = await get_redis().get(f"principal:{user_id}")
+        return Principal(**json.loads(raw)) if raw else None
+    return None
+
+
+async def _cache_set(principal: Principal) -> None:
+    backend = _backend()
+    if backend == "memory":
+        _memory.set(principal.id, principal)
+    elif backend == "redis":
+        await get_redis().set(f"principal:{principal.id}", json.dumps(asdict(principal)), ex=settings.PRINCIPAL_CACHE_TTL)
+
+
+async def invalidate_principal(user_id: int) -> None:
+    """
+    Сбрасывает закешированного принципала (блокировка, смена прав и т.п.).
+    """
+    backend = _backend()
+    if backend == "memory":
+        _memory.pop(user_id)
+    elif backend == "redis":
+        await get_redis().delete(f"principal:{user_id}")
+
+
+async def load_principal(user_id: int) -> Optional[Principal]:
+    """
+    Принципал из кеша, при промахе — один лёгкий SELECT четырёх колонок.
+    """
+    principal = await _cache_get(user_id)
+    if principal is not None:
+        return principal
+    async with async_session_maker() as session:
+        row = (await session.exec(
+            select(User.id, User.is_admin, User.is_active, User.is_blocked).where(User.id == user_id)
+        )).first()
+    if row is None:
+        return None
+    principal = Principal(id=row[0], is_admin=row[1], is_active=row[2], is_blocked=row[3])
+    await _cache_set(principal)
+    return principal
@@ -0,0 +1,135 @@
+# utils/search.py
+"""
+Полнотекстовый поиск персонажей по name/bio.
+
+Postgres: GIN-индекс по выражению to_tsvector(name || bio) — обновляется сам.
+SQLite: отдельная таблица FTS5 character_fts (rowid = character.id), которую
+create_character/update_character обновляют через index_character.
+"""
+import re
+from typing import List, Optional
+
+from sqlalchemy import column, func, literal_column, table, text
+from sqlmodel import Session, select
+
+from config import settings
+from models.character import Character
+from schemas.character import CharacterCard
+from utils.characters import CARD_COLUMNS, card_from_row, fetch_my_votes, interest_filter
+from utils.db import engine
+
+FTS_TABLE = "character_fts"
+fts_table = table(FTS_TABLE, column("rowid"))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_TS_CONFIG_RE = re.compile(r"[a-z_]+")
+
+
+def _is_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def _ts_config() -> str:
+    """
+    Имя конфигурации FTS Postgres. Идёт в SQL литералом (иначе выражение не совпадёт
+    с индексом), поэтому из настроек принимаем только [a-z_]+.
+    """
+    name = settings.SEARCH_TS_CONFIG
+    if not _TS_CONFIG_RE.fullmatch(name):
+        raise ValueError(f"SEARCH_TS_CONFIG must match [a-z_]+, got {name!r}")
+    return name
+
+
+def _pg_document():
+    # Должно совпадать с выражением индекса ix_character_search буквально: с bind-параметрами
+    # вместо '' и ' ' планировщик не сопоставит выражение с индексом
+    return func.to_tsvector(
+        literal_column(f"'{_ts_config()}'"),
+        func.coalesce(Character.name, literal_column("''"))
+        .op("||")(literal_column("' '"))
+        .op("||")(func.coalesce(Character.bio, literal_column("''"))),
+    )
+
+
+def setup_search_index() -> None:
+    """
+    Создаёт поисковые индексы, если их ещё нет (вызывается на старте).
+    """
+    with engine.begin() as conn:
+        if _is_postgres():
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_character_search ON character USING GIN "
+                f"(to_tsvector('{_ts_config()}', coalesce(name, '') || ' ' || coalesce(bio, '')))"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_character_interests ON character USING GIN "
+                "((interests::jsonb) jsonb_path_ops)"
+            ))
+            return
+
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        if exists:
+            return
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, bio, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, bio) "
+            "SELECT id, name, coalesce(bio, '') FROM character"
+        ))
+
+
+def index_character(session: Session, ch: Character) -> None:
+    """
+    Обновляет запись персонажа в FTS5 (в той же транзакции). В Postgres не нужно.
+    """
+    if _is_postgres():
+        return
+    session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": ch.id})
+    session.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, name, bio) VALUES (:id, :name, :bio)"),
+        {"id": ch.id, "name": ch.name, "bio": ch.bio or ""},
+    )
+
+
+def search_characters(
+    session: Session,
+    query: str = "",
+    interests: Optional[List[str]] = None,
+    limit: int = 20,
+    offset: int = 0,
+    user_id: Optional[int] = None,
+) -> List[CharacterCard]:
+    """
+    Поиск публичных персонажей: все слова запроса (по префиксу) в name/bio
+    и все указанные теги в interests. Результаты — по релевантности.
+    """
+    words = _WORD_RE.findall(query or "")
+    q = select(*CARD_COLUMNS).where(Character.is_blocked == False, Character.is_public == True)
+    for tag in interests or []:
+        q = q.where(interest_filter(tag))
+
+    if not words:
+        q = q.order_by(Character.created_at.desc(), Character.id.desc())
+    elif _is_postgres():
+        ts_query = func.to_tsquery(
+            literal_column(f"'{_ts_config()}'"),
+            " & ".join(f"{w}:*" for w in words),
+        )
+        document = _pg_document()
+        q = q.where(document.op("@@")(ts_query)).order_by(func.ts_rank(document, ts_query).desc(), Character.id.desc())
+    else:
+        fts = literal_column(FTS_TABLE)
+        match = " ".join(f'"{w}"*' for w in words)
+        q = (
+            q.join(fts_table, fts_table.c.rowid == Character.id)
+            .where(fts.op("MATCH")(match))
+            .order_by(func.bm25(fts), Character.id.desc())
+        )
+
+    rows = session.exec(q.offset(offset).limit(limit)).all()
+    vmap = fetch_my_votes(session, user_id, [r.id for r in rows])
+    return [card_from_row(r, vmap.get(r.id)) for r in rows]
@@ -1,30 +1,116 @@
 # app/utils/security.py
+import asyncio
 import base64
 import hashlib
 import hmac
 import json
-import secrets
+import multiprocessing
 import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any, Dict, Optional
 
 from fastapi import HTTPException, status
+from prometheus_client import Histogram
+
 from config import settings
+from utils import passwords
+from utils.cache import LRUCache
+
+# --- Password hashing ---
+# Сами алгоритмы — в utils/passwords.py; здесь параметры из настроек и пул процессов.
+# PBKDF2/scrypt держат GIL (или CPU) десятки миллисекунд, поэтому в async-коде
+# хеширование уходит в ProcessPoolExecutor, а число одновременных задач
+# ограничено семафором: лишние запросы ждут в очереди (метрика
+# password_hash_queue_seconds) или получают 503 после PASSWORD_HASH_QUEUE_TIMEOUT.
+PASSWORD_HASH_QUEUE_SECONDS = Histogram(
+    "password_hash_queue_seconds",
+    "Время ожидания свободного слота в пуле хеширования паролей",
+    ["op"],
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "password_hash_seconds",
+    "Время хеширования/проверки пароля в пуле",
+    ["op"],
+)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def _hash_params() -> Dict[str, Any]:
+    if settings.PASSWORD_SCHEME == "scrypt":
+        return {"n": settings.PASSWORD_SCRYPT_N, "r": settings.PASSWORD_SCRYPT_R, "p": settings.PASSWORD_SCRYPT_P}
+    return {"iterations": settings.PASSWORD_PBKDF2_ITERATIONS}
+
 
-# --- Password hashing (PBKDF2-HMAC-SHA256) ---
 def hash_password(password: str) -> str:
-    salt = secrets.token_hex(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), 100_000)
-    return f"{salt}${dk.hex()}"
+    return passwords.hash_password(password, settings.PASSWORD_SCHEME, _hash_params())
 
 def verify_password(password: str, hashed: str) -> bool:
+    return passwords.verify_password(password, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    return passwords.needs_rehash(hashed, settings.PASSWORD_SCHEME, _hash_params())
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if _pool is None and settings.PASSWORD_HASH_WORKERS > 0:
+        # spawn: дочерние процессы не наследуют потоки и соединения родителя
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.PASSWORD_HASH_CONCURRENCY or max(settings.PASSWORD_HASH_WORKERS, 1))
+    return _slots
+
+
+async def _run_in_pool(op: str, fn, *args):
+    slots = _get_slots()
+    started = time.perf_counter()
     try:
-        salt, hex_hash = hashed.split("$", 1)
-        dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), 100_000)
-        return hmac.compare_digest(dk.hex(), hex_hash)
-    except Exception:
-        return False
+        await asyncio.wait_for(slots.acquire(), timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later")
+    PASSWORD_HASH_QUEUE_SECONDS.labels(op).observe(time.perf_counter() - started)
+    try:
+        with PASSWORD_HASH_SECONDS.labels(op).time():
+            pool = _get_pool()
+            if pool is None:
+                return await asyncio.to_thread(fn, *args)
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    finally:
+        slots.release()
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool("hash", passwords.hash_password, password, settings.PASSWORD_SCHEME, _hash_params())
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await _run_in_pool("verify", passwords.verify_password, password, hashed)
+
+
+def shutdown_password_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
 
 # --- Minimal JWT (HS256) ---
+# Ключ HMAC готовим один раз: на каждый токен — только copy() + update()
+_JWT_MAC = hmac.new(settings.JWT_SECRET.encode(), digestmod=hashlib.sha256)
+
+# Уже проверенные токены: sha256(токен) -> payload. Запись живёт не дольше exp,
+# поэтому повторный запрос с тем же токеном не пересчитывает HMAC и не парсит JSON
+_verified_tokens = LRUCache(maxsize=settings.TOKEN_CACHE_MAX)
+
+
 def _b64url_encode(b: bytes) -> str:
     return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
 
@@ -32,6 +118,11 @@ def _b64url_decode(s: str) -> bytes:
     padding = '=' * (-len(s) % 4)
     return base64.urlsafe_b64decode(s + padding)
 
+def _sign(signing_input: bytes) -> str:
+    mac = _JWT_MAC.copy()
+    mac.update(signing_input)
+    return _b64url_encode(mac.digest())
+
 def create_access_token(subject: str, expires_minutes: int = settings.ACCESS_TOKEN_EXPIRE_MINUTES, extra: Optional[Dict[str, Any]] = None) -> str:
     header = {"alg": "HS256", "typ": "JWT"}
     now = int(time.time())
@@ -41,25 +132,34 @@ def create_access_token(subject: str, expires_minutes: int = settings.ACCESS_TOK
 
     header_b64 = _b64url_encode(json.dumps(header, separators=(",", ":")).encode())
     payload_b64 = _b64url_encode(json.dumps(payload, separators=(",", ":")).encode())
-    signing_input = f"{header_b64}.{payload_b64}".encode()
-    signature = hmac.new(settings.JWT_SECRET.encode(), signing_input, hashlib.sha256).digest()
-    sig_b64 = _b64url_encode(signature)
-    return f"{header_b64}.{payload_b64}.{sig_b64}"
+    signing_input = f"{header_b64}.{payload_b64}"
+    return f"{signing_input}.{_sign(signing_input.encode())}"
 
 def decode_token(token: str) -> Dict[str, Any]:
-    try:
-        header_b64, payload_b64, sig_b64 = token.split(".")
-    except ValueError:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token format")
+    """
+    Проверяет подпись и срок действия токена, возвращает payload (не изменяйте его —
+    он общий для всех запросов с этим токеном).
+    """
+    key = hashlib.sha256(token.encode()).digest() if settings.TOKEN_CACHE_MAX else None
+    if key is not None:
+        payload = _verified_tokens.get(key)
+        if payload is not None:
+            if time.time() > payload["exp"]:
+                _verified_tokens.pop(key)
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
+            return payload
 
-    signing_input = f"{header_b64}.{payload_b64}".encode()
-    signature = _b64url_decode(sig_b64)
-    expected = hmac.new(settings.JWT_SECRET.encode(), signing_input, hashlib.sha256).digest()
-    if not hmac.compare_digest(signature, expected):
+    if token.count(".") != 2:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token format")
+    signing_input, _, sig_b64 = token.rpartition(".")
+    if not hmac.compare_digest(sig_b64.encode(), _sign(signing_input.encode()).encode()):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token signature")
 
-    payload = json.loads(_b64url_decode(payload_b64))
+    payload = json.loads(_b64url_decode(signing_input.split(".", 1)[1]))
     exp = payload.get("exp")
-    if not exp or int(time.time()) > int(exp):
+    now = time.time()
+    if not exp or int(now) > int(exp):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
-    return payload
\ No newline at end of file
+    if key is not None:
+        _verified_tokens.set(key, payload, ttl=int(exp) - now + 1)
+    return payload
@@ -0,0 +1,83 @@
+# utils/stats.py
+"""
+Статистика для админки: COUNT(*) вместо выгрузки строк и суточные ряды
+(сообщения, активные диалоги, новые пользователи). Результаты кешируются
+на STATS_TTL_SECONDS, так что обновление дашборда почти не нагружает БД.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from config import settings
+from models.user import User
+from models.character import Character
+from models.dialog import Dialog
+from models.message import Message
+from schemas.admin import Stats, DailyPoint, StatsSeries
+from utils.cache import LRUCache
+
+_cache = LRUCache(maxsize=64, ttl=settings.STATS_TTL_SECONDS)
+
+
+def _count(session: Session, model) -> int:
+    return session.exec(select(func.count()).select_from(model)).one()
+
+
+def get_counts(session: Session) -> Stats:
+    """
+    Общее число пользователей, персонажей, диалогов и сообщений.
+    """
+    cached = _cache.get("counts")
+    if cached is not None:
+        return cached
+    stats = Stats(
+        users=_count(session, User),
+        characters=_count(session, Character),
+        dialogs=_count(session, Dialog),
+        messages=_count(session, Message),
+    )
+    _cache.set("counts", stats)
+    return stats
+
+
+def _daily(session: Session, column, value, since: datetime) -> Dict[date, int]:
+    day = func.date(column)
+    rows = session.exec(
+        select(day, value).where(column >= since).group_by(day)
+    ).all()
+    out: Dict[date, int] = {}
+    for d, v in rows:
+        # SQLite отдаёт date() строкой, Postgres — датой
+        out[date.fromisoformat(d) if isinstance(d, str) else d] = v
+    return out
+
+
+def _fill(days: List[date], data: Dict[date, int]) -> List[DailyPoint]:
+    return [DailyPoint(day=d, value=data.get(d, 0)) for d in days]
+
+
+def get_series(session: Session, days: int = 30) -> StatsSeries:
+    """
+    Суточные ряды за последние days дней (UTC), пропуски заполняются нулями.
+    """
+    key = ("series", days)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    today = datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    since = datetime.combine(first, datetime.min.time())
+    day_list = [first + timedelta(days=i) for i in range(days)]
+
+    series = StatsSeries(
+        messages_per_day=_fill(day_list, _daily(session, Message.created_at, func.count(), since)),
+        active_dialogs_per_day=_fill(
+            day_list, _daily(session, Message.created_at, func.count(func.distinct(Message.dialog_id)), since)
+        ),
+        new_users_per_day=_fill(day_list, _daily(session, User.created_at, func.count(), since)),
+    )
+    _cache.set(key, series)
+    return series
@@ -0,0 +1,190 @@
+# utils/summary.py
+"""
+Скользящие сводки длинных диалогов.
+
+Когда несвёрнутых реплик становится больше SUMMARY_TRIGGER_MESSAGES, в фоне
+старые реплики (кроме последних SUMMARY_KEEP_RECENT) сворачиваются в сводку.
+Каждый проход обрабатывает только сообщения после last_message_id прошлой
+сводки, так что размер промпта не растёт вместе с длиной диалога.
+
+Проход захватывается в БД до вызова модели (claimed_at в строке сводки),
+поэтому несколько воркеров не сворачивают один диалог одновременно.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import func, or_, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from langchain_core.messages import SystemMessage, HumanMessage
+
+from config import settings
+from models.message import Message
+from models.dialog_summary import DialogSummary
+from utils.db import async_session_maker, dialect_insert
+from utils.chat import get_llm
+from utils.history_cache import history_cache
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "Ты ведёшь краткий конспект ролевого диалога пользователя с персонажем. "
+    "Дополни предыдущий конспект новыми репликами: сохрани факты о пользователе, "
+    "договорённости, имена, события и тон общения. Пиши от третьего лица, "
+    "без вступлений, не длиннее 300 слов."
+)
+
+# Диалоги, которые сворачивает этот процесс (без лишних запросов к БД;
+# между воркерами проход разграничивает захват в БД)
+_in_progress: Set[int] = set()
+
+
+async def get_summary(session: AsyncSession, dialog_id: int) -> Optional[DialogSummary]:
+    """
+    Возвращает текущую сводку диалога, если она есть (заготовку без текста — нет).
+    """
+    q = select(DialogSummary).where(DialogSummary.dialog_id == dialog_id, DialogSummary.last_message_id > 0)
+    return (await session.exec(q)).first()
+
+
+async def _pending_turns(session: AsyncSession, dialog_id: int) -> Tuple[Optional[DialogSummary], List[Message]]:
+    """
+    Текущая сводка и реплики, которые пора в неё свернуть (пусто — порог не набран).
+    """
+    summary = await get_summary(session, dialog_id)
+    after_id = summary.last_message_id if summary else 0
+
+    pending = select(Message).where(
+        Message.dialog_id == dialog_id,
+        Message.role != "system",
+        Message.id > after_id,
+    )
+    count = (await session.exec(
+        select(func.count()).select_from(pending.subquery())
+    )).one()
+    if count < settings.SUMMARY_TRIGGER_MESSAGES:
+        return summary, []
+
+    fold = count - settings.SUMMARY_KEEP_RECENT
+    rows = (await session.exec(pending.order_by(Message.id.asc()).limit(fold))).all()
+    return summary, list(rows)
+
+
+async def _claim(session: AsyncSession, dialog_id: int) -> Optional[datetime]:
+    """
+    Захватывает проход: ставит claimed_at в строке сводки, если её никто не держит
+    (или захват старше SUMMARY_CLAIM_TTL). Строки ещё нет — сначала заготовка
+    (INSERT ... ON CONFLICT DO NOTHING). None — диалог сворачивает другой воркер.
+    """
+    now = datetime.utcnow()
+    await session.exec(
+        dialect_insert(DialogSummary)
+        .values(dialog_id=dialog_id, content="", last_message_id=0, summarized_count=0, updated_at=now)
+        .on_conflict_do_nothing(index_elements=["dialog_id"])
+    )
+    stale = now - timedelta(seconds=settings.SUMMARY_CLAIM_TTL)
+    res = await session.exec(
+        update(DialogSummary)
+        .where(
+            DialogSummary.dialog_id == dialog_id,
+            or_(DialogSummary.claimed_at.is_(None), DialogSummary.claimed_at < stale),
+        )
+        .values(claimed_at=now)
+    )
+    await session.commit()
+    return now if res.rowcount else None
+
+
+async def _release(dialog_id: int, claimed_at: datetime) -> None:
+    async with async_session_maker() as session:
+        await session.exec(
+            update(DialogSummary)
+            .where(DialogSummary.dialog_id == dialog_id, DialogSummary.claimed_at == claimed_at)
+            .values(claimed_at=None)
+        )
+        await session.commit()
+
+
+def summary_system_message(content: str) -> SystemMessage:
+    """
+    Представление сводки в промпте.
+    """
+    return SystemMessage(content=f"Краткое содержание предыдущей части диалога:\n{content}")
+
+
+def _format_turns(messages: List[Message]) -> str:
+    lines = []
+    for m in messages:
+        who = "Пользователь" if m.role == "user" else "Персонаж"
+        lines.append(f"{who}: {m.content}")
+    return "\n".join(lines)
+
+
+async def summarize_messages(previous: Optional[str], messages: List[Message]) -> str:
+    """
+    Просит LLM дополнить предыдущую сводку новыми репликами.
+    """
+    llm = get_llm(model_id=settings.SUMMARY_MODEL_ID, temperature=0.0)
+    prompt = (
+        f"Предыдущий конспект:\n{previous or '—'}\n\n"
+        f"Новые реплики:\n{_format_turns(messages)}"
+    )
+    ai_msg = await llm.ainvoke([SystemMessage(content=SUMMARY_INSTRUCTIONS), HumanMessage(content=prompt)])
+    return ai_msg.content if hasattr(ai_msg, "content") else str(ai_msg)
+
+
+async def maybe_summarize_dialog(dialog_id: int) -> None:
+    """
+    Фоновая задача после ответа ассистента: сворачивает накопившиеся реплики,
+    если их больше порога. Ошибки LLM не критичны — попробуем на следующем ходу.
+    """
+    if not settings.SUMMARY_ENABLED or dialog_id in _in_progress:
+        return
+    _in_progress.add(dialog_id)
+    claimed_at = None
+    try:
+        async with async_session_maker() as session:
+            _, rows = await _pending_turns(session, dialog_id)
+            if not rows:
+                return
+            claimed_at = await _claim(session, dialog_id)
+            if claimed_at is None:
+                return
+            # Пока захватывали, сводку мог продвинуть другой воркер — перечитываем
+            session.expire_all()
+            summary, rows = await _pending_turns(session, dialog_id)
+            if not rows:
+                return
+
+            text = await summarize_messages(summary.content if summary else None, rows)
+
+            # Пишем, только если захват всё ещё наш (не истёк и не перехвачен)
+            res = await session.exec(
+                update(DialogSummary)
+                .where(DialogSummary.dialog_id == dialog_id, DialogSummary.claimed_at == claimed_at)
+                .values(
+                    content=text,
+                    last_message_id=rows[-1].id,
+                    summarized_count=DialogSummary.summarized_count + len(rows),
+                    updated_at=datetime.utcnow(),
+                    claimed_at=None,
+                )
+            )
+            await session.commit()
+            if not res.rowcount:
+                logger.warning("summary claim for dialog %s expired, result dropped", dialog_id)
+                return
+            claimed_at = None
+        # Граница сводки сдвинулась — кеш истории пересоберётся на следующем ходу
+        await history_cache.invalidate(dialog_id)
+    except Exception:
+        logger.exception("summary for dialog %s failed", dialog_id)
+    finally:
+        _in_progress.discard(dialog_id)
+        if claimed_at is not None:
+            try:
+                await _release(dialog_id, claimed_at)
+            except Exception:
+                logger.exception("failed to release summary claim for dialog %s", dialog_id)
@@ -0,0 +1,184 @@
+# utils/uploads.py
+"""
+Загрузка фото персонажей.
+
+Файл копируется на диск кусками по UPLOAD_CHUNK_BYTES с подсчётом sha256 и
+проверкой размера (больше UPLOAD_MAX_BYTES — 413), тип определяется по
+сигнатуре содержимого, а не по имени/заголовкам клиента. Итоговое имя —
+<sha256>.<ext>, поэтому одинаковые файлы хранятся один раз.
+Уменьшенные копии (<sha256>_<size>.webp) для карточек каталога делает
+фоновый пул потоков (Pillow отпускает GIL на декодировании и ресайзе).
+"""
+import errno
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from config import settings
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Сигнатуры поддерживаемых форматов -> расширение
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+# По окончанию пути: фронтенд сохраняет photo_url абсолютным (с адресом API)
+_UPLOAD_RE = re.compile(rf"{re.escape(settings.UPLOAD_URL)}/([0-9a-f]{{64}})\.\w+$")
+
+_pool: Optional[ThreadPoolExecutor] = None
+# Уже найденные на диске уменьшенные копии (чтобы не делать stat на каждую карточку)
+_known_thumbs = LRUCache(maxsize=10000)
+
+
+def _sniff(head: bytes) -> Optional[str]:
+    for signature, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _thumb_name(digest: str, size: int) -> str:
+    return f"{digest}_{size}.webp"
+
+
+def save_upload(src: BinaryIO) -> Tuple[str, str, bool]:
+    """
+    Копирует загрузку в UPLOAD_DIR под именем по содержимому.
+    Возвращает (sha256, имя файла, создан ли новый файл).
+    """
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    os.makedirs(settings.UPLOAD_TMP_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    # Недокачанный и ещё не проверенный файл — вне раздаваемого каталога
+    fd, tmp_path = tempfile.mkstemp(dir=settings.UPLOAD_TMP_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = src.read(settings.UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                if ext is None:
+                    ext = _sniff(chunk[:16])
+                    if ext is None:
+                        raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF or WebP images are allowed")
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail="File is too large")
+                digest.update(chunk)
+                out.write(chunk)
+        if ext is None:
+            raise HTTPException(status_code=400, detail="Empty file")
+
+        name = f"{digest.hexdigest()}.{ext}"
+        path = os.path.join(settings.UPLOAD_DIR, name)
+        if os.path.exists(path):
+            return digest.hexdigest(), name, False
+        _publish(tmp_path, path)
+        tmp_path = None
+        return digest.hexdigest(), name, True
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+
+
+def _publish(tmp_path: str, path: str) -> None:
+    """
+    Атомарно переносит проверенный файл в UPLOAD_DIR. Если UPLOAD_TMP_DIR на другой ФС
+    (например, UPLOAD_DIR — отдельный том), файл сначала копируется рядом с целью
+    под скрытым именем (MediaFiles такие не отдаёт) и переименовывается.
+    """
+    try:
+        os.replace(tmp_path, path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    fd, staged = tempfile.mkstemp(dir=settings.UPLOAD_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out, open(tmp_path, "rb") as src:
+            shutil.copyfileobj(src, out, settings.UPLOAD_CHUNK_BYTES)
+        os.replace(staged, path)
+    except BaseException:
+        os.unlink(staged)
+        raise
+    os.unlink(tmp_path)
+
+
+def _make_thumbnails(digest: str, name: str) -> None:
+    from PIL import Image
+
+    src = os.path.join(settings.UPLOAD_DIR, name)
+    try:
+        with Image.open(src) as img:
+            img.seek(0)
+            img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+            for size in settings.UPLOAD_THUMB_SIZES:
+                dst = os.path.join(settings.UPLOAD_DIR, _thumb_name(digest, size))
+                if os.path.exists(dst):
+                    continue
+                thumb = img.copy()
+                thumb.thumbnail((size, size))
+                # Уникальное временное имя: одну картинку могут догружать параллельно;
+                # скрытое — недописанный файл не отдаётся
+                tmp = os.path.join(settings.UPLOAD_DIR, f".{_thumb_name(digest, size)}.{threading.get_ident()}.tmp")
+                thumb.save(tmp, "WEBP", quality=80, method=4)
+                os.replace(tmp, dst)
+    except Exception:
+        logger.exception("thumbnails for %s failed", name)
+
+
+def schedule_thumbnails(digest: str, name: str) -> None:
+    """
+    Ставит генерацию уменьшенных копий в фоновый пул.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.UPLOAD_THUMB_WORKERS, thread_name_prefix="thumbs")
+    _pool.submit(_make_thumbnails, digest, name)
+
+
+def shutdown_thumbnail_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+def upload_url(name: str) -> str:
+    return f"{settings.UPLOAD_URL}/{name}"
+
+
+def thumbnail_url(photo_url: Optional[str], size: Optional[int] = None) -> Optional[str]:
+    """
+    URL уменьшенной копии загруженного фото, если она уже готова.
+    photo_url может быть относительным (/static/uploads/...) или абсолютным
+    (http://api.example.com/static/uploads/...). Для внешних ссылок и старых
+    загрузок — None (остаётся photo_url).
+    """
+    m = _UPLOAD_RE.search(urlparse(photo_url or "").path)
+    if not m:
+        return None
+    name = _thumb_name(m.group(1), size or settings.UPLOAD_CARD_THUMB_SIZE)
+    if _known_thumbs.get(name) is None:
+        if not os.path.exists(os.path.join(settings.UPLOAD_DIR, name)):
+            return None
+        _known_thumbs.set(name, True)
+    return upload_url(name)
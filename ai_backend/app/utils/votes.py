@@ -0,0 +1,232 @@
+# utils/votes.py
+"""
+Голосование за персонажей без read-modify-write.
+
+Голос пишется атомарно (INSERT ... ON CONFLICT DO NOTHING / условный UPDATE /
+DELETE ... RETURNING), счётчики меняются UPDATE ... SET x = x + :delta.
+При VOTE_WRITE_BEHIND=true дельты копятся в памяти и сбрасываются пачкой раз
+в VOTE_FLUSH_INTERVAL секунд — строка популярного персонажа не становится
+точкой сериализации. reconcile_vote_counters пересчитывает счётчики из CharacterVote.
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, update
+from sqlmodel import Session, select
+
+from config import settings
+from models.character import Character
+from models.character_vote import CharacterVote
+from models.user import User
+from utils.db import engine, async_session_maker, dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# Попыток записать голос, пока параллельные запросы того же пользователя его меняют
+VOTE_ATTEMPTS = 5
+
+
+class VoteConflict(RuntimeError):
+    """
+    Голос не удалось записать за VOTE_ATTEMPTS попыток.
+    """
+
+
+def _deltas(old: int, new: int) -> Tuple[int, int]:
+    likes = (new == 1) - (old == 1)
+    dislikes = (new == -1) - (old == -1)
+    return likes, dislikes
+
+
+def apply_vote(session: Session, character_id: int, user_id: int, value: int) -> Tuple[int, int]:
+    """
+    Атомарно записывает голос пользователя (-1, 0, 1) и возвращает изменения
+    счётчиков (лайки, дизлайки). Коммит — на вызывающей стороне.
+    Голос так и не удалось записать из-за параллельных изменений — VoteConflict.
+    """
+    where = (CharacterVote.character_id == character_id, CharacterVote.user_id == user_id)
+
+    if value == 0:
+        old = session.exec(delete(CharacterVote).where(*where).returning(CharacterVote.value)).first()
+        return _deltas(old[0] if old else 0, 0)
+
+    for _ in range(VOTE_ATTEMPTS):
+        inserted = session.exec(
+            dialect_insert(CharacterVote)
+            .values(character_id=character_id, user_id=user_id, value=value)
+            .on_conflict_do_nothing(index_elements=["character_id", "user_id"])
+            .returning(CharacterVote.id)
+        ).first()
+        if inserted:
+            return _deltas(0, value)
+
+        # Голос уже есть: compare-and-swap, чтобы параллельный запрос того же
+        # пользователя не посчитал одно изменение дважды
+        old = session.exec(select(CharacterVote.value).where(*where)).first()
+        if old is None:
+            # Голос успели удалить между запросами — вставляем заново
+            continue
+        if old == value:
+            return 0, 0
+        res = session.exec(
+            update(CharacterVote).where(*where, CharacterVote.value == old).values(value=value)
+        )
+        if res.rowcount:
+            return _deltas(old, value)
+    raise VoteConflict(f"vote of user {user_id} for character {character_id} keeps changing")
+
+
+def bump_counters(session: Session, character_id: int, likes: int, dislikes: int) -> None:
+    """
+    Атомарный инкремент счётчиков персонажа.
+    """
+    if not likes and not dislikes:
+        return
+    session.exec(
+        update(Character)
+        .where(Character.id == character_id)
+        .values(
+            likes_count=Character.likes_count + likes,
+            dislikes_count=Character.dislikes_count + dislikes,
+            version=Character.version + 1,
+        )
+    )
+
+
+class VoteCounterBuffer:
+    """
+    Буфер дельт счётчиков для режима write-behind.
+    """
+
+    def __init__(self):
+        self._pending: Dict[int, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, character_id: int, likes: int, dislikes: int) -> None:
+        if not likes and not dislikes:
+            return
+        with self._lock:
+            l, d = self._pending.get(character_id, (0, 0))
+            self._pending[character_id] = (l + likes, d + dislikes)
+
+    def pending(self, character_id: int) -> Tuple[int, int]:
+        with self._lock:
+            return self._pending.get(character_id, (0, 0))
+
+    def drain(self) -> Dict[int, Tuple[int, int]]:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def restore(self, batch: Dict[int, Tuple[int, int]]) -> None:
+        for character_id, (likes, dislikes) in batch.items():
+            self.add(character_id, likes, dislikes)
+
+    async def flush(self) -> int:
+        """
+        Сбрасывает накопленные дельты одной транзакцией. Возвращает число персонажей.
+        """
+        batch = self.drain()
+        if not batch:
+            return 0
+        try:
+            async with async_session_maker() as session:
+                for character_id, (likes, dislikes) in batch.items():
+                    await session.exec(
+                        update(Character)
+                        .where(Character.id == character_id)
+                        .values(
+                            likes_count=Character.likes_count + likes,
+                            dislikes_count=Character.dislikes_count + dislikes,
+                            version=Character.version + 1,
+                        )
+                    )
+                await session.commit()
+        except Exception:
+            # Не потеряем дельты — попробуем на следующем проходе
+            self.restore(batch)
+            raise
+        return len(batch)
+
+
+vote_buffer = VoteCounterBuffer()
+
+
+def record_vote(session: Session, character_id: int, user_id: int, value: int) -> None:
+    """
+    Голос + счётчики: сразу в той же транзакции или через буфер write-behind.
+    Коммит — на вызывающей стороне.
+    """
+    likes, dislikes = apply_vote(session, character_id, user_id, value)
+    if likes or dislikes:
+        # my_vote изменился — сбрасываем ETag списков этого пользователя
+        session.exec(update(User).where(User.id == user_id).values(votes_version=User.votes_version + 1))
+    if settings.VOTE_WRITE_BEHIND:
+        # В буфер — только после успешного коммита голоса
+        session.info.setdefault("vote_deltas", []).append((character_id, likes, dislikes))
+    else:
+        bump_counters(session, character_id, likes, dislikes)
+
+
+def commit_vote(session: Session) -> None:
+    session.commit()
+    for character_id, likes, dislikes in session.info.pop("vote_deltas", []):
+        vote_buffer.add(character_id, likes, dislikes)
+
+
+def pending_counters(character_id: int) -> Tuple[int, int]:
+    """
+    Ещё не сброшенные в БД дельты (для ответа клиенту сразу после голоса).
+    """
+    return vote_buffer.pending(character_id) if settings.VOTE_WRITE_BEHIND else (0, 0)
+
+
+def reconcile_vote_counters(session: Session, character_id: Optional[int] = None) -> int:
+    """
+    Пересчитывает likes_count/dislikes_count из CharacterVote одним UPDATE.
+    Возвращает число персонажей, у которых счётчики разошлись и были исправлены.
+    """
+    def count_of(v: int):
+        return (
+            select(func.count(CharacterVote.id))
+            .where(CharacterVote.character_id == Character.id, CharacterVote.value == v)
+            .scalar_subquery()
+        )
+
+    likes, dislikes = count_of(1), count_of(-1)
+    q = (
+        update(Character)
+        .where(or_(Character.likes_count != likes, Character.dislikes_count != dislikes))
+        .values(likes_count=likes, dislikes_count=dislikes, version=Character.version + 1)
+    )
+    if character_id is not None:
+        q = q.where(Character.id == character_id)
+    res = session.exec(q)
+    session.commit()
+    return res.rowcount
+
+
+async def run_vote_jobs() -> None:
+    """
+    Фоновый цикл: сброс буфера write-behind и (если задано) периодическая сверка.
+    """
+    since_reconcile = 0.0
+    while True:
+        await asyncio.sleep(settings.VOTE_FLUSH_INTERVAL)
+        try:
+            if settings.VOTE_WRITE_BEHIND:
+                await vote_buffer.flush()
+            since_reconcile += settings.VOTE_FLUSH_INTERVAL
+            if settings.VOTE_RECONCILE_INTERVAL and since_reconcile >= settings.VOTE_RECONCILE_INTERVAL:
+                since_reconcile = 0.0
+                await vote_buffer.flush()
+                await asyncio.to_thread(_reconcile_all)
+        except Exception:
+            logger.exception("vote background job failed")
+
+
+def _reconcile_all() -> int:
+    with Session(engine) as session:
+        return reconcile_vote_counters(session)
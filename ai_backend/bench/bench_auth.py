@@ -0,0 +1,62 @@
+# bench/bench_auth.py
+"""
+Микробенчмарк проверки JWT на запрос.
+
+Сравнивает прежний decode_token (split + base64 + новый HMAC + json на каждый
+вызов), текущий без кеша (холодный путь) и текущий с кешем проверенных токенов.
+
+Запуск из ai_backend/:
+    python bench/bench_auth.py [число_вызовов]
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from config import settings  # noqa: E402
+from utils import security  # noqa: E402
+
+
+def legacy_decode_token(token: str):
+    header_b64, payload_b64, sig_b64 = token.split(".")
+    signing_input = f"{header_b64}.{payload_b64}".encode()
+    signature = base64.urlsafe_b64decode(sig_b64 + "=" * (-len(sig_b64) % 4))
+    expected = hmac.new(settings.JWT_SECRET.encode(), signing_input, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("Invalid token signature")
+    payload = json.loads(base64.urlsafe_b64decode(payload_b64 + "=" * (-len(payload_b64) % 4)))
+    if int(time.time()) > int(payload["exp"]):
+        raise ValueError("Token expired")
+    return payload
+
+
+def cold_decode_token(token: str):
+    security._verified_tokens.clear()
+    return security.decode_token(token)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    token = security.create_access_token("12345", extra={"role": "user"})
+    security.decode_token(token)  # прогреть кеш
+
+    cases = [
+        ("before (legacy decode)", lambda: legacy_decode_token(token)),
+        ("after, cache miss", lambda: cold_decode_token(token)),
+        ("after, cache hit", lambda: security.decode_token(token)),
+    ]
+    baseline = None
+    for name, fn in cases:
+        best = min(timeit.repeat(fn, number=n, repeat=5)) / n
+        baseline = baseline or best
+        print(f"{name:<24} {best * 1e6:8.2f} us/call  x{baseline / best:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# bench/bench_serialization.py
+"""
+Бенчмарк сборки больших списков: строк в секунду до и после быстрой сериализации.
+
+before — как было: ORM-объекты, model_validate + model_copy на строку,
+         затем путь FastAPI (serialize_response: проверка по response_model,
+         jsonable_encoder, json.dumps);
+after  — кортежи колонок, один TypeAdapter.validate_python на весь список
+         и JSON-байты через dump_json (utils/fast_json.py).
+Оба варианта включают запрос к БД. Данные — во временной SQLite в памяти.
+
+Запуск из ai_backend/:
+    python bench/bench_serialization.py [число_строк]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from sqlmodel import Session, SQLModel, create_engine, select  # noqa: E402
+
+from models.character import Character  # noqa: E402
+from models.character_vote import CharacterVote  # noqa: E402
+from models.dialog import Dialog  # noqa: E402
+from models.message import Message  # noqa: E402
+from models.user import User  # noqa: E402
+from schemas.character import CharacterOut  # noqa: E402
+from schemas.dialog import MessageOut  # noqa: E402
+from utils.chat import MESSAGE_OUT_COLUMNS  # noqa: E402
+from utils.characters import character_list_json  # noqa: E402
+from utils.fast_json import rows_to_json  # noqa: E402
+from utils.uploads import thumbnail_url  # noqa: E402
+
+
+def seed(session: Session, n: int) -> None:
+    now = datetime.utcnow()
+    session.add(User(id=1, email="bench@example.com"))
+    session.add_all(
+        Character(
+            id=i, owner_id=1, name=f"Character {i}", bio="bio " * 20, context="context " * 50,
+            interests=["music", "films"], likes_count=i % 17, created_at=now - timedelta(seconds=i),
+        )
+        for i in range(1, n + 1)
+    )
+    session.add_all(CharacterVote(character_id=i, user_id=1, value=1) for i in range(1, n + 1, 3))
+    session.add(Dialog(id=1, user_id=1, character_id=1))
+    session.add_all(
+        Message(dialog_id=1, role="user" if i % 2 else "assistant", content="message text " * 10,
+                created_at=now + timedelta(seconds=i))
+        for i in range(n)
+    )
+    session.commit()
+
+
+def fastapi_dump(field, items) -> bytes:
+    # Как FastAPI отдаёт возвращённые из хендлера объекты по response_model
+    content = asyncio.run(serialize_response(field=field, response_content=items, is_coroutine=False))
+    return json.dumps(jsonable_encoder(content)).encode()
+
+
+def characters_before(session: Session, field) -> bytes:
+    where = (Character.is_blocked == False, Character.is_public == True)  # noqa: E712
+    items = session.exec(select(Character).where(*where).order_by(Character.created_at.desc())).all()
+    votes = session.exec(
+        select(CharacterVote).where(CharacterVote.user_id == 1, CharacterVote.character_id.in_([c.id for c in items]))
+    ).all()
+    vmap = {v.character_id: v.value for v in votes}
+    out = [
+        CharacterOut.model_validate(ch, from_attributes=True).model_copy(
+            update={"my_vote": vmap.get(ch.id), "thumb_url": thumbnail_url(ch.photo_url)}
+        )
+        for ch in items
+    ]
+    return fastapi_dump(field, out)
+
+
+def characters_after(session: Session) -> bytes:
+    where = (Character.is_blocked == False, Character.is_public == True)  # noqa: E712
+    return character_list_json(session, where, user_id=1)
+
+
+def messages_before(session: Session, field) -> bytes:
+    q = select(Message).where(Message.dialog_id == 1).order_by(Message.created_at.asc(), Message.id.asc())
+    return fastapi_dump(field, session.exec(q).all())
+
+
+def messages_after(session: Session) -> bytes:
+    q = select(*MESSAGE_OUT_COLUMNS).where(Message.dialog_id == 1).order_by(Message.created_at.asc(), Message.id.asc())
+    return rows_to_json(MessageOut, [c.key for c in MESSAGE_OUT_COLUMNS], session.exec(q).all())
+
+
+def measure(fn, rows: int, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return rows / best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    character_field = create_model_field(name="Response", type_=List[CharacterOut], mode="serialization")
+    message_field = create_model_field(name="Response", type_=List[MessageOut], mode="serialization")
+
+    with Session(engine) as session:
+        seed(session, n)
+        assert json.loads(characters_before(session, character_field)) == json.loads(characters_after(session))
+        assert json.loads(messages_before(session, message_field)) == json.loads(messages_after(session))
+        cases = [
+            ("characters", lambda: characters_before(session, character_field), lambda: characters_after(session)),
+            ("messages", lambda: messages_before(session, message_field), lambda: messages_after(session)),
+        ]
+        for name, before, after in cases:
+            slow = measure(before, n)
+            fast = measure(after, n)
+            print(f"{name:<12} before {slow:10,.0f} rows/s   after {fast:10,.0f} rows/s   x{fast / slow:4.1f}")
+
+
+if __name__ == "__main__":
+    main()
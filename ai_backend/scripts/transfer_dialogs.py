@@ -0,0 +1,117 @@
+# scripts/transfer_dialogs.py
+"""
+Выгрузка и загрузка диалогов в gzip JSONL из командной строки (utils/dialog_transfer.py).
+БД берётся из DATABASE_URL (.env или окружение).
+
+Запуск из ai_backend/:
+    python scripts/transfer_dialogs.py export [--user-id N] [--character-id N] -o dialogs.jsonl.gz
+    python scripts/transfer_dialogs.py import dialogs.jsonl.gz [--user-id N] [--character-id N]
+
+Пользователи и персонажи не переносятся: диалоги, чьих пользователя или персонажа
+(по id из файла) нет в целевой БД, пропускаются. Перед переносом в новую БД
+перенесите таблицы user и character с сохранением id либо задайте
+--user-id/--character-id. Повторный импорт того же файла не создаёт дублей,
+поэтому прерванную загрузку можно просто запустить заново.
+
+Перенос SQLite -> Postgres без промежуточного файла:
+    DATABASE_URL=sqlite:///app.db python scripts/transfer_dialogs.py export -o - | \\
+        DATABASE_URL=postgresql+psycopg://... python scripts/transfer_dialogs.py import -
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+import anyio  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+# Все таблицы должны быть в метаданных до create_db_and_tables
+from models.character import Character  # noqa: E402,F401
+from models.character_vote import CharacterVote  # noqa: E402,F401
+from models.dialog import Dialog  # noqa: E402,F401
+from models.dialog_summary import DialogSummary  # noqa: E402,F401
+from models.message import Message  # noqa: E402,F401
+from models.user import User  # noqa: E402,F401
+from utils.db import create_db_and_tables, engine  # noqa: E402
+from utils.dialog_transfer import ImportStats, gzip_chunks, import_dialogs, iter_export_lines  # noqa: E402
+from utils.history_cache import history_cache  # noqa: E402
+
+
+def run_export(args) -> None:
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        with Session(engine) as session:
+            for chunk in gzip_chunks(iter_export_lines(session, args.user_id, args.character_id)):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+def _invalidate(dialog_ids) -> None:
+    # Общий кеш (redis) мог хранить историю диалогов с теми же id
+    for dialog_id in dialog_ids:
+        anyio.from_thread.run(history_cache.invalidate, dialog_id)
+
+
+def _import(args) -> ImportStats:
+    src = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    try:
+        with Session(engine) as session:
+            return import_dialogs(
+                session, src, args.user_id, args.character_id, args.batch_size, on_commit=_invalidate
+            )
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+
+
+def run_import(args) -> None:
+    create_db_and_tables()
+    # Сброс кеша после каждой пачки — async-клиент redis живёт в этом цикле событий
+    stats = anyio.run(anyio.to_thread.run_sync, lambda: _import(args))
+    print(
+        f"dialogs: {stats.dialogs}, messages: {stats.messages}, "
+        f"skipped dialogs: {stats.skipped_dialogs}, already imported: {stats.existing_dialogs}",
+        file=sys.stderr,
+    )
+    if stats.skipped_dialogs:
+        print("skipped dialogs reference users or characters missing in this database", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Dialogs export/import in gzip JSONL",
+        epilog="import: users and characters are not transferred, they must already exist "
+               "in the target database with the same ids (or use --user-id/--character-id); "
+               "dialogs referencing missing ones are skipped. Re-import is idempotent.",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export")
+    exp.add_argument("-o", "--output", required=True, help="файл .jsonl.gz или - для stdout")
+    exp.add_argument("--user-id", type=int)
+    exp.add_argument("--character-id", type=int)
+    exp.set_defaults(func=run_export)
+
+    imp = sub.add_parser(
+        "import",
+        description="Users and characters must already exist in the target database with the same ids; "
+                    "dialogs referencing missing ones are skipped. Re-import does not create duplicates.",
+    )
+    imp.add_argument("input", help="файл .jsonl.gz или - для stdin")
+    imp.add_argument("--user-id", type=int, help="назначить все диалоги этому пользователю")
+    imp.add_argument("--character-id", type=int, help="назначить все диалоги этому персонажу")
+    imp.add_argument("--batch-size", type=int)
+    imp.set_defaults(func=run_import)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except ValueError as e:
+        sys.exit(f"error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# tests/conftest.py
+"""
+Общая обвязка тестов: временная SQLite, заглушка LLM вместо YandexGPT
+и TestClient приложения.
+
+Запуск из ai_backend/:
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Настройки читаются при импорте config — окружение задаём до импорта приложения
+_tmp = tempfile.mkdtemp(prefix="ai-backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["JWT_SECRET"] = "test-secret"
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp, "uploads")
+os.environ["UPLOAD_TMP_DIR"] = os.path.join(_tmp, "uploads-tmp")
+os.environ["EMAIL_BACKEND"] = "console"
+os.environ["VOTE_WRITE_BEHIND"] = "false"
+
+sys.path.insert(0, os.path.join(BASE_DIR, "app"))
+# Приложение раздаёт static/ по относительному пути
+os.chdir(BASE_DIR)
+
+from fastapi.testclient import TestClient  # noqa: E402
+from langchain_core.language_models.fake_chat_models import FakeListChatModel  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+import config  # noqa: E402
+
+ASSISTANT_REPLY = "Привет, я бот!"
+_fake_llm = FakeListChatModel(responses=[ASSISTANT_REPLY])
+config.Settings.create_yandex_model = lambda self, model_id="lite", temperature=None, **kwargs: _fake_llm
+
+import main  # noqa: E402
+from models.character import Character  # noqa: E402
+from models.user import User  # noqa: E402
+from utils.db import engine  # noqa: E402
+from utils.security import create_access_token  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture
+def db():
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture
+def make_user(db):
+    """
+    Новый пользователь: (id, заголовки авторизации).
+    """
+
+    def make(is_admin: bool = False):
+        user = User(email=f"{uuid.uuid4().hex}@example.com", is_admin=is_admin)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return user.id, {"Authorization": f"Bearer {create_access_token(str(user.id))}"}
+
+    return make
+
+
+@pytest.fixture
+def make_character(db):
+    def make(owner_id: int, **fields):
+        fields.setdefault("name", "Bob")
+        fields.setdefault("context", "Ты — Боб.")
+        fields.setdefault("interests", ["music", "art"])
+        character = Character(owner_id=owner_id, **fields)
+        db.add(character)
+        db.commit()
+        db.refresh(character)
+        return character.id
+
+    return make
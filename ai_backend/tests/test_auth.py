@@ -0,0 +1,47 @@
+# tests/test_auth.py
+"""
+Кеш принципала: блокировка и записи профиля сбрасывают его сразу.
+"""
+import uuid
+
+from sqlalchemy import update
+from sqlmodel import select
+
+import utils.principal as principal_cache
+from models.user import User
+from utils.security import create_access_token
+
+
+def test_block_takes_effect_through_cached_principal(client, db, make_user):
+    user_id, headers = make_user()
+    _, admin = make_user(is_admin=True)
+
+    assert client.get("/dialogs", headers=headers).status_code == 200
+    assert principal_cache._memory.get(user_id) is not None
+
+    # Запись в обход API кеш не видит — проверки идут по закешированному принципалу
+    db.exec(update(User).where(User.id == user_id).values(is_blocked=True))
+    db.commit()
+    assert client.get("/dialogs", headers=headers).status_code == 200
+    db.exec(update(User).where(User.id == user_id).values(is_blocked=False))
+    db.commit()
+
+    # Блокировка из админки действует со следующего запроса
+    r = client.post(f"/admin/users/{user_id}/block", headers=admin)
+    assert r.json()["is_blocked"] is True
+    assert client.get("/dialogs", headers=headers).status_code == 403
+    client.post(f"/admin/users/{user_id}/block", headers=admin)
+    assert client.get("/dialogs", headers=headers).status_code == 200
+
+
+def test_signup_resets_cached_principal(client, db):
+    email = f"{uuid.uuid4().hex}@example.com"
+    assert client.post("/auth/request-signup", json={"email": email}).status_code == 200
+    user = db.exec(select(User).where(User.email == email)).one()
+    headers = {"Authorization": f"Bearer {create_access_token(str(user.id))}"}
+
+    client.get("/dialogs", headers=headers)
+    assert principal_cache._memory.get(user.id) is not None
+    r = client.post("/auth/complete-signup", json={"token": user.verification_token, "password": "secret-pass-1"})
+    assert r.status_code == 200
+    assert principal_cache._memory.get(user.id) is None
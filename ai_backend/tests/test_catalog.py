@@ -0,0 +1,41 @@
+# tests/test_catalog.py
+"""
+Каталог персонажей: курсорная пагинация по (ключ сортировки, id).
+"""
+from datetime import datetime, timedelta
+
+
+def _walk_catalog(client, **params):
+    ids, cursor = [], None
+    while True:
+        page = client.get("/characters/catalog", params={**params, "cursor": cursor}).json()
+        ids += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return ids
+
+
+def test_catalog_cursor_new(client, make_user, make_character):
+    owner_id, _ = make_user()
+    base = datetime(2024, 1, 1)
+    # У первых трёх одинаковый created_at — порядок решает id
+    times = [base, base, base, base + timedelta(seconds=1), base + timedelta(seconds=2)]
+    created = [make_character(owner_id, name=f"C{i}", created_at=t) for i, t in enumerate(times)]
+    make_character(owner_id, name="hidden", is_public=False)
+
+    ids = _walk_catalog(client, owner_id=owner_id, limit=2)
+    assert ids == [created[4], created[3], created[2], created[1], created[0]]
+
+
+def test_catalog_cursor_likes(client, make_user, make_character):
+    owner_id, _ = make_user()
+    likes = [3, 1, 3, 0, 2]
+    created = [make_character(owner_id, name=f"L{i}", likes_count=n) for i, n in enumerate(likes)]
+
+    ids = _walk_catalog(client, owner_id=owner_id, sort="likes", limit=2)
+    expected = [cid for cid, _ in sorted(zip(created, likes), key=lambda x: (x[1], x[0]), reverse=True)]
+    assert ids == expected
+
+
+def test_catalog_bad_cursor(client):
+    assert client.get("/characters/catalog", params={"cursor": "garbage"}).status_code == 400
@@ -0,0 +1,118 @@
+# tests/test_dialog_transfer.py
+"""
+Выгрузка диалогов в gzip JSONL и загрузка в другую БД.
+"""
+import gzip
+import io
+from datetime import datetime
+
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from models.character import Character
+from models.dialog import Dialog
+from models.message import Message
+from models.user import User
+from utils.dialog_transfer import gzip_chunks, import_dialogs, iter_export_lines
+
+
+def _history(session, user_id):
+    q = (
+        select(Dialog.started_at, Message.role, Message.content, Message.created_at)
+        .join(Message, Message.dialog_id == Dialog.id)
+        .where(Dialog.user_id == user_id)
+        .order_by(Dialog.started_at, Message.created_at, Message.id)
+    )
+    return [(started_at, str(getattr(role, "value", role)), content, created_at)
+            for started_at, role, content, created_at in session.exec(q)]
+
+
+@pytest.fixture
+def target():
+    """
+    Пустая целевая БД с теми же пользователем и персонажем — как после переноса таблиц.
+    """
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def test_export_import_round_trip(client, db, make_user, make_character, target):
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+    for _ in range(3):
+        dialog_id = client.post(f"/dialogs/{character_id}/messages", json={"message": "hi"}, headers=headers).json()["dialog_id"]
+        client.post(f"/dialogs/{character_id}/messages", json={"message": "more", "dialog_id": dialog_id}, headers=headers)
+    # Диалог без сообщений тоже переносится
+    db.add(Dialog(user_id=user_id, character_id=character_id))
+    db.commit()
+
+    data = b"".join(gzip_chunks(iter_export_lines(db, user_id=user_id)))
+    assert len(gzip.decompress(data).splitlines()) == 4 + 3 * 5
+
+    target.add(User(id=user_id, email="copy@example.com"))
+    target.add(Character(id=character_id, owner_id=user_id, name="Bob", context="ctx", interests=["music"]))
+    target.commit()
+
+    touched = []
+    stats = import_dialogs(target, io.BytesIO(data), batch_size=2, on_commit=touched.extend)
+    assert (stats.dialogs, stats.messages, stats.skipped_dialogs) == (4, 15, 0)
+    assert sorted(set(touched)) == sorted(target.exec(select(Dialog.id)).all())
+    assert _history(target, user_id) == _history(db, user_id)
+
+    # Повторная загрузка ничего не дублирует
+    stats = import_dialogs(target, io.BytesIO(data), batch_size=3)
+    assert (stats.dialogs, stats.messages, stats.existing_dialogs) == (0, 0, 4)
+    assert _history(target, user_id) == _history(db, user_id)
+
+
+def test_import_skips_missing_references(db, make_user, make_character, target):
+    user_id, _ = make_user()
+    db.add(Dialog(user_id=user_id, character_id=make_character(user_id)))
+    db.commit()
+    data = b"".join(gzip_chunks(iter_export_lines(db, user_id=user_id)))
+
+    stats = import_dialogs(target, io.BytesIO(data))
+    assert (stats.dialogs, stats.skipped_dialogs) == (0, 1)
+
+
+def test_import_rejects_bad_input(target):
+    with pytest.raises(ValueError):
+        import_dialogs(target, io.BytesIO(b"not gzip"))
+
+    orphan = b'{"type": "message", "dialog_id": 1, "role": "user", "content": "x", "created_at": "2024-01-01T00:00:00"}\n'
+    with pytest.raises(ValueError):
+        import_dialogs(target, io.BytesIO(gzip.compress(orphan)))
+
+
+def test_import_keeps_messages_with_same_timestamp(db, make_user, make_character, target):
+    user_id, _ = make_user()
+    character_id = make_character(user_id)
+    dialog = Dialog(user_id=user_id, character_id=character_id)
+    db.add(dialog)
+    db.commit()
+    # Одинаковые роль и время: разный текст и даже полные повторы — разные сообщения
+    at = datetime(2024, 1, 1)
+    db.add_all(Message(dialog_id=dialog.id, role="user", content=text, created_at=at) for text in ("a", "b", "a"))
+    db.commit()
+    data = b"".join(gzip_chunks(iter_export_lines(db, user_id=user_id)))
+
+    target.add(User(id=user_id, email="copy@example.com"))
+    target.add(Character(id=character_id, owner_id=user_id, name="Bob", context="ctx", interests=["music"]))
+    target.commit()
+    assert import_dialogs(target, io.BytesIO(data)).messages == 3
+    assert import_dialogs(target, io.BytesIO(data)).messages == 0
+
+    # Прерванная загрузка: недостающий повтор дозагружается
+    target.delete(target.exec(select(Message).where(Message.content == "a")).first())
+    target.commit()
+    assert import_dialogs(target, io.BytesIO(data)).messages == 1
+    assert sorted(target.exec(select(Message.content)).all()) == ["a", "a", "b"]
+
+
+def test_import_endpoint_rejects_bad_file(client, make_user):
+    _, admin = make_user(is_admin=True)
+    r = client.post("/admin/import/dialogs", files={"file": ("d.jsonl.gz", b"not gzip")}, headers=admin)
+    assert r.status_code == 400 and r.json()["detail"] == "Not a gzip file or truncated"
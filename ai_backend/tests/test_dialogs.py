@@ -0,0 +1,189 @@
+# tests/test_dialogs.py
+"""
+Ход диалога: откат при ошибке модели, SSE-поток (кадры, частичный ответ
+при обрыве), 503 до записи хода и обрезка истории по бюджету токенов.
+"""
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from sqlmodel import Session, select
+
+import utils.llm_resilience as resilience
+from config import settings
+from models.dialog import Dialog
+from models.message import Message
+from routers.dialogs import send_message_stream
+from schemas.dialog import StartOrContinueChat
+from utils.db import async_session_maker, engine
+from utils.llm_gateway import GatedLLM, ModelGate
+from utils.principal import Principal
+
+REPLY = "Ответ модели"
+
+
+class ScriptedModel(FakeListChatModel):
+    """
+    FakeListChatModel, который запоминает промпты; fail — обрыв соединения.
+    """
+
+    fail: bool = False
+    prompts: list = []
+
+    def _call(self, messages, *args, **kwargs):
+        self.prompts.append(messages)
+        if self.fail:
+            raise httpx.ConnectError("connection refused")
+        return super()._call(messages, *args, **kwargs)
+
+    async def _astream(self, messages, *args, **kwargs):
+        self.prompts.append(messages)
+        if self.fail:
+            raise httpx.ConnectError("connection refused")
+        async for chunk in super()._astream(messages, *args, **kwargs):
+            yield chunk
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = ScriptedModel(responses=[REPLY])
+    gate = ModelGate("lite", max_in_flight=2, max_queue=2, queue_timeout=1.0)
+    gated = GatedLLM(model, gate)
+    monkeypatch.setattr(resilience, "get_gated_llm", lambda model_id, temperature: gated)
+    monkeypatch.setattr(resilience, "get_gate", lambda model_id: gate)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "LLM_FALLBACKS", {})
+    monkeypatch.setattr(settings, "LLM_RETRIES", 0)
+    return model
+
+
+def _sse(text):
+    events = []
+    for block in text.split("\n\n"):
+        if block:
+            event, data = block.split("\n")
+            assert event.startswith("event: ") and data.startswith("data: ")
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _dialogs(user_id):
+    with Session(engine) as session:
+        return session.exec(select(Dialog.id).where(Dialog.user_id == user_id)).all()
+
+
+def _messages(dialog_id):
+    with Session(engine) as session:
+        q = select(Message.role, Message.content).where(Message.dialog_id == dialog_id).order_by(Message.id)
+        return [(str(getattr(role, "value", role)), content) for role, content in session.exec(q)]
+
+
+@pytest.mark.parametrize("path", ["messages", "messages/stream"])
+def test_model_failure_rolls_back_turn(client, make_user, make_character, model, path):
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+    url = f"/dialogs/{character_id}/{path}"
+
+    # Новый диалог: не остаётся ни диалога, ни сообщений
+    model.fail = True
+    r = client.post(url, json={"message": "hi"}, headers=headers)
+    if path == "messages":
+        assert r.status_code == 503
+    else:
+        assert [e for e, _ in _sse(r.text)] == ["dialog", "error"]
+    assert _dialogs(user_id) == []
+
+    # Существующий диалог: удаляется только сообщение пользователя
+    model.fail = False
+    client.post(url, json={"message": "hi"}, headers=headers)
+    dialog_id = _dialogs(user_id)[0]
+    before = _messages(dialog_id)
+    model.fail = True
+    client.post(url, json={"message": "again", "dialog_id": dialog_id}, headers=headers)
+    assert _messages(dialog_id) == before == [("system", "Ты — Боб."), ("user", "hi"), ("assistant", REPLY)]
+
+
+def test_admit_rejects_before_turn_is_written(client, make_user, make_character, model):
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+    breaker = resilience.get_breaker("lite")
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        breaker.on_failure()
+
+    for path in ("messages", "messages/stream"):
+        r = client.post(f"/dialogs/{character_id}/{path}", json={"message": "hi"}, headers=headers)
+        assert r.status_code == 503 and "retry-after" in r.headers
+    assert _dialogs(user_id) == [] and model.prompts == []
+
+
+def test_stream_sse_frames(client, make_user, make_character, model):
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+
+    r = client.post(f"/dialogs/{character_id}/messages/stream", json={"message": "hi"}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    assert r.headers["cache-control"] == "no-cache" and r.headers["x-accel-buffering"] == "no"
+
+    events = _sse(r.text)
+    names = [e for e, _ in events]
+    assert names == ["dialog"] + ["token"] * len(REPLY) + ["done"]
+    dialog_id = events[0][1]["dialog_id"]
+    assert "".join(data["content"] for e, data in events if e == "token") == REPLY
+    done = events[-1][1]
+    assert done["dialog_id"] == dialog_id and done["assistant_message"]["content"] == REPLY
+    assert done["context_tokens"] == events[0][1]["context_tokens"]
+    assert _messages(dialog_id)[-1] == ("assistant", REPLY)
+
+
+def test_stream_closed_early_saves_partial_reply(client, make_user, make_character, model):
+    user_id, _ = make_user()
+    character_id = make_character(user_id)
+    principal = Principal(id=user_id, is_admin=False, is_active=True, is_blocked=False)
+
+    async def read_first_token():
+        async with async_session_maker() as session:
+            response = await send_message_stream(character_id, StartOrContinueChat(message="hi"), session, principal)
+        body = response.body_iterator
+        frames = [await body.__anext__() for _ in range(2)]
+        # Клиент отключился после первого куска
+        await body.aclose()
+        return frames
+
+    frames = client.portal.call(read_first_token)
+    assert [event for event, _ in _sse("".join(frames))] == ["dialog", "token"]
+    dialog_id = _dialogs(user_id)[0]
+    assert _messages(dialog_id) == [("system", "Ты — Боб."), ("user", "hi"), ("assistant", REPLY[0])]
+
+
+def test_history_cut_to_token_budget(client, db, make_user, make_character, model, monkeypatch):
+    monkeypatch.setitem(settings.MODEL_CONTEXT_TOKENS, "lite", 300)
+    monkeypatch.setattr(settings, "RESPONSE_RESERVE_TOKENS", 0)
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+
+    dialog = Dialog(user_id=user_id, character_id=character_id)
+    db.add(dialog)
+    db.commit()
+    base = datetime(2024, 1, 1)
+    history = [f"{i:02d} " + "x" * 60 for i in range(30)]
+    db.add(Message(dialog_id=dialog.id, role="system", content="Ты — Боб.", created_at=base))
+    db.add_all(
+        Message(dialog_id=dialog.id, role="user" if i % 2 == 0 else "assistant", content=text,
+                created_at=base + timedelta(seconds=i + 1))
+        for i, text in enumerate(history)
+    )
+    db.commit()
+
+    r = client.post(f"/dialogs/{character_id}/messages", json={"message": "hi", "dialog_id": dialog.id}, headers=headers)
+    assert r.status_code == 200, r.text
+    assert 0 < r.json()["context_tokens"] <= settings.context_budget("lite")
+
+    # В промпт попал только свежий хвост истории, по порядку и с новым сообщением
+    contents = [m.content for m in model.prompts[-1]]
+    sent = [c for c in contents if c in history]
+    assert 0 < len(sent) < len(history)
+    assert sent == history[-len(sent):]
+    assert "hi" in contents[-3:] and any("Ты — Боб." in c for c in contents)
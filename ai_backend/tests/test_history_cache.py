@@ -0,0 +1,49 @@
+# tests/test_history_cache.py
+"""
+Кеш истории (memory-бэкенд): поколения против гонки set с append и invalidate.
+"""
+from datetime import datetime
+
+import anyio
+
+from utils.history_cache import HistoryEntry, HistoryItem, MemoryHistoryCache
+
+
+def _item(id_: int) -> HistoryItem:
+    return HistoryItem(id=id_, role="user", content=f"m{id_}", created_at=datetime(2024, 1, 1, 0, 0, id_))
+
+
+def _entry(generation: int, *ids: int) -> HistoryEntry:
+    return HistoryEntry(pinned=[], summary=None, floor_id=0, items=[_item(i) for i in ids],
+                        complete=True, generation=generation)
+
+
+def test_set_does_not_overwrite_append():
+    async def scenario():
+        cache = MemoryHistoryCache(max_dialogs=10, max_messages=3)
+        await cache.set(1, _entry(await cache.generation(1), 1, 2))
+
+        # Сборка контекста взяла копию, а тем временем пришла новая реплика
+        snapshot = (await cache.get(1)).copy()
+        await cache.append(1, _item(3))
+        snapshot.items.insert(0, _item(0))
+        await cache.set(1, snapshot)
+        assert [x.id for x in (await cache.get(1)).items] == [1, 2, 3]
+
+        # Повтор и старая реплика не дописываются; лишнее обрезается
+        await cache.append(1, _item(3))
+        await cache.append(1, _item(4))
+        entry = await cache.get(1)
+        assert [x.id for x in entry.items] == [2, 3, 4] and not entry.complete
+
+        # Промах: set по поколению до append тоже не пишет
+        generation = await cache.generation(2)
+        await cache.append(2, _item(5))
+        await cache.set(2, _entry(generation))
+        assert await cache.get(2) is None
+
+        await cache.invalidate(1)
+        await cache.set(1, entry)
+        assert await cache.get(1) is None
+
+    anyio.run(scenario)
@@ -0,0 +1,75 @@
+# tests/test_http_cache.py
+"""
+Условные GET персонажей: ETag и 304.
+"""
+
+
+def test_character_etag(client, make_user, make_character):
+    owner_id, headers = make_user()
+    character_id = make_character(owner_id)
+    url = f"/characters/{character_id}"
+
+    r = client.get(url, headers=headers)
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+    assert r.headers["cache-control"] == "private, no-cache"
+
+    r = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["etag"] == etag and not r.content
+    assert client.get(url, headers={**headers, "If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+    # Last-Modified не отдаётся, If-Modified-Since без ETag не даёт 304
+    assert "last-modified" not in r.headers
+    r = client.get(url, headers={**headers, "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert r.status_code == 200
+
+    # Изменение персонажа меняет версию
+    client.patch(url, json={"bio": "new bio"}, headers=headers)
+    r = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert r.status_code == 200 and r.json()["bio"] == "new bio"
+    etag = r.headers["etag"]
+
+    # Свой голос меняет my_vote — и ETag
+    client.post(f"{url}/vote", json={"value": 1}, headers=headers)
+    r = client.get(url, headers={**headers, "If-None-Match": etag})
+    assert r.status_code == 200 and r.json()["my_vote"] == 1
+
+
+def test_private_character_not_revealed_by_304(client, make_user, make_character):
+    owner_id, headers = make_user()
+    character_id = make_character(owner_id, is_public=False)
+    etag = client.get(f"/characters/{character_id}", headers=headers).headers["etag"]
+
+    _, stranger = make_user()
+    r = client.get(f"/characters/{character_id}", headers={**stranger, "If-None-Match": etag})
+    assert r.status_code == 403
+
+
+def test_owner_list_etag(client, make_user, make_character):
+    owner_id, headers = make_user()
+    make_character(owner_id, name="A")
+    make_character(owner_id, name="B", is_public=False)
+    url = "/characters"
+
+    r = client.get(url, params={"mine": True}, headers=headers)
+    assert r.status_code == 200 and len(r.json()) == 2
+    etag = r.headers["etag"]
+    assert client.get(url, params={"mine": True}, headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    # Новый персонаж в выборке — новый ETag
+    make_character(owner_id, name="C")
+    r = client.get(url, params={"mine": True}, headers={**headers, "If-None-Match": etag})
+    assert r.status_code == 200 and len(r.json()) == 3
+
+    # Список по владельцу для анонима: без приватных и не в общем публичном кеше
+    r = client.get(url, params={"owner_id": owner_id})
+    assert sorted(c["name"] for c in r.json()) == ["A", "C"]
+    assert r.headers["cache-control"] == "private, no-cache"
+
+
+def test_public_list_etag(client):
+    r = client.get("/characters")
+    assert r.status_code == 200
+    assert r.headers["cache-control"].startswith("public, max-age=")
+    r = client.get("/characters", headers={"If-None-Match": r.headers["etag"]})
+    assert r.status_code == 304
@@ -0,0 +1,141 @@
+# tests/test_llm_resilience.py
+"""
+Автомат (circuit breaker), его работа внутри ResilientLLM и слот модели в astream.
+"""
+import time
+from contextlib import aclosing
+
+import anyio
+import httpx
+import pytest
+from fastapi import HTTPException
+from langchain_core.messages import AIMessage
+
+import utils.llm_resilience as resilience
+from config import settings
+from utils.llm_gateway import GatedLLM, ModelGate
+from utils.llm_resilience import CircuitBreaker, ResilientLLM
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker("test", failures=2, reset_after=0.05)
+    assert breaker.before_call()
+
+    # closed: одна ошибка ещё не размыкает, успех сбрасывает счёт
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+    assert breaker.before_call()
+
+    # N ошибок подряд -> open
+    breaker.on_failure()
+    assert not breaker.allows()
+    assert not breaker.before_call()
+
+    # reset_after -> half-open: ровно один пробный вызов
+    time.sleep(0.06)
+    assert breaker.allows()
+    assert breaker.before_call()
+    assert not breaker.before_call()
+
+    # Ошибка пробы снова размыкает
+    breaker.on_failure()
+    assert not breaker.before_call()
+
+    # Проба не состоялась (on_skip) — пробовать можно снова
+    time.sleep(0.06)
+    assert breaker.before_call()
+    breaker.on_skip()
+    assert breaker.before_call()
+
+    # Успех пробы замыкает
+    breaker.on_success()
+    assert breaker.before_call()
+    assert breaker.before_call()
+
+
+class FlakyModel:
+    def __init__(self):
+        self.calls = 0
+        self.fail = True
+
+    async def ainvoke(self, *args, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise httpx.ConnectError("connection refused")
+        return AIMessage(content="ok")
+
+
+@pytest.fixture
+def flaky(monkeypatch):
+    model = FlakyModel()
+    gated = GatedLLM(model, ModelGate("flaky", max_in_flight=2, max_queue=2, queue_timeout=1.0))
+    monkeypatch.setattr(resilience, "get_gated_llm", lambda model_id, temperature: gated)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "LLM_FALLBACKS", {})
+    monkeypatch.setattr(settings, "LLM_RETRIES", 0)
+    monkeypatch.setattr(settings, "LLM_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_RESET", 0.05)
+    return model
+
+
+def test_resilient_llm_opens_and_closes_breaker(flaky):
+    llm = ResilientLLM("flaky", 0.5)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            anyio.run(llm.ainvoke, "hi")
+        assert exc.value.status_code == 503
+    assert flaky.calls == 2
+
+    # Автомат разомкнут: модель даже не вызывается, admit отвечает 503 сразу
+    with pytest.raises(HTTPException):
+        anyio.run(llm.ainvoke, "hi")
+    assert flaky.calls == 2
+    with pytest.raises(HTTPException):
+        llm.admit()
+
+    # После паузы пробный вызов проходит и замыкает автомат
+    time.sleep(0.06)
+    flaky.fail = False
+    assert anyio.run(llm.ainvoke, "hi").content == "ok"
+    assert llm.served_by == "flaky"
+    assert resilience.get_breaker("flaky").before_call()
+
+
+class StreamingModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def astream(self, *args, **kwargs):
+        for text in self.chunks:
+            yield AIMessage(content=text)
+
+
+def test_astream_releases_slot_and_counts_empty_stream(monkeypatch):
+    gate = ModelGate("stream", max_in_flight=1, max_queue=0, queue_timeout=0.1)
+    gated = GatedLLM(StreamingModel(["a", "b", "c"]), gate)
+    monkeypatch.setattr(resilience, "get_gated_llm", lambda model_id, temperature: gated)
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(settings, "LLM_FALLBACKS", {})
+    llm = ResilientLLM("stream", 0.5)
+
+    async def first_chunk():
+        async with aclosing(llm.astream("hi")) as stream:
+            async for chunk in stream:
+                return chunk.content
+
+    async def read_all():
+        async with aclosing(llm.astream("hi")) as stream:
+            return [chunk.content async for chunk in stream]
+
+    # Потребитель остановился на первом куске — слот единственного места свободен
+    assert anyio.run(first_chunk) == "a"
+    assert not gate.saturated and anyio.run(read_all) == ["a", "b", "c"]
+
+    ok = resilience.LLM_ATTEMPTS.labels("stream", "ok")
+    before = ok._value.get()
+    gated.llm = StreamingModel([])
+    assert anyio.run(read_all) == []
+    assert ok._value.get() == before + 1
+    assert llm.served_by == "stream"
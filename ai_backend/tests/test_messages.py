@@ -0,0 +1,75 @@
+# tests/test_messages.py
+"""
+Keyset-пагинация истории сообщений диалога.
+"""
+from datetime import datetime, timedelta
+
+from models.dialog import Dialog
+from models.message import Message
+from utils.chat import MESSAGES_PAGE_LIMIT
+
+
+def _dialog_with_messages(db, user_id, character_id, count):
+    dialog = Dialog(user_id=user_id, character_id=character_id)
+    db.add(dialog)
+    db.commit()
+    # Одинаковое время у пар сообщений — порядок внутри пары решает id
+    base = datetime(2024, 1, 1)
+    db.add_all(
+        Message(dialog_id=dialog.id, role="user", content=f"m{i}", created_at=base + timedelta(seconds=i // 2))
+        for i in range(count)
+    )
+    db.commit()
+    return dialog.id
+
+
+def _contents(response):
+    return [m["content"] for m in response.json()]
+
+
+def test_messages_keyset_pages(client, db, make_user, make_character):
+    user_id, headers = make_user()
+    dialog_id = _dialog_with_messages(db, user_id, make_character(user_id), 7)
+    url = f"/dialogs/{dialog_id}/messages"
+
+    # Без курсоров — последние limit сообщений
+    r = client.get(url, params={"limit": 3}, headers=headers)
+    assert _contents(r) == ["m4", "m5", "m6"]
+    assert r.headers["x-has-more"] == "true"
+
+    # Прокрутка вверх до начала
+    seen = _contents(r)
+    while r.headers["x-has-more"] == "true":
+        r = client.get(url, params={"limit": 3, "before_id": r.json()[0]["id"]}, headers=headers)
+        seen = _contents(r) + seen
+    assert seen == [f"m{i}" for i in range(7)]
+
+    # Без limit — последняя страница по умолчанию (здесь вся история)
+    r = client.get(url, headers=headers)
+    everything = r.json()
+    assert [m["content"] for m in everything] == [f"m{i}" for i in range(7)]
+    assert r.headers["x-has-more"] == "false"
+
+    # Догрузка новых после известного
+    r = client.get(url, params={"limit": 3, "after_id": everything[1]["id"]}, headers=headers)
+    assert _contents(r) == ["m2", "m3", "m4"]
+    assert r.headers["x-has-more"] == "true"
+    r = client.get(url, params={"limit": 10, "after_id": everything[1]["id"]}, headers=headers)
+    assert _contents(r) == ["m2", "m3", "m4", "m5", "m6"]
+    assert r.headers["x-has-more"] == "false"
+
+
+def test_messages_of_foreign_dialog_hidden(client, db, make_user, make_character):
+    owner_id, _ = make_user()
+    _, stranger = make_user()
+    dialog_id = _dialog_with_messages(db, owner_id, make_character(owner_id), 2)
+    assert client.get(f"/dialogs/{dialog_id}/messages", headers=stranger).status_code == 404
+
+
+def test_messages_default_limit_bounded(client, db, make_user, make_character):
+    user_id, headers = make_user()
+    dialog_id = _dialog_with_messages(db, user_id, make_character(user_id), MESSAGES_PAGE_LIMIT + 3)
+
+    r = client.get(f"/dialogs/{dialog_id}/messages", headers=headers)
+    assert len(r.json()) == MESSAGES_PAGE_LIMIT and r.json()[-1]["content"] == f"m{MESSAGES_PAGE_LIMIT + 2}"
+    assert r.headers["x-has-more"] == "true"
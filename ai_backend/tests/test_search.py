@@ -0,0 +1,61 @@
+# tests/test_search.py
+"""
+Полнотекстовый поиск персонажей (SQLite FTS5): индекс при создании
+и изменении, префиксы, фильтры; проверка SEARCH_TS_CONFIG для Postgres.
+"""
+import uuid
+
+import pytest
+
+import utils.search as search
+from config import settings
+
+
+def _ids(client, q, **params):
+    r = client.get("/characters/search", params={"q": q, **params})
+    assert r.status_code == 200
+    return [c["id"] for c in r.json()]
+
+
+def _create(client, headers, **fields):
+    body = {"context": "ctx", "interests": ["music", "art"], **fields}
+    r = client.post("/characters", json=body, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+def test_search_indexes_created_and_updated(client, make_user):
+    _, headers = make_user()
+    word = "zq" + uuid.uuid4().hex[:8]
+    character_id = _create(client, headers, name=f"{word}name", bio="Старый пират")
+    private_id = _create(client, headers, name=f"{word}name", is_public=False)
+
+    # Префикс слова, регистр и слова из bio
+    assert _ids(client, word) == [character_id]
+    assert _ids(client, f"{word.upper()}NAME пират") == [character_id]
+    assert _ids(client, f"{word} пира", interests=["music"]) == [character_id]
+    assert _ids(client, word, interests=["chess"]) == []
+    assert private_id not in _ids(client, word)
+
+    # Изменение bio переиндексирует запись
+    client.patch(f"/characters/{character_id}", json={"bio": "Молодой капитан"}, headers=headers)
+    assert _ids(client, f"{word} пират") == []
+    assert _ids(client, f"{word} капитан") == [character_id]
+
+    # Кавычки и операторы FTS5 в запросе — просто слова
+    assert _ids(client, f'"{word}" OR NOT *') == []
+
+
+@pytest.mark.parametrize("name", ["simple", "russian", "pg_catalog_custom"])
+def test_ts_config_accepts_plain_names(monkeypatch, name):
+    monkeypatch.setattr(settings, "SEARCH_TS_CONFIG", name)
+    assert search._ts_config() == name
+
+
+@pytest.mark.parametrize("name", ["simple'); DROP TABLE character; --", "Russian", "simple\n", "pg_catalog.simple", ""])
+def test_ts_config_rejects_sql(monkeypatch, name):
+    monkeypatch.setattr(settings, "SEARCH_TS_CONFIG", name)
+    with pytest.raises(ValueError):
+        search._ts_config()
+    with pytest.raises(ValueError):
+        search._pg_document()
@@ -0,0 +1,74 @@
+# tests/test_summary.py
+"""
+Сводки длинных диалогов: проход захватывается в БД, чужой захват не трогаем.
+"""
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+
+from config import settings
+from conftest import ASSISTANT_REPLY
+from models.dialog import Dialog
+from models.dialog_summary import DialogSummary
+from models.message import Message
+from utils.db import engine
+from utils.summary import maybe_summarize_dialog
+
+
+def _long_dialog(db, user_id, character_id, count):
+    dialog = Dialog(user_id=user_id, character_id=character_id)
+    db.add(dialog)
+    db.commit()
+    db.add_all(
+        Message(dialog_id=dialog.id, role="user" if i % 2 == 0 else "assistant", content=f"m{i}")
+        for i in range(count)
+    )
+    db.commit()
+    return dialog.id
+
+
+def _summary(dialog_id):
+    with Session(engine) as session:
+        return session.exec(select(DialogSummary).where(DialogSummary.dialog_id == dialog_id)).first()
+
+
+def _message_ids(dialog_id):
+    with Session(engine) as session:
+        return session.exec(select(Message.id).where(Message.dialog_id == dialog_id).order_by(Message.id)).all()
+
+
+def test_summary_pass(client, db, make_user, make_character):
+    user_id, _ = make_user()
+    count = settings.SUMMARY_TRIGGER_MESSAGES + 5
+    dialog_id = _long_dialog(db, user_id, make_character(user_id), count)
+
+    client.portal.call(maybe_summarize_dialog, dialog_id)
+    summary = _summary(dialog_id)
+    assert summary.content == ASSISTANT_REPLY and summary.claimed_at is None
+    folded = count - settings.SUMMARY_KEEP_RECENT
+    assert summary.last_message_id == _message_ids(dialog_id)[folded - 1]
+    assert summary.summarized_count == folded
+
+    # Порог не набран — второй проход ничего не меняет
+    client.portal.call(maybe_summarize_dialog, dialog_id)
+    assert _summary(dialog_id).updated_at == summary.updated_at
+
+
+def test_summary_respects_foreign_claim(client, db, make_user, make_character):
+    user_id, _ = make_user()
+    dialog_id = _long_dialog(db, user_id, make_character(user_id), settings.SUMMARY_TRIGGER_MESSAGES)
+
+    # Диалог сворачивает другой воркер — этот модель не вызывает
+    db.add(DialogSummary(dialog_id=dialog_id, content="", last_message_id=0, claimed_at=datetime.utcnow()))
+    db.commit()
+    client.portal.call(maybe_summarize_dialog, dialog_id)
+    assert _summary(dialog_id).last_message_id == 0
+
+    # Брошенный захват (воркер упал) истекает
+    placeholder = _summary(dialog_id)
+    placeholder.claimed_at = datetime.utcnow() - timedelta(seconds=settings.SUMMARY_CLAIM_TTL + 1)
+    db.add(placeholder)
+    db.commit()
+    client.portal.call(maybe_summarize_dialog, dialog_id)
+    summary = _summary(dialog_id)
+    assert summary.content == ASSISTANT_REPLY and summary.claimed_at is None
@@ -0,0 +1,77 @@
+# tests/test_uploads.py
+"""
+Загрузка фото: имя по содержимому, лимиты, уменьшенные копии и thumb_url.
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from config import settings
+from utils.uploads import shutdown_thumbnail_pool
+
+
+def _png(color=(200, 10, 10), size=(800, 600)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def _upload(client, headers, data, name="photo.png"):
+    return client.post("/characters/upload/photo", files={"file": (name, data, "image/png")}, headers=headers)
+
+
+def test_upload_content_addressed(client, make_user):
+    _, headers = make_user()
+    data = _png()
+    url = _upload(client, headers, data, "x.exe").json()["photo_url"]
+    assert url.startswith(settings.UPLOAD_URL + "/") and url.endswith(".png")
+    # Тот же файл под другим именем — тот же URL
+    assert _upload(client, headers, data, "y.png").json()["photo_url"] == url
+    # Во временном каталоге ничего не остаётся
+    assert os.listdir(settings.UPLOAD_TMP_DIR) == []
+
+
+@pytest.mark.parametrize("data, status", [
+    (b"hello", 415),
+    (b"", 400),
+])
+def test_upload_rejected(client, make_user, data, status):
+    _, headers = make_user()
+    assert _upload(client, headers, data).status_code == status
+
+
+def test_upload_too_large(client, make_user, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 1000)
+    _, headers = make_user()
+    assert _upload(client, headers, b"\x89PNG\r\n\x1a\n" + b"0" * 2000).status_code == 413
+
+
+def test_upload_requires_auth(client):
+    assert _upload(client, {}, _png()).status_code in (401, 403)
+
+
+def test_thumb_url_for_absolute_photo_url(client, make_user):
+    owner_id, headers = make_user()
+    url = _upload(client, headers, _png((10, 200, 10))).json()["photo_url"]
+    shutdown_thumbnail_pool()  # дождаться уменьшенных копий
+
+    # Фронтенд сохраняет photo_url с адресом API
+    absolute = f"https://api.example.com{url}"
+    r = client.post("/characters", json={
+        "name": "Pic", "context": "ctx", "interests": ["a", "b"], "photo_url": absolute, "is_public": True,
+    }, headers=headers)
+    assert r.status_code == 200, r.text
+    character_id = r.json()["id"]
+
+    expected = url.rsplit(".", 1)[0] + f"_{settings.UPLOAD_CARD_THUMB_SIZE}.webp"
+    assert client.get(f"/characters/{character_id}", headers=headers).json()["thumb_url"] == expected
+    cards = client.get("/characters/catalog", params={"owner_id": owner_id}).json()["items"]
+    assert [c["thumb_url"] for c in cards] == [expected]
+
+    # Внешняя ссылка — без уменьшенной копии
+    r = client.post("/characters", json={
+        "name": "Ext", "context": "ctx", "interests": ["a", "b"], "photo_url": "https://cdn.example.com/a.png",
+    }, headers=headers)
+    assert r.json()["thumb_url"] is None
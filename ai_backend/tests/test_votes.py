@@ -0,0 +1,94 @@
+# tests/test_votes.py
+"""
+Голоса: атомарный upsert, буфер write-behind и сверка счётчиков.
+"""
+import anyio
+import pytest
+from sqlalchemy import Select, update
+from sqlmodel import Session
+
+from config import settings
+from models.character import Character
+from utils.db import engine
+from utils.votes import VOTE_ATTEMPTS, VoteConflict, VoteCounterBuffer, apply_vote, reconcile_vote_counters, record_vote
+
+
+def _counters(character_id):
+    with Session(engine) as session:
+        ch = session.get(Character, character_id)
+        return ch.likes_count, ch.dislikes_count
+
+
+def test_vote_upsert(client, make_user, make_character):
+    user_id, headers = make_user()
+    character_id = make_character(user_id)
+    url = f"/characters/{character_id}/vote"
+
+    steps = [(1, (1, 0), 1), (1, (1, 0), 1), (-1, (0, 1), -1), (0, (0, 0), None), (0, (0, 0), None)]
+    for value, counters, my_vote in steps:
+        out = client.post(url, json={"value": value}, headers=headers).json()
+        assert (out["likes_count"], out["dislikes_count"]) == counters
+        assert out["my_vote"] == my_vote
+        assert _counters(character_id) == counters
+
+    _, other = make_user()
+    client.post(url, json={"value": 1}, headers=headers)
+    client.post(url, json={"value": 1}, headers=other)
+    assert _counters(character_id) == (2, 0)
+
+
+def test_vote_retry_is_bounded(db, make_user, make_character, monkeypatch):
+    user_id, _ = make_user()
+    character_id = make_character(user_id)
+    assert apply_vote(db, character_id, user_id, 1) == (1, 0)
+
+    # Голос «удаляют» между INSERT и SELECT на каждой попытке
+    class Gone:
+        def first(self):
+            return None
+
+    real_exec = db.exec
+    selects = []
+
+    def exec_(statement, *args, **kwargs):
+        if isinstance(statement, Select):
+            selects.append(statement)
+            return Gone()
+        return real_exec(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db, "exec", exec_)
+    with pytest.raises(VoteConflict):
+        apply_vote(db, character_id, user_id, -1)
+    assert len(selects) == VOTE_ATTEMPTS
+    db.rollback()
+
+
+def test_write_behind_flush_and_reconcile(make_user, make_character, monkeypatch):
+    monkeypatch.setattr(settings, "VOTE_WRITE_BEHIND", True)
+    owner_id, _ = make_user()
+    character_id = make_character(owner_id)
+    voters = [make_user()[0] for _ in range(3)]
+    # Свой буфер: общий может сбросить фоновый цикл приложения в любой момент
+    buffer = VoteCounterBuffer()
+
+    with Session(engine) as session:
+        for user_id, value in [(voters[0], 1), (voters[1], 1), (voters[2], -1), (voters[2], 1)]:
+            record_vote(session, character_id, user_id, value)
+            session.commit()
+            for args in session.info.pop("vote_deltas"):
+                buffer.add(*args)
+
+    # Голоса уже в БД, счётчики — только в буфере (переголосование дало разницу)
+    assert _counters(character_id) == (0, 0)
+    assert buffer.pending(character_id) == (3, 0)
+    assert anyio.run(buffer.flush) == 1
+    assert buffer.pending(character_id) == (0, 0)
+    assert _counters(character_id) == (3, 0)
+
+    # Счётчики разошлись с CharacterVote — сверка исправляет их, совпавшие не трогает
+    with Session(engine) as session:
+        session.exec(update(Character).where(Character.id == character_id).values(likes_count=10))
+        session.commit()
+        assert reconcile_vote_counters(session, character_id) == 1
+        assert reconcile_vote_counters(session, character_id) == 0
+    assert _counters(character_id) == (3, 0)
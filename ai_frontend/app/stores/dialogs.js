@@ -1,8 +1,13 @@
 import { defineStore } from 'pinia'
 
+// Сообщений за один запрос истории
+const PAGE_SIZE = 50
+
 export const useDialogsStore = defineStore('dialogs', () => {
   const dialogs = ref([])
   const messages = ref({})
+  // Есть ли в диалоге сообщения раньше загруженных
+  const hasOlder = ref({})
   const dialogCharacter = ref({})
 
   const { $api } = useNuxtApp()
@@ -17,10 +22,49 @@ export const useDialogsStore = defineStore('dialogs', () => {
     return res
   }
 
+  // Страница истории: бэкенд отдаёт её по возрастанию времени, X-Has-More — есть ли ещё
+  async function fetchPage(dialogId, params = {}) {
+    const res = await $api.raw(`/dialogs/${dialogId}/messages`, { params: { limit: PAGE_SIZE, ...params } })
+    return { items: res._data || [], more: res.headers.get('X-Has-More') === 'true' }
+  }
+
+  // Последняя страница диалога (при открытии)
   async function fetchMessages(dialogId) {
-    const res = await $api(`/dialogs/${dialogId}/messages`)
-    messages.value[dialogId] = res || []
-    return res
+    const { items, more } = await fetchPage(dialogId)
+    messages.value[dialogId] = items
+    hasOlder.value[dialogId] = more
+    return items
+  }
+
+  // Предыдущая страница — при прокрутке вверх
+  async function fetchOlderMessages(dialogId) {
+    const list = messages.value[dialogId] || []
+    const first = list.find(m => m.id)
+    if (!first) return fetchMessages(dialogId)
+    const { items, more } = await fetchPage(dialogId, { before_id: first.id })
+    messages.value[dialogId] = [...items, ...(messages.value[dialogId] || [])]
+    hasOlder.value[dialogId] = more
+    return items
+  }
+
+  // Догрузка новых сообщений после последнего известного (с id)
+  async function syncMessages(dialogId) {
+    const list = messages.value[dialogId] || []
+    let last = list.length - 1
+    while (last >= 0 && !list[last].id) last--
+    if (last < 0) return fetchMessages(dialogId)
+    let after = list[last].id
+    let more = true
+    const fresh = []
+    while (more) {
+      const page = await fetchPage(dialogId, { after_id: after })
+      fresh.push(...page.items)
+      more = page.more && page.items.length > 0
+      if (page.items.length) after = page.items[page.items.length - 1].id
+    }
+    // Локальные черновики (без id) после последнего известного заменяем тем, что сохранил сервер
+    messages.value[dialogId] = [...list.slice(0, last + 1), ...fresh]
+    return fresh
   }
 
   async function ensureDialogCharacter(dialogId) {
@@ -71,11 +115,16 @@ export const useDialogsStore = defineStore('dialogs', () => {
       messages.value[newDialogId].push(
         typeof assistantMsg === 'string'
           ? { role: 'assistant', text: assistantMsg }
-          : { role: 'assistant', text: assistantMsg.text || assistantMsg.content || String(assistantMsg) }
+          : {
+              id: assistantMsg.id,
+              role: 'assistant',
+              text: assistantMsg.text || assistantMsg.content || String(assistantMsg),
+              created_at: assistantMsg.created_at
+            }
       )
     } else {
-      // 7) если ответ не пришёл в POST — подгружаем историю (это починит “видно только после обновления”)
-      await fetchMessages(newDialogId)
+      // 7) если ответ не пришёл в POST — догружаем новые сообщения (это починит “видно только после обновления”)
+      await syncMessages(newDialogId)
     }
 
     // 8) если это новый диалог — обновим список диалогов
@@ -84,5 +133,16 @@ export const useDialogsStore = defineStore('dialogs', () => {
     return newDialogId
   }
 
-  return { dialogs, messages, dialogCharacter, fetchDialogs, fetchMessages, ensureDialogCharacter, sendMessage }
+  return {
+    dialogs,
+    messages,
+    hasOlder,
+    dialogCharacter,
+    fetchDialogs,
+    fetchMessages,
+    fetchOlderMessages,
+    syncMessages,
+    ensureDialogCharacter,
+    sendMessage
+  }
 })
\ No newline at end of file